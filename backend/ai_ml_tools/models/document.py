@@ -1,11 +1,121 @@
-from ai_ml_tools.utils.document_inteligence import get_content
-from ai_ml_tools.utils.openai import request_openai_response
+from ai_ml_tools.utils.document_inteligence import get_content, estimate_tokens, COMPACT_KEY_LEGEND
+from ai_ml_tools.utils.openai import request_openai_response, request_openai_structured_response
+from ai_ml_tools.utils.tokenizer import count_tokens
 from fastapi import UploadFile
+from functools import partial
+from uuid import uuid4
+import asyncio
 import time
 import json
-import tiktoken
 import openai
 
+# Model used for analyzer requests (request_openai_response's default), determines the tokenizer used for size checks
+ANALYZER_MODEL = "gpt-4o-mini"
+
+# Number of simultaneous OpenAI requests and rate limit retries per request when headers are asked independently
+DEFAULT_MAX_CONCURRENCY = 8
+MAX_RATE_LIMIT_RETRIES = 3
+PROMPT_MODES = ("sequential", "independent", "batched")
+
+# Batched mode: token budget for the questions in one request (including room for each answer) and a cap on headers per request
+BATCH_TOKEN_BUDGET = 3000
+BATCH_TOKENS_PER_ANSWER = 150
+MAX_HEADERS_PER_BATCH = 20
+
+'''
+Read the 'Retry-After' header from an OpenAI rate limit error, defaults to 30 seconds.
+'''
+def _retry_after_seconds(error: openai.RateLimitError) -> int:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return int(float(headers.get('Retry-After', 30)))
+    except (TypeError, ValueError):
+        return 30
+
+'''
+Split a response into its answer and the text after 'Source:', the source is "N/A" when missing.
+'''
+def _split_source(response: str) -> tuple[str, str]:
+    parts = response.split('Source:', 1)
+    return parts[0].strip(), parts[1].strip() if len(parts) > 1 else "N/A"
+
+'''
+Run blocking OpenAI calls concurrently in threads, at most max_concurrency at a time. A rate limit on any call pauses
+all calls until its 'Retry-After' time has passed. Results are returned in the same order as calls.
+Parameters:
+    - calls (list): (label, function, args) tuples, label is only used for logging.
+'''
+async def _run_rate_limited(calls: list, max_concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    retry_at = 0.0
+
+    async def run(label, function, args):
+        nonlocal retry_at
+        async with semaphore:
+            for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+                wait = retry_at - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    return await asyncio.to_thread(function, *args)
+                except openai.RateLimitError as e:
+                    if attempt == MAX_RATE_LIMIT_RETRIES:
+                        raise
+                    retry_after = _retry_after_seconds(e)
+                    print(f'Rate limit exceeded on "{label}". Retrying after {retry_after} seconds.')
+                    retry_at = max(retry_at, time.monotonic() + retry_after + 1)
+                except Exception as e:
+                    print(f"An OpenAIError occurred: {e}")
+                    raise
+
+    return await asyncio.gather(*(run(label, function, args) for label, function, args in calls))
+
+'''
+Group headers so the prompts in each group stay under BATCH_TOKEN_BUDGET tokens and MAX_HEADERS_PER_BATCH headers.
+'''
+def _batch_headers(headers: list) -> list[list]:
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for header in headers:
+        prompt_tokens = count_tokens(header.prompt, ANALYZER_MODEL) + BATCH_TOKENS_PER_ANSWER
+        if batch and (batch_tokens + prompt_tokens > BATCH_TOKEN_BUDGET or len(batch) >= MAX_HEADERS_PER_BATCH):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(header)
+        batch_tokens += prompt_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+'''
+Build the (messages, schema_name, schema) arguments for a batch of headers. Each header is asked as question qN and
+answered in field qN of the JSON schema.
+'''
+def _batch_request(batch: list, system_message: dict) -> tuple:
+    questions = "\n".join(f"q{index + 1}: {header.prompt}" for index, header in enumerate(batch))
+    user_message = (
+        "Answer each of the following questions independently. Return a JSON object with one field per question id. "
+        "Put only the answer in \"answer\" and the source, using the source format from the specifications, in \"source\" "
+        "(\"N/A\" if the answer is NA).\n" + questions
+    )
+    answer_schema = {
+        "type": "object",
+        "properties": {"answer": {"type": "string"}, "source": {"type": "string"}},
+        "required": ["answer", "source"],
+        "additionalProperties": False,
+    }
+    schema = {
+        "type": "object",
+        "properties": {f"q{index + 1}": {**answer_schema, "description": header.name} for index, header in enumerate(batch)},
+        "required": [f"q{index + 1}" for index in range(len(batch))],
+        "additionalProperties": False,
+    }
+    messages = [system_message, {"role": "user", "content": user_message}]
+    return messages, "csv_answers", schema
+
 '''
 Class defining a document that is used by OpenAI. It contains the following properties: file_path, file_name, content, col_prompts, and openai_answers.
 There are also serveral functions defined in this class which are listed below.
@@ -15,9 +125,14 @@ class Document:
         # self._file_path = file_path
         self._file_name = file.filename
         self.token_threshold = token_threshold
+        self._is_json = False
         self._content = self._get_content(file)
         self._col_prompts = col_prompts
         self._openai_answers = {}
+        self._system_prompt = None
+        self._cached_tokens = 0
+        # Identifies this document's requests to the LLM scheduler so concurrent analyses share deployments fairly
+        self._session_id = f"analyzer-{uuid4().hex[:12]}"
     
     '''
     Read the content of a text document located at the specified path and return it as a string.
@@ -27,41 +142,71 @@ class Document:
       - doc_content (str): Content of the file as a string
     '''
     def _get_content(self, document) -> str:
-        # Use DI to get document content
-        refined_content = get_content(pdf=document, content=True, polygon=False, di_api="3.1")
+        # Use DI to get document content, compact JSON keeps more documents under the token threshold
+        refined_content = get_content(pdf=document, content=True, polygon=False, di_api="3.1", compact=True)
         
-        # If JSON data is too large, use string for raw content instead
-        encoding = tiktoken.get_encoding("cl100k_base")
-        num_tokens = len(encoding.encode(refined_content))
-        print('Using json data' if num_tokens < self.token_threshold else 'Using content string')
+        # If JSON data is too large, use string for raw content instead. Skip tokenizing when the estimate is far over the threshold.
+        if estimate_tokens(refined_content) > 2 * self.token_threshold:
+            num_tokens = None
+        else:
+            num_tokens = count_tokens(refined_content, ANALYZER_MODEL)
+        use_json = num_tokens is not None and num_tokens < self.token_threshold
+        print('Using json data' if use_json else 'Using content string')
 
-        if num_tokens < self.token_threshold:
+        if use_json:
+            self._is_json = True
             return refined_content
         else:
             data_object = json.loads(refined_content) 
             print(list(data_object.keys()))
-            num_tokens = len(encoding.encode(data_object["Content"]))
+            num_tokens = count_tokens(data_object["c"], ANALYZER_MODEL)
             if num_tokens > self.token_threshold:
                 raise Exception(f"Document is too long for OpenAI, at {num_tokens} tokens. Please shorten the document and try again.")
 
-            return data_object['Content']
+            self._is_json = False
+            return data_object["c"]
     
     '''
     Obtain responses from OpenAI based on conversation headers and return them in a dictionary.
+    Parameters:
+        - mode (str): "sequential" asks every header in one growing conversation, "independent" asks each header
+        with only the document context, and "batched" asks groups of headers in one structured output request per group.
+        Requests in "independent" and "batched" mode run concurrently.
+        - max_concurrency (int): Maximum number of simultaneous requests in "independent" and "batched" mode.
     Return Value:
         - _openai_answers (dict): A dictionary containing OpenAI responses, where header names serve as keys and 
         corresponding conversation responses as values. Each response is stored under the 'content' key of a 
         conversation item in a list. 
-    ''' # TODO: when models options are added, some models must be handled by combining prompts to reduce cost and time
-    def get_openai_responses(self) -> dict:
-        content = (
-            """ You are an AI assistant that reads in a document and answers user questions related to it. The document is provided here:
-        ---
-        DOCUMENT
-            """
-            + self._content
-            + """
-        ---
+    '''
+    async def get_openai_responses(self, mode="sequential", max_concurrency=DEFAULT_MAX_CONCURRENCY) -> dict:
+        system_message = {'role': "system", "content": self._get_system_prompt()}
+
+        if mode == "sequential":
+            responses, token_consumption = await asyncio.to_thread(self._get_sequential_responses, system_message)
+        elif mode == "independent":
+            responses, token_consumption = await self._get_independent_responses(system_message, max_concurrency)
+        elif mode == "batched":
+            answers, token_consumption = await self._get_batched_answers(system_message, max_concurrency)
+        else:
+            raise ValueError(f"{mode} is not a valid prompt mode.")
+        print('(Tokens consumed: {0}, cached: {1})\n'.format(token_consumption, self._cached_tokens))
+        
+        # Separate response and source
+        if mode != "batched":
+            answers = [_split_source(response) for response in responses]
+        for header, (answer, source) in zip(self.col_prompts, answers):
+            self._openai_answers[header.name] = (header.csv_prompt, answer, source)
+        return self._openai_answers, token_consumption
+
+    '''
+    Build the system prompt containing the answering rules and the document. The rules come first and the document last,
+    and the prompt is built once per document, so every request for this document starts with the same bytes and the
+    provider's prompt cache can serve the prefix.
+    '''
+    def _get_system_prompt(self) -> str:
+        if self._system_prompt is None:
+            self._system_prompt = (
+                """ You are an AI assistant that reads in a document and answers user questions related to it.
         SPECIFICATIONS
         Only use information found in the document to answer questions.
         If you cannot find the information being prompted to answer, respond with NA.
@@ -71,18 +216,31 @@ class Document:
         DO NOT output extra unnecessary words.
         IF an output structure is specified, follow that structure EXACTLY, your only limitation is that you can only provide the “A:” portion, not the “Q:” portion.
         At the end of each non N/A response add a source, format MUST be "Source: <The Document Title>, Page: <page number>, 
-        Paragraph Number: <paragraph number> (the ith entry in "Paragraphs": [] starting at 1, N/A if from Tables), 
-        Table Number: <table number> (the ith entry in "Paragraphs": [] starting at 1, N/A if from Paragraphs),
+        Paragraph Number: <paragraph number> (the ith entry in "p": [] starting at 1, N/A if from Tables), 
+        Table Number: <table number> (the ith entry in "t": [] starting at 1, N/A if from Paragraphs),
         Section Heading: <section heading>"
         If responce contains multiple sources COMBINE them into a single entry.
         DO NOT break any of the rules above.
+        The document is provided here:
+        ---
+        DOCUMENT
+            """
+                + (COMPACT_KEY_LEGEND + "\n" if self._is_json else "")
+                + self._content
+                + """
+        ---
         """
-        )
+            )
         # Alternative prompt method, critical for GPT4 instead of GPT4 turbo
         # There will be """ + str(len(self._col_prompts)) + """ user inputs and therefore """ + str(len(self._col_prompts)) + """ answers expected.
         # You will receive 7 or 8 tasks, in a single response, you will answer all these questions separated by 'A:'.
+        return self._system_prompt
 
-        conversation = [{'role': "system", "content": content}]
+    '''
+    Ask every header in a single conversation, each request includes all previous questions and answers.
+    '''
+    def _get_sequential_responses(self, system_message: dict) -> tuple[list, int]:
+        conversation = [system_message]
         responses = []
         token_consumption = 0
 
@@ -90,13 +248,13 @@ class Document:
             # Get response for current prompt
             response = None
             try:
-                response = request_openai_response(header.prompt, conversation)
+                response = request_openai_response(header.prompt, conversation, session_id=self._session_id)
             except openai.RateLimitError as e:  
                 # Extract the 'Retry-After' header value or use a default wait time  
-                retry_after = int(e.headers.get('Retry-After', 30))  
+                retry_after = _retry_after_seconds(e)  
                 print(f'Rate limit exceeded. Retrying after {retry_after} seconds.')  
                 time.sleep(retry_after+1)  # Wait an extra second incase error message rounded down to nearest second
-                response = request_openai_response(header.prompt, conversation) 
+                response = request_openai_response(header.prompt, conversation, session_id=self._session_id) 
             except Exception as e:  
                 print(f"An OpenAIError occurred: {e}")  
                 raise
@@ -105,15 +263,44 @@ class Document:
                 conversation = response[0]
                 responses.append(response[1])
                 token_consumption += int(response[2])
-        print('(Tokens consumed: {0})\n'.format(token_consumption))
-        
-        # Separate response and source
-        i = 0
-        for header in self.col_prompts:
-            parts = responses[i].split('Source:', 1)  
-            self._openai_answers[header.name] = (header.csv_prompt, parts[0].strip(), parts[1].strip() if len(parts) > 1 else "N/A")
-            i += 1
-        return self._openai_answers, token_consumption
+                self._cached_tokens += int(response[3])
+        return responses, token_consumption
+
+    '''
+    Ask every header independently with only the document context, running requests concurrently.
+    '''
+    async def _get_independent_responses(self, system_message: dict, max_concurrency: int) -> tuple[list, int]:
+        request = partial(request_openai_response, session_id=self._session_id)
+        calls = [(header.name, request, (header.prompt, [system_message])) for header in self._col_prompts]
+        results = await _run_rate_limited(calls, max_concurrency)
+        responses = [result[1] for result in results]
+        token_consumption = sum(int(result[2]) for result in results)
+        self._cached_tokens += sum(int(result[3]) for result in results)
+        return responses, token_consumption
+
+    '''
+    Ask headers in batches sized to BATCH_TOKEN_BUDGET, each batch is a single structured output request with one
+    field per header so the document context is only sent once per batch. Answers are returned in header order.
+    '''
+    async def _get_batched_answers(self, system_message: dict, max_concurrency: int) -> tuple[list, int]:
+        batches = _batch_headers(self._col_prompts)
+        request = partial(request_openai_structured_response, session_id=self._session_id)
+        calls = [
+            (f"batch {index + 1}/{len(batches)}", request, _batch_request(batch, system_message))
+            for index, batch in enumerate(batches)
+        ]
+        results = await _run_rate_limited(calls, max_concurrency)
+
+        answers = []
+        token_consumption = 0
+        for batch, (batch_answers, tokens, cached_tokens) in zip(batches, results):
+            token_consumption += int(tokens)
+            self._cached_tokens += int(cached_tokens)
+            for index, header in enumerate(batch):
+                field = batch_answers.get(f"q{index + 1}") or {}
+                answer, source = _split_source(field.get("answer") or "NA")
+                answers.append((answer, (field.get("source") or "").strip() or source))
+        return answers, token_consumption
 
     @property
     def col_prompts(self):
@@ -121,4 +308,8 @@ class Document:
 
     @property
     def file_name(self):
-        return self._file_name
\ No newline at end of file
+        return self._file_name
+
+    @property
+    def cached_tokens(self):
+        return self._cached_tokens
\ No newline at end of file
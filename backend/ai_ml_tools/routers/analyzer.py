@@ -1,7 +1,7 @@
 from fastapi import APIRouter, File, UploadFile, HTTPException
 from fastapi.responses import StreamingResponse, JSONResponse
 from ai_ml_tools.utils.file import extract_col_prompts
-from ai_ml_tools.models.document import Document
+from ai_ml_tools.models.document import Document, PROMPT_MODES
 import json
 import csv
 import io
@@ -10,8 +10,15 @@ router = APIRouter()
 
 # Takes in a PDF and CSV, and performs OpenAI analysis on the PDF using the prompts in the CSV. 
 # Output is the results in the from of a .json, .csv, or .txt depending on what outputType is set too
+# promptMode is "sequential" (one growing conversation), "independent" (each prompt asked concurrently with only the document),
+# or "batched" (prompts grouped into structured output requests so the document is sent once per group)
 @router.post("/openai_csv_analyze/")
-async def pdf_csv_analyzer(csv_file: UploadFile = File(...), pdf_file: UploadFile = File(...), outputType="json"):
+async def pdf_csv_analyzer(csv_file: UploadFile = File(...), pdf_file: UploadFile = File(...), outputType="json", promptMode="sequential"):
+    if promptMode not in PROMPT_MODES:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Invalid promptMode provided. Valid options are {', '.join(repr(mode) for mode in PROMPT_MODES)}."}
+        )
     try:
         print(f"Processing CSV file: {csv_file.filename}")
         print(f"Processing PDF file: {pdf_file.filename}")
@@ -26,9 +33,9 @@ async def pdf_csv_analyzer(csv_file: UploadFile = File(...), pdf_file: UploadFil
         doc = Document(pdf_file, header_list, token_threshold)
         
         # Get OpenAI responses
-        responses, tokens = doc.get_openai_responses()
+        responses, tokens = await doc.get_openai_responses(mode=promptMode)
         structured_data = convert_responces_to_json(responses)
-        print(f"Tokens used: {tokens}")
+        print(f"Tokens used: {tokens}, served from prompt cache: {doc.cached_tokens}")
 
         if outputType == "json":
             # Output resulting json file
@@ -1,13 +1,22 @@
-from fastapi import APIRouter, File, UploadFile, Form, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, File, UploadFile, Form, Body, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse, JSONResponse
 from ai_ml_tools.utils.document_inteligence import get_content, get_vectors
-from ai_ml_tools.utils.openai import request_openai_chat, get_relevent_chunks
-from ai_ml_tools.utils.file import add_page_numbers
+from ai_ml_tools.utils.openai import request_openai_chat, get_relevent_chunks, get_cached_chat_answer, replay_cached_chat, build_chat_messages
+from ai_ml_tools.utils.response_cache import fingerprint
+from ai_ml_tools.utils.tokenizer import count_messages_tokens
+from ai_ml_tools.utils.chat_history import compact_chat_history, DEFAULT_HISTORY_MODE
+from ai_ml_tools.utils.file import add_page_numbers, copy_upload
+from ai_ml_tools.utils.document_collections import create_document_collection, add_to_document_collection, delete_document_collection, get_relevent_collection_chunks, COLLECTION_MAX_CHUNKS
 from typing import List
+from uuid import uuid4
+import asyncio
 import json
 
 router = APIRouter()  
 
+# Response formats of the di_chunk routes, ndjson streams one line per document
+OUTPUT_FORMATS = ["json", "ndjson"]
+
 # Performs DI extraction on document so document can be processed with openAI
 @router.post("/di_extract_document/")
 async def pdf_to_json_string(file: UploadFile = File(...)):
@@ -30,7 +39,9 @@ async def llm_responce(websocket: WebSocket):
     try:
         data = await websocket.receive_json()  
         chat_history = data['chat_history']  
-        document_vectors = data['document_vectors']
+        # Either a stored collection (see /chatbot_collections/) or the chunks themselves
+        collection_id = data.get('collection_id')
+        document_vectors = data.get('document_vectors')
         model = data.get('model', 'gpt-4o-mini')  
         temperature = data.get('temperature', 0.3)  
         reasoning_effort = data.get('reasoning_effort', 'high') 
@@ -39,13 +50,35 @@ async def llm_responce(websocket: WebSocket):
         api_key = data.get('api_key', None)
         # User-supplied API key for non-default models; None for gpt-4o-mini
         api_key = data.get('api_key', None)
+        # Opt-in reuse of answers to the same (or a very similar) question about the same documents
+        use_cache = data.get('use_cache', False)
+        # How earlier turns are sent: "full", "window" (last turns within a token budget) or "summary" (older turns summarized)
+        history_mode = data.get('history_mode', DEFAULT_HISTORY_MODE)
+        # Optional retrieval settings, defaults come from the RETRIEVAL_* environment variables
+        retrieval_options = {option: data[key] for key, option in (('retrieval_k', 'k'), ('rerank', 'rerank'), ('context_tokens', 'context_tokens')) if data.get(key) is not None}
+        session_id = f"chat-{uuid4().hex[:12]}"
+
+        # Only the recent turns (and a summary of older ones) are sent, so each turn costs about the same
+        llm_history = await asyncio.to_thread(compact_chat_history, chat_history, model, history_mode, session_id=session_id)
 
-        document_chunks = document_vectors['text_chunks']
-        document_metadata = document_vectors['metadata']
-        
-        document_content = get_relevent_chunks(chat_history, document_chunks, document_metadata) 
+        if not use_cache:
+            cache_fingerprint = None
+        elif collection_id:
+            cache_fingerprint = fingerprint(collection_id)
+        else:
+            cache_fingerprint = fingerprint(document_vectors['text_chunks'], document_vectors['metadata'])
+        cached_answer = await asyncio.to_thread(get_cached_chat_answer, llm_history, model, cache_fingerprint) if use_cache else None
 
-        llm_stream = request_openai_chat(chat_history, document_content=document_content, model=model, temperature=temperature, reasoning_effort=reasoning_effort, token_remaining=token_limit, isAuth=isAuth, api_key=api_key)
+        if cached_answer is not None:
+            # A cache hit skips both the retrieval and the LLM call
+            llm_stream = replay_cached_chat(cached_answer, count_messages_tokens(build_chat_messages(llm_history, ""), model))
+        else:
+            if collection_id:
+                document_content = await asyncio.to_thread(get_relevent_collection_chunks, chat_history, collection_id, **retrieval_options)
+            else:
+                document_content = await asyncio.to_thread(get_relevent_chunks, chat_history, document_vectors['text_chunks'], document_vectors['metadata'], **retrieval_options)
+
+            llm_stream = request_openai_chat(llm_history, document_content=document_content, model=model, temperature=temperature, reasoning_effort=reasoning_effort, token_remaining=token_limit, isAuth=isAuth, api_key=api_key, session_id=session_id, cache_fingerprint=cache_fingerprint)
             
         # Simulate processing and responding with chunks  
         async for chunk in llm_stream:
@@ -58,41 +91,108 @@ async def llm_responce(websocket: WebSocket):
         await websocket.send_json({"error": str(e)})  
         await websocket.close() 
 
-# Performs DI extraction and divides documents into chunks of markdown, to be used for RAG. Only works for a single document.
-@router.post("/di_chunk_single_document/")
-async def pdf_to_chunks(file: UploadFile = File(...)):
+# Adds page numbers to a document, runs DI and chunks it. Returns the text chunks and their metadata.
+def _chunk_document(file: UploadFile):
+    paged_file = add_page_numbers(file)
+    return get_vectors(paged_file, file.filename)
+
+# Streams one NDJSON line per document as soon as it is chunked, then a final summary line.
+# Files must be copies (copy_upload), the request's uploads are closed before a streaming response is sent.
+# When collection_id is given each document's chunks are also embedded and stored in that collection.
+async def _stream_document_chunks(files: List[UploadFile], collection_id: str | None = None):
+    total_chunks = 0
+    for file in files:
+        try:
+            doc_chunks, doc_metadata = await asyncio.to_thread(_chunk_document, file)
+            if collection_id:
+                await asyncio.to_thread(add_to_document_collection, collection_id, doc_chunks, doc_metadata)
+            total_chunks += len(doc_chunks)
+            yield json.dumps({"document_name": file.filename, "text_chunks": doc_chunks, "metadata": doc_metadata}) + "\n"
+        except Exception as e:
+            yield json.dumps({"document_name": file.filename, "error": f"An error occurred: {str(e)}"}) + "\n"
+        finally:
+            file.file.close()
+    summary = {"done": True, "total_chunks": total_chunks}
+    if collection_id:
+        summary["collection_id"] = collection_id
+    yield json.dumps(summary) + "\n"
+
+# Stores chunks in a new collection and returns its id, expiry and chunk count. Raises ValueError over the chunk quota,
+# which is checked before the collection is created, and deletes the collection if storing the chunks fails.
+def _store_in_new_collection(text_chunks: list, metadata: list) -> dict:
+    if len(text_chunks) > COLLECTION_MAX_CHUNKS:
+        raise ValueError(f"Document collections are limited to {COLLECTION_MAX_CHUNKS} chunks.")
+    collection = create_document_collection()
     try:
-        paged_file = add_page_numbers(file)
-        doc_chunks, doc_metadata = get_vectors(paged_file, file.filename)
-        text_chunks = doc_chunks
-        metadata = doc_metadata
+        chunk_count = add_to_document_collection(collection["collection_id"], text_chunks, metadata)
+    except BaseException:
+        delete_document_collection(collection["collection_id"])
+        raise
+    return {**collection, "chunk_count": chunk_count}
+
+# Chunks the documents and returns them in one JSON response, stored in a new collection when store_collection is set
+async def _chunk_documents_response(files: List[UploadFile], store_collection: bool):
+    try:
+        text_chunks = []
+        metadata = []
+        for file in files:
+            doc_chunks, doc_metadata = await asyncio.to_thread(_chunk_document, file)
+            text_chunks.extend(doc_chunks)
+            metadata.extend(doc_metadata)
 
         print(f"Total number of chunks: {len(text_chunks)}")
         print(f"Metadata entries (must equal chunk number): {len(metadata)}")
-        return JSONResponse({"text_chunks": text_chunks, "metadata": metadata})
+        response = {"text_chunks": text_chunks, "metadata": metadata}
+        if store_collection:
+            try:
+                collection = await asyncio.to_thread(_store_in_new_collection, text_chunks, metadata)
+            except ValueError as e:
+                return JSONResponse(status_code=413, content={"error": str(e)})
+            collection.pop("chunk_count")
+            response.update(collection)
+        return JSONResponse(response)
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content={"error": f"An error occurred: {str(e)}"}
         )
+
+# Performs DI extraction and divides documents into chunks of markdown, to be used for RAG. Only works for a single document.
+# With outputFormat=ndjson the chunks are streamed as newline delimited JSON instead of returned in one response.
+# With storeCollection=true the chunks are also embedded and stored, and the returned collection_id can be used by /ws/chat_stream.
+@router.post("/di_chunk_single_document/")
+async def pdf_to_chunks(file: UploadFile = File(...), outputFormat: str = "json", storeCollection: bool = False):
+    return await pdf_to_chunks_multi([file], outputFormat, storeCollection)
     
 # Performs DI extraction and divides documents into chunks of markdown, to be used for RAG. Requires a set of documents.
+# With outputFormat=ndjson each document's chunks are streamed as soon as that document is processed.
 @router.post("/di_chunk_multi_document/")
-async def pdf_to_chunks(files: List[UploadFile] = File(...)):
-    try:
-        text_chunks = []
-        metadata = []
-        for file in files:
-            paged_file = add_page_numbers(file)
-            doc_chunks, doc_metadata = get_vectors(paged_file, file.filename)
-            text_chunks.extend(doc_chunks)
-            metadata.extend(doc_metadata)
+async def pdf_to_chunks_multi(files: List[UploadFile] = File(...), outputFormat: str = "json", storeCollection: bool = False):
+    if outputFormat not in OUTPUT_FORMATS:
+        return JSONResponse(status_code=400, content={"error": f"outputFormat must be one of: {OUTPUT_FORMATS}"})
+    if outputFormat == "ndjson":
+        collection_id = None
+        if storeCollection:
+            collection_id = (await asyncio.to_thread(create_document_collection))["collection_id"]
+        return StreamingResponse(_stream_document_chunks([copy_upload(file) for file in files], collection_id), media_type="application/x-ndjson")
+    return await _chunk_documents_response(files, storeCollection)
 
-        print(f"Total number of chunks: {len(text_chunks)}")
-        print(f"Metadata entries (must equal chunk number): {len(metadata)}")
-        return JSONResponse({"text_chunks": text_chunks, "metadata": metadata})
+# Stores already chunked documents (the text_chunks and metadata returned by the di_chunk routes) in a new collection
+@router.post("/chatbot_collections/")
+async def create_collection(document_vectors: dict = Body(...)):
+    try:
+        collection = await asyncio.to_thread(_store_in_new_collection, document_vectors['text_chunks'], document_vectors['metadata'])
+        return JSONResponse(collection)
+    except ValueError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content={"error": f"An error occurred: {str(e)}"}
-        )
\ No newline at end of file
+        )
+
+# Deletes a stored collection before it expires
+@router.delete("/chatbot_collections/{collection_id}")
+async def delete_collection(collection_id: str):
+    await asyncio.to_thread(delete_document_collection, collection_id)
+    return JSONResponse({"deleted": collection_id})
@@ -1,5 +1,5 @@
 # ------ Imports ------
-import os, uuid
+import os, uuid, asyncio
 from typing import List
 from fastapi import APIRouter, UploadFile, File, HTTPException
 from pydantic import BaseModel
@@ -11,6 +11,7 @@ from ai_ml_tools.utils.documentOcr.functions import (
     query_document,
     query_document_per_file,
 )
+from ai_ml_tools.utils.response_cache import fingerprint
 load_dotenv()
 router = APIRouter(prefix="/api", tags=["documentOcr"])
 
@@ -35,6 +36,8 @@ class ExtractPerDocRequest(BaseModel):
     # User-supplied API key for all models except gpt4omini.
     # Never stored or logged – used only within this request.
     api_key: str | None = None
+    # Reuse answers already extracted for the same fields, document and model
+    use_cache: bool = False
 
 class RowPerDoc(BaseModel):
     document: str
@@ -63,7 +66,9 @@ async def index_pdfs(files: List[UploadFile] = File(...)):
         if not documents:
             raise HTTPException(status_code=422, detail="No text extracted from PDFs.")
         vectorstore_id = f"collection_{uuid.uuid4().hex[:12]}"
-        create_vectorstore_from_multiple_documents(
+        # Run in a worker thread, the embedding service blocks until the embeddings are done
+        await asyncio.to_thread(
+            create_vectorstore_from_multiple_documents,
             documents=documents,
             api_key=None,
             collection_name=vectorstore_id,
@@ -104,7 +109,9 @@ async def extract_per_file(req: ExtractPerDocRequest):
         model_type = req.model_type or FREE_MODEL
         print(f"[PDF Extraction] Using model: {model_type}")
 
-        per_doc = query_document_per_file(
+        # Run in a worker thread, the LLM scheduler may block while waiting for budget
+        per_doc = await asyncio.to_thread(
+            query_document_per_file,
             vectorstore=vectorstore,
             fields_list=req.fields,
             document_names=req.document_names,
@@ -112,6 +119,7 @@ async def extract_per_file(req: ExtractPerDocRequest):
             # For all other models the user-supplied key is forwarded.
             api_key=req.api_key or None,
             model_type=model_type,
+            cache_fingerprint=fingerprint(req.vectorstore_id) if req.use_cache else None,
         )
 
         rows: List[RowPerDoc] = []
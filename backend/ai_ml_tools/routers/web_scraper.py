@@ -1,29 +1,29 @@
 # Imports
 from fastapi import APIRouter, Query
-from fastapi.responses import PlainTextResponse, JSONResponse
+from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, List
-import uuid, json, re, os, hashlib, threading, time, logging
-from ai_ml_tools.utils.webScraper.scrape import scrape_website, split_dom_content
+from typing import Callable, Dict, Iterable
+import uuid, json, re, os, hashlib, threading, time, logging, asyncio, itertools
+from ai_ml_tools.utils.webScraper.scrape import scrape_website, chunk_pages, ScrapeCancelled
+from ai_ml_tools.utils.webScraper.jobs import get_scrape_jobs, ScrapeJob, ScrapeJobFailed
+from ai_ml_tools.utils.webScraper.sessions import ScrapeSessionStore
 from ai_ml_tools.utils.webScraper.parse import parse_with_azure_llm
-from langchain_openai import AzureOpenAIEmbeddings
 import chromadb, logging
 from langchain_chroma import Chroma
 from chromadb.config import Settings
 from datetime import datetime, timezone
 from urllib.parse import urlparse, urljoin, urldefrag
-from ai_ml_tools.utils.openai import request_openai_chat
+from ai_ml_tools.utils.openai import request_openai_chat, get_cached_chat_answer, replay_cached_chat
+from ai_ml_tools.utils.response_cache import fingerprint
+from ai_ml_tools.utils.tokenizer import count_messages_tokens
 from fastapi import WebSocket, WebSocketDisconnect
 from datetime import datetime, timezone, timedelta
-from openai import RateLimitError
-from ai_ml_tools.utils.azure_key_vault import get_OPENAI_API_KEY
+from ai_ml_tools.utils.embedding_service import get_embedding_service, ServiceEmbeddings
 from functools import lru_cache
 
 router = APIRouter(prefix="/api", tags=["web-scraper"])
 
-_memory: Dict[str, List[str]] = {}
-_combined_text: Dict[str, str] = {}
-_session_url: Dict[str, str] = {}
+_sessions = ScrapeSessionStore()
 _url_locks: Dict[str, threading.Lock] = {}
 _url_locks_guard = threading.Lock()
 _preset_index = {}
@@ -32,6 +32,9 @@ _index_lock = threading.Lock()
 
 PERSIST_DIR = "/home/chroma_store"
 COLLECTION  = "web_chunks_v6"
+UPSERT_GROUP_SIZE = 512  # chunks embedded per call to the embedding service and upserted together
+SCRAPE_JOB_PROGRESS_INTERVAL = 0.5  # seconds between checks for scrape job progress on the websocket
+SCRAPE_JOB_HEARTBEAT = 20  # seconds after which progress is sent again even if unchanged (nginx drops idle sockets after 60s)
 
 os.environ.setdefault("CHROMA_TELEMETRY_ENABLED", "false")
 os.environ.setdefault("ANONYMIZED_TELEMETRY", "false")
@@ -66,17 +69,17 @@ def _invalidate_caches():
 class ScrapeReq(BaseModel):
     url: str
     force: bool = False
+    incremental: bool = True  # on a forced re-scrape, skip unchanged pages and reuse stored embeddings
 
 # Functions
 @lru_cache(maxsize=1)
 def _build_embeddings():
-    '''Creates and returns an AzureOpenAIEmbeddings client configured from environment variables.'''
-    return AzureOpenAIEmbeddings(
-        api_key=get_OPENAI_API_KEY(),
-        azure_endpoint=os.getenv("OPENAI_API_ENDPOINT"),
+    '''Returns the embeddings for the large embedding deployment, backed by the shared embedding service.'''
+    return ServiceEmbeddings(get_embedding_service(
+        os.getenv("AZURE_OPENAI_LARGE_EMBED_DEPLOYMENT"),
+        endpoint=os.getenv("OPENAI_API_ENDPOINT"),
         api_version=os.getenv("OPENAI_API_EMBEDDING_VERSION", "2023-05-15"),
-        azure_deployment=os.getenv("AZURE_OPENAI_LARGE_EMBED_DEPLOYMENT"),
-    )
+    ))
 
 # get or create the vector database store
 """ def _get_or_create_vs(emb):
@@ -108,90 +111,111 @@ def _get_collection():
     client = _get_chroma_client()
     return client.get_or_create_collection(name=COLLECTION)
 
-def _embed_with_retry(emb, texts: list[str], max_retries: int = 3, base_delay: int = 20):
-    """
-    Try to embed `texts`, retrying on Azure OpenAI rate limits.
+# insert chunks into the vector store 
+def upsert_chunks_into_vector_db(
+    chunks: Iterable[dict],
+    source_url: str,
+    site_meta: dict | None = None,
+    progress: Callable[[int], None] | None = None,
+    cancel_event: threading.Event | None = None,
+) -> tuple[int, int]:
     """
-    for attempt in range(max_retries):
-        try:
-            return emb.embed_documents(texts)
-        except RateLimitError as e:
-            wait = base_delay * (attempt + 1)
-            logging.warning(
-                f"[EMBED] Rate limit hit (attempt {attempt+1}/{max_retries}); "
-                f"sleeping {wait}s. Error: {e}"
-            )
-            time.sleep(wait)
-        except Exception as e:
-            logging.error(f"[EMBED] Unexpected embedding error: {e}")
-            raise
+    Embeds the given page chunks (see chunk_pages), attaches metadata, and upserts them into
+    the Chroma vector database. Each chunk keeps the URL, depth and title of its page.
 
-    # If we get here, all retries failed because of rate limits
-    logging.error("[EMBED] Giving up on this batch after repeated rate limits.")
-    return None
+    chunks may be a generator: it is consumed UPSERT_GROUP_SIZE chunks at a time, so a site is chunked, embedded and
+    stored incrementally without holding all of its chunks.
 
-# insert chunks into the vector store 
-def upsert_chunks_into_vector_db(chunks: list[str], source_url: str, site_meta: dict | None = None) -> int:
-    """
-    Embeds the given text chunks, attaches metadata, and upserts them into
-    the Chroma vector database.
-
-    IMPORTANT:
-    - Batches chunks to avoid slamming rate limits.
-    - Retries on RateLimitError with exponential-ish backoff.
-    - If rate limit persists, stops embedding further batches but DOES NOT crash.
-    - Returns the number of chunks that were actually embedded.
+    Chunk ids are derived from the chunk text (its sha256, plus the occurrence number for repeated text), so when a site
+    is re-scraped the chunks that are already stored with the same text only get their metadata updated and keep their
+    vector. Only new or changed chunks are embedded, and chunks of the site that are no longer produced are deleted.
+
+    Each group is embedded by the shared embedding service, which batches it by tokens, runs batches concurrently and
+    waits out rate limits without blocking, and upserted once embedded, so if the service still fails (rate limits past
+    its retries) the chunks stored so far are kept and the error is logged.
+    progress is called with the number of chunks stored after each group, and setting cancel_event stops before the
+    next group. Returns (stored, reused): the number of chunks stored and how many of them reused an existing vector.
     """
-    if not chunks:
-        return 0
     emb = _build_embeddings()
     vs  = _get_or_create_vs(emb)
     site_meta = site_meta or {}
 
     base = hashlib.sha1(source_url.encode("utf-8")).hexdigest()[:12]
     now  = datetime.now(timezone.utc).isoformat()
-    ids = [f"{base}-{i}" for i in range(len(chunks))]
     default_favicon = _host_favicon(source_url)
-    metas = [{
-        "source": source_url,
-        "chunk_index": i,
-        "doc_id": base,
-        "scraped_at": now,
-        "site_title": (site_meta.get("site_title") or ""),
-        "site_description":(site_meta.get("site_description") or ""),
-        "favicon": (site_meta.get("favicon") or default_favicon),
-        "duration_seconds": site_meta.get("duration_seconds"),
-    } for i in range(len(chunks))]
-
-    # batch + retry logic if rate limit is encountered
-    batch_size = 32
-    embedded = 0
-
-    for start in range(0, len(chunks), batch_size):
-        batch_chunks = chunks[start:start + batch_size]
-        batch_ids = ids[start:start + batch_size]
-        batch_metas = metas[start:start + batch_size]
-
-        vectors = _embed_with_retry(emb, batch_chunks)
-
-        if vectors is None:
-            # Stop embedding more, but don't crash the whole request.
-            logging.error(
-                f"[EMBED] Stopping further upserts for {source_url} "
-                f"after repeated rate limits. Embedded so far: {embedded} chunks."
-            )
+    existing_ids = set(vs._collection.get(where={"source": {"$eq": source_url}}, include=[]).get("ids") or [])
+
+    occurrences: Dict[str, int] = {}
+    stored_ids = set()
+    stored = reused = 0
+    complete = True
+    chunks = iter(chunks)
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            print(f"[EMBED] Cancelled for {source_url}, stored {stored} chunks.")
+            complete = False
+            break
+        group = list(itertools.islice(chunks, UPSERT_GROUP_SIZE))
+        if not group:
             break
 
-        # Normal upsert
-        vs._collection.upsert(
-            ids=batch_ids,
-            documents=batch_chunks,
-            embeddings=vectors,
-            metadatas=batch_metas,
-        )
-        embedded += len(batch_chunks)
+        texts = [chunk["text"] for chunk in group]
+        ids, metas = [], []
+        for offset, (chunk, text) in enumerate(zip(group, texts)):
+            content_hash = hashlib.sha256(text.encode("utf-8", "ignore")).hexdigest()
+            occurrence = occurrences.get(content_hash, 0)
+            occurrences[content_hash] = occurrence + 1
+            ids.append(f"{base}-{content_hash[:16]}-{occurrence}")
+            metas.append({
+                "source": source_url,
+                "chunk_index": stored + offset,
+                "doc_id": base,
+                "content_hash": content_hash,
+                "page_url": chunk.get("url") or source_url,
+                "page_depth": chunk.get("depth", 0),
+                "page_title": chunk.get("title") or "",
+                "scraped_at": now,
+                "site_title": (site_meta.get("site_title") or ""),
+                "site_description":(site_meta.get("site_description") or ""),
+                "favicon": (site_meta.get("favicon") or default_favicon),
+                "duration_seconds": site_meta.get("duration_seconds"),
+            })
+
+        known = [i for i in range(len(group)) if ids[i] in existing_ids]
+        missing = [i for i in range(len(group)) if ids[i] not in existing_ids]
+        if missing:
+            try:
+                vectors = emb.embed_documents([texts[i] for i in missing])
+            except Exception as e:
+                logging.error(
+                    f"[EMBED] Embedding failed for {source_url}: {e}. "
+                    f"Stored {stored} chunks before the failure."
+                )
+                complete = False
+                break
+            vs._collection.upsert(
+                ids=[ids[i] for i in missing],
+                documents=[texts[i] for i in missing],
+                embeddings=vectors,
+                metadatas=[metas[i] for i in missing],
+            )
+        if known:
+            # Same text as the stored chunk, so its document and vector are kept as they are
+            vs._collection.update(ids=[ids[i] for i in known], metadatas=[metas[i] for i in known])
+        stored_ids.update(ids)
+        stored += len(group)
+        reused += len(known)
+        if progress is not None:
+            progress(stored)
+
+    # Only drop the chunks that are no longer produced once the new set is complete, a failed run keeps the old ones
+    stale = list(existing_ids - stored_ids) if complete and stored else []
+    for start in range(0, len(stale), UPSERT_GROUP_SIZE):
+        vs._collection.delete(ids=stale[start:start + UPSERT_GROUP_SIZE])
+    if existing_ids:
+        print(f"[EMBED] {source_url}: {reused} of {stored} chunks unchanged, {stored - reused} embedded, {len(stale)} removed.")
 
-    return embedded
+    return stored, reused
 
 
 def _load_ordered_vectors(url: str) -> tuple[list[str], list[dict]]:
@@ -212,13 +236,24 @@ def _load_ordered_vectors(url: str) -> tuple[list[str], list[dict]]:
     order = sorted(range(len(docs)), key=lambda i: (metas[i] or {}).get("chunk_index", i))
     return [docs[i] for i in order], [metas[i] for i in order]
 
-def _load_website_blob(url: str, cap: int = 200_000) -> str:
-    """Join ordered chunks into a single capped string for prompting."""
+def _load_website_blob(url: str, cap: int | None = 200_000) -> str:
+    """Join ordered chunks into a single capped string for prompting (cap=None for all of it)."""
     docs, _ = _load_ordered_vectors(url)
     return ("\n\n".join(docs))[:cap]
 
-def _retrieve_relevant(url: str, query: str, k: int = 6, char_cap: int = 20000) -> str:
-    """ Normalize URL, check for candidates and conduct similarity search between the query vector and chromadb vectors"""
+def _cite_chunk(doc) -> str:
+    """Chunk text headed by the page it comes from, so answers can cite the page (older chunks have no page)."""
+    meta = doc.metadata or {}
+    if not meta.get("page_url"):
+        return doc.page_content
+    title = f'{meta["page_title"]} - ' if meta.get("page_title") else ""
+    return f'[Page: {title}{meta["page_url"]}]\n{doc.page_content}'
+
+def _retrieve_relevant(url: str, query: str, k: int = 6, char_cap: int = 20000, page_url: str | None = None) -> str:
+    """
+    Normalize URL, check for candidates and conduct similarity search between the query vector and chromadb vectors.
+    With page_url only the chunks of that page of the site are searched.
+    """
     emb = _build_embeddings()
     vs  = _get_or_create_vs(emb)
 
@@ -233,9 +268,10 @@ def _retrieve_relevant(url: str, query: str, k: int = 6, char_cap: int = 20000)
         candidates.append(url + "/")
 
     for u in candidates:
-        docs = vs.similarity_search(query, k=k, filter={"source": u})
+        where = {"$and": [{"source": u}, {"page_url": page_url}]} if page_url else {"source": u}
+        docs = vs.similarity_search(query, k=k, filter=where)
         if docs:
-            text = "\n\n".join(d.page_content for d in docs)
+            text = "\n\n".join(_cite_chunk(d) for d in docs)
             return text[:char_cap]
     logging.warning("[WS] No docs for url=%r. Tried: %r", url, candidates)
     return ""
@@ -419,7 +455,8 @@ def _ensure_site_description(site_meta: dict, url: str, text: str) -> dict:
         if sample.strip():
             desc = parse_with_azure_llm(
                 [sample],
-                "Write a 1–2 sentence description of what this website is about."
+                "Write a 1–2 sentence description of what this website is about.",
+                session_id=f"scrape-{url}",
             ).strip()
     except Exception as e:
         logging.warning(f"[DESC] Could not generate description for {url}: {e}")
@@ -547,10 +584,95 @@ def _build_preset_indexes():
 
 # ----- POST Requests -----
 
+def _run_scrape_job(job: ScrapeJob, req: ScrapeReq) -> dict:
+    '''Body of a scrape job: crawls the site, embeds and stores its chunks, and returns the result of the scrape.'''
+    # Ensure only ONE scrape for this URL runs at a time
+    lock = _get_url_lock(req.url)
+    with lock:
+        start_time = datetime.now(timezone.utc)
+        cached = _url_cached(req.url)
+
+        job.start_phase("crawling")
+        try:
+            data = scrape_website(
+                req.url,
+                incremental=bool(cached) and req.incremental,
+                progress=lambda crawled, queued: job.update(pages_crawled=crawled, pages_queued=queued),
+                cancel_event=job.cancel_event,
+            )
+        except ScrapeCancelled:
+            raise
+        except Exception as e:
+            raise ScrapeJobFailed(
+                "unreachable",
+                "We couldn't reach that website (it may be down, invalid, or returned 4xx/5xx).",
+                str(e),
+            )
+
+        # Crawled pages are spooled on disk, they are read back one at a time for the description, chunks and text
+        pages = data["pages"]
+        try:
+            site_meta = data.get("site_meta") or {
+                "site_title": "", "site_description": "", "favicon": _host_favicon(req.url)
+            }
+            site_meta = _ensure_site_description(site_meta, req.url, pages.text_sample(12000))
+
+            end_time = datetime.now(timezone.utc)
+            duration_sec = (end_time - start_time).total_seconds()
+            site_meta["duration_seconds"] = duration_sec
+            job.start_phase("embedding")
+            job.update(pages_crawled=len(pages))
+
+            # only the number of chunks is kept, their text goes to Chroma and the combined text to the session file
+            chunk_count = 0
+            def _chunks():
+                nonlocal chunk_count
+                for count, page in enumerate(pages.iter_pages(), start=1):
+                    for chunk in chunk_pages([page]):
+                        chunk_count += 1
+                        yield chunk
+                    job.update(pages_chunked=count, chunks_total=chunk_count)
+
+            added, reused = upsert_chunks_into_vector_db(
+                _chunks(), req.url, site_meta=site_meta,
+                progress=lambda stored: job.update(chunks_embedded=stored),
+                cancel_event=job.cancel_event,
+            )
+            _update_preset_indexes_for_url(req.url, site_meta, duration_sec, added)
+            _invalidate_caches()
+            if job.cancel_event.is_set():
+                raise ScrapeCancelled(f"Scrape of {req.url} was cancelled after {added} chunks")
+
+            session_id = str(uuid.uuid4())
+            _sessions.put(session_id, req.url, pages.iter_text())
+        finally:
+            pages.close()
+
+        response = {
+            "status": "ok",
+            "session_id": session_id,
+            "chunk_count": chunk_count,
+            "embedded_count": added,
+            "reused_embeddings": reused,
+            "unchanged_pages": data.get("unchanged_pages", 0),
+            "cache_hit": bool(cached),
+            "url": req.url,
+            "site_meta": site_meta,
+            "duration_seconds": duration_sec,
+            "scraped_at": end_time.isoformat(),
+        }
+        if added < chunk_count:
+            response["warning"] = f"Only {added} of {chunk_count} chunks could be embedded, try the scrape again later."
+        return response
+
 # Scrape POST request
 @router.post("/scrape")
 def api_scrape(req: ScrapeReq):
-    '''Scrapes a URL (or uses cached data), stores chunks in memory, upserts them to Chroma, and returns a session_id.'''
+    '''
+    Hands back a session over cached data, or starts a background scrape job (crawl, then embed into Chroma) and returns
+    its job_id right away. Follow the job on /ws/scrape_jobs/{job_id} or GET /scrape/jobs/{job_id}, the session_id is
+    in the finished job's result.
+    '''
 
     # Reject bad URLs
     if not _valid_http_url(req.url):
@@ -563,114 +685,113 @@ def api_scrape(req: ScrapeReq):
             }
         )
 
-    # Ensure only ONE scrape for this URL runs at a time
-    lock = _get_url_lock(req.url)
-    with lock:
-        start_time = datetime.now(timezone.utc)
-        cached = _url_cached(req.url)
-
-        # Monhtly cool-down (block rescrape if < 30days since last scrape)
-        if req.force:
-            last = _last_scraped_at(req.url)
-            if last:
-                now = datetime.now(timezone.utc)
-                next_allowed = last + timedelta(days=30)
-                if now < next_allowed:
-                    retry_after = int((next_allowed - now).total_seconds())
-                    return JSONResponse(
-                        status_code=429,
-                        content={
-                            "status": "cooldown",
-                            "message": "Re-scrape blocked by 30-day cooldown.",
-                            "url": req.url,
-                            "last_scraped_at": last.isoformat(),
-                            "next_allowed_at": next_allowed.isoformat(),
-                        },
-                        headers={"Retry-After": str(retry_after)},
-                    )
-
-        # If already cached and not forcing, just hand back a new session over cached data
-        if cached and not req.force:
-            session_id = str(uuid.uuid4())
-            _session_url[session_id] = req.url
-            _memory[session_id] = []
-            _combined_text[session_id] = ""
-            end_time = datetime.now(timezone.utc)
-            duration_sec = (end_time - start_time).total_seconds()
-            last_dur = _get_last_duration(req.url)
-            return {
-                "status": "ok",
-                "session_id": session_id,
-                "chunk_count": 0,
-                "embedded_count": 0,
-                "cache_hit": True,
-                "url": req.url,
-                "duration_seconds": duration_sec,
-                "last_scrape_duration": last_dur,
-            }
-
-        # Otherwise, actually scrape
-        try:
-            data = scrape_website(req.url)
-        except Exception as e:
-            return JSONResponse(
-                status_code=502,  # bad gateway: upstream site or network failed
-                content={
-                    "status": "error",
-                    "reason": "unreachable",
-                    "message": "We couldn't reach that website (it may be down, invalid, or returned 4xx/5xx).",
-                    "detail": str(e),
-                }
-            )
-
-        text = data.get("combined_text", "") or ""
-        chunks = split_dom_content(text)
-        site_meta = data.get("site_meta") or {
-            "site_title": "", "site_description": "", "favicon": _host_favicon(req.url)
-        }
-        site_meta = _ensure_site_description(site_meta, req.url, text)
+    start_time = datetime.now(timezone.utc)
+    cached = _url_cached(req.url)
+
+    # Monhtly cool-down (block rescrape if < 30days since last scrape)
+    if req.force:
+        last = _last_scraped_at(req.url)
+        if last:
+            now = datetime.now(timezone.utc)
+            next_allowed = last + timedelta(days=30)
+            if now < next_allowed:
+                retry_after = int((next_allowed - now).total_seconds())
+                return JSONResponse(
+                    status_code=429,
+                    content={
+                        "status": "cooldown",
+                        "message": "Re-scrape blocked by 30-day cooldown.",
+                        "url": req.url,
+                        "last_scraped_at": last.isoformat(),
+                        "next_allowed_at": next_allowed.isoformat(),
+                    },
+                    headers={"Retry-After": str(retry_after)},
+                )
 
+    # If already cached and not forcing, just hand back a new session over cached data
+    if cached and not req.force:
         session_id = str(uuid.uuid4())
-        _session_url[session_id] = req.url
-        _memory[session_id] = chunks
-        _combined_text[session_id] = text
-
+        _sessions.put(session_id, req.url)
         end_time = datetime.now(timezone.utc)
         duration_sec = (end_time - start_time).total_seconds()
-        site_meta["duration_seconds"] = duration_sec
-        added = upsert_chunks_into_vector_db(chunks, req.url, site_meta=site_meta)
-        _update_preset_indexes_for_url(req.url, site_meta, duration_sec, added)
-        _invalidate_caches()
-
+        last_dur = _get_last_duration(req.url)
         return {
             "status": "ok",
             "session_id": session_id,
-            "chunk_count": len(chunks),
-            "embedded_count": added,
-            "cache_hit": bool(cached),
+            "chunk_count": 0,
+            "embedded_count": 0,
+            "cache_hit": True,
             "url": req.url,
-            "site_meta": site_meta,
             "duration_seconds": duration_sec,
-            "scraped_at": end_time.isoformat(),
+            "last_scrape_duration": last_dur,
         }
 
+    # Otherwise, scrape in the background (a scrape of the same URL already queued or running is reused)
+    job, created = get_scrape_jobs().submit(req.url, lambda job: _run_scrape_job(job, req))
+    return JSONResponse(
+        status_code=202,
+        content={
+            **job.snapshot(),
+            "created": created,
+            "last_scrape_duration": _get_last_duration(req.url) if cached else None,
+        },
+    )
+
+# Cancel a scrape job
+@router.delete("/scrape/jobs/{job_id}")
+def api_cancel_scrape_job(job_id: str):
+    '''Cancels a queued or running scrape job. Chunks already stored by a cancelled job are kept.'''
+    job = get_scrape_jobs().cancel(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": "Unknown scrape job."})
+    return job.snapshot()
 
 # ----- GET Requests -----
+@router.get("/scrape/jobs/{job_id}")
+def api_scrape_job(job_id: str):
+    '''Returns the progress of a scrape job, and its result once done.'''
+    job = get_scrape_jobs().get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": "Unknown scrape job."})
+    return job.snapshot()
+
 @router.get("/scrape/{session_id}/combined.txt")
 def download_combined_text(session_id: str):
-    '''Returns the raw combined scraped text for a fresh scrape as a downloadable .txt file.'''
-    txt = _combined_text.get(session_id)
-    if not txt:
-        return PlainTextResponse("No combined text for this session.", status_code=404)
-    url = _session_url.get(session_id, "")
+    '''
+    Returns the raw combined scraped text for a fresh scrape as a downloadable .txt file. Once the session's text has
+    been evicted (or for a session over cached data) the text is rebuilt from the site's chunks in Chroma.
+    '''
+    url = _sessions.url(session_id) or ""
     if url:
         base = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
         filename = f'combined_{base}.txt'
     else:
         filename = f'combined_{session_id}.txt'
     headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+    # the session's text file is streamed as is, it is never read into memory
+    text_file = _sessions.open_text(session_id)
+    if text_file is not None:
+        return StreamingResponse(_iter_file(text_file), media_type="text/plain", headers=headers)
+
+    txt = ""
+    if url:
+        try:
+            txt = _load_website_blob(url, cap=None)
+        except ValueError:
+            txt = ""
+    if not txt:
+        return PlainTextResponse("No combined text for this session.", status_code=404)
     return PlainTextResponse(txt, media_type="text/plain", headers=headers)
 
+def _iter_file(file, chunk_size: int = 64 * 1024):
+    with file:
+        while True:
+            data = file.read(chunk_size)
+            if not data:
+                break
+            yield data
+
 @router.get("/presets")
 def api_list_presets():
     cached = _cache_get(_preset_cache)
@@ -745,10 +866,34 @@ def api_pages(base: str = Query(...)):
 
 
 # ----- Web Socket Routes -----
+@router.websocket("/ws/scrape_jobs/{job_id}")
+async def scrape_job_progress(ws: WebSocket, job_id: str):
+    """Streams the progress of a scrape job (pages crawled, chunks embedded, ETA) until it is finished."""
+    await ws.accept()
+    job = get_scrape_jobs().get(job_id)
+    if job is None:
+        await ws.send_json({"error": "unknown scrape job"})
+        await ws.close()
+        return
+    sent_version, sent_at = -1, 0.0
+    try:
+        while True:
+            if job.version != sent_version or time.monotonic() - sent_at > SCRAPE_JOB_HEARTBEAT:
+                snapshot = job.snapshot()
+                sent_version, sent_at = snapshot["version"], time.monotonic()
+                await ws.send_json(snapshot)
+                if snapshot["status"] in ("done", "error", "cancelled"):
+                    break
+            await asyncio.sleep(SCRAPE_JOB_PROGRESS_INTERVAL)
+        await ws.close()
+    except WebSocketDisconnect:
+        pass
+
 @router.websocket("/ws/website_chat")
 async def website_chat_min(ws: WebSocket):
     """Return list of unique base domains from vector DB."""
     await ws.accept()
+    chat_session_id = f"website-chat-{uuid.uuid4().hex[:12]}"
     try:
         while True:
             # Expect exactly one JSON frame with {url, message, model?, temperature?, ...}
@@ -761,28 +906,23 @@ async def website_chat_min(ws: WebSocket):
             token_limit = int(payload.get("token_limit", 100_000))
             isAuth = bool(payload.get("isAuth", False))
             api_key = payload.get("api_key", None)
+            # Optional page of the site to restrict the answer to
+            page_url = (payload.get("page_url") or "").strip() or None
+            # Opt-in reuse of answers to the same (or a very similar) question about the same scrape of the site
+            use_cache = bool(payload.get("use_cache", False))
 
             if not url or not user_msg:
                 await ws.send_json({"error": "missing url or message"})
                 await ws.close()
                 return
 
-            # Build “website blob” from Chroma
-            logging.warning("[WS] payload url=%r", url)
-            context = _retrieve_relevant(url, user_msg, k=6, char_cap=20000)
-            # Show context in terminal
-            logging.warning(
-                "\n===== WS CONTEXT START =====\n%s\n===== WS CONTEXT END =====\n",
-                context
-            )
-
+            # Static system prompt so it stays a cacheable prefix, the retrieved context is sent with the question
             system_prompt = (
                     "You are a helpful assistant answering questions about a WEBSITE. "
-                    "Use ONLY the WEBSITE CONTENT provided below. "
+                    "Use ONLY the WEBSITE CONTENT provided in [DOCUMENT] with the question. "
+                    "The content is split into excerpts headed by [Page: title - url], link the page(s) your answer comes from. "
                     "Return VALID HTML ONLY (no markdown, no code fences). "
                     f"Keep answers concise (≤ {400} words). "
-                    "\n\n[CONTEXT]\n"
-                    f"{context}"
                 )
 
             chat = [
@@ -790,17 +930,39 @@ async def website_chat_min(ws: WebSocket):
                 {"role": "user", "content": user_msg},
             ]
 
-            # Stream from your existing helper
-            stream = request_openai_chat(
-                chat,
-                document_content="",
-                model=model,
-                temperature=temperature,
-                reasoning_effort=reasoning,
-                token_remaining=token_limit,
-                isAuth=isAuth,
-                api_key=api_key,
-            )
+            # A new scrape of the site changes its fingerprint, so answers about older content are not reused
+            cache_fingerprint = None
+            cached_answer = None
+            if use_cache:
+                last_scraped = await asyncio.to_thread(_last_scraped_at, url)
+                cache_fingerprint = fingerprint(url, last_scraped, page_url) if page_url else fingerprint(url, last_scraped)
+                cached_answer = await asyncio.to_thread(get_cached_chat_answer, chat, model, cache_fingerprint)
+
+            if cached_answer is not None:
+                stream = replay_cached_chat(cached_answer, count_messages_tokens(chat, model))
+            else:
+                # Build “website blob” from Chroma
+                logging.warning("[WS] payload url=%r", url)
+                context = await asyncio.to_thread(_retrieve_relevant, url, user_msg, k=6, char_cap=20000, page_url=page_url)
+                # Show context in terminal
+                logging.warning(
+                    "\n===== WS CONTEXT START =====\n%s\n===== WS CONTEXT END =====\n",
+                    context
+                )
+
+                # Stream from your existing helper
+                stream = request_openai_chat(
+                    chat,
+                    document_content=context,
+                    model=model,
+                    temperature=temperature,
+                    reasoning_effort=reasoning,
+                    token_remaining=token_limit,
+                    isAuth=isAuth,
+                    api_key=api_key,
+                    session_id=chat_session_id,
+                    cache_fingerprint=cache_fingerprint,
+                )
 
             # Forward deltas as they arrive
             async for chunk in stream:
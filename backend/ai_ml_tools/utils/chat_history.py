@@ -0,0 +1,123 @@
+from cachetools import LRUCache
+from dotenv import load_dotenv
+import hashlib
+import os
+import threading
+from ai_ml_tools.utils.tokenizer import count_message_tokens
+from ai_ml_tools.utils.openai import request_openai_response
+
+# Load enviroment variables
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
+
+# How earlier turns are sent with a new question:
+#   full    - every turn, the conversation grows until the session's token limit
+#   window  - the last turns that fit in the token budget, older turns are dropped
+#   summary - like window, but dropped turns are folded into a rolling summary
+HISTORY_MODES = ["full", "window", "summary"]
+DEFAULT_HISTORY_MODE = os.getenv("CHAT_HISTORY_MODE", "window")
+
+# Most recent turns (question and answer) always kept verbatim, even past the budget
+HISTORY_KEEP_TURNS = int(os.getenv("CHAT_HISTORY_KEEP_TURNS", "3"))
+# Tokens allowed for earlier turns before older ones are dropped or summarized
+HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "6000"))
+
+SUMMARY_MODEL = "gpt-4o-mini"
+SUMMARY_PROMPT = "You maintain a running summary of a conversation between a user and an assistant about one or more documents. Given the previous summary and the next part of the conversation, return an updated summary in under 200 words. Keep the user's questions, the facts given in the answers, and the document names and pages they came from. Return plain text only."
+SUMMARY_PREFIX = "[SUMMARY OF EARLIER CONVERSATION]\n"
+
+# Summaries keyed by a hash of every turn they cover. The hash is chained turn by turn, so when the window moves only the
+# newly dropped turns are summarized on top of the cached summary of the turns before them.
+_summary_cache = LRUCache(maxsize=2000)
+_summary_cache_lock = threading.Lock()
+
+'''
+Group messages into turns, each starting with a user message followed by the replies to it.
+'''
+def _split_turns(messages: list) -> list:
+    turns = []
+    for message in messages:
+        if message['role'] == 'user' or not turns:
+            turns.append([message])
+        else:
+            turns[-1].append(message)
+    return turns
+
+def _turn_tokens(turn: list, model: str) -> int:
+    return sum(count_message_tokens(message, model) for message in turn)
+
+def _chain_hash(previous: str, turn: list) -> str:
+    digest = hashlib.sha1(previous.encode("utf-8"))
+    for message in turn:
+        digest.update(f"\0{message['role']}\0{message['content']}".encode("utf-8", "ignore"))
+    return digest.hexdigest()
+
+'''
+Returns the rolling summary of the given turns. Starts from the longest prefix of turns already summarized and only
+sends the remaining turns to the LLM.
+'''
+def summarize_turns(turns: list, session_id: str | None = None) -> str:
+    hashes = []
+    previous = ""
+    for turn in turns:
+        previous = _chain_hash(previous, turn)
+        hashes.append(previous)
+
+    summary = ""
+    start = 0
+    with _summary_cache_lock:
+        for index in range(len(hashes) - 1, -1, -1):
+            cached = _summary_cache.get(hashes[index])
+            if cached is not None:
+                summary, start = cached, index + 1
+                break
+    if start == len(turns):
+        return summary
+
+    transcript = "\n\n".join(f"{message['role'].upper()}: {message['content']}" for turn in turns[start:] for message in turn)
+    question = f"PREVIOUS SUMMARY:\n{summary or '(none)'}\n\nNEXT PART OF THE CONVERSATION:\n{transcript}"
+    conversation = [{"role": "system", "content": SUMMARY_PROMPT}]
+    summary = request_openai_response(question, conversation, model=SUMMARY_MODEL, tempurature=0, session_id=session_id)[1]
+
+    with _summary_cache_lock:
+        _summary_cache[hashes[-1]] = summary
+    return summary
+
+'''
+Compact a chat history before it is sent to the LLM. System messages and the last question are always kept, as are the
+last keep_turns earlier turns. Older turns are kept newest first while they fit in token_budget, the rest are dropped
+(window) or replaced by a rolling summary (summary). Token counts come from the tokenizer's per-message cache, so each
+call only tokenizes the newest messages. Returns the history unchanged when it already fits.
+'''
+def compact_chat_history(chat_history: list, model: str, mode: str = DEFAULT_HISTORY_MODE, keep_turns: int = HISTORY_KEEP_TURNS, token_budget: int = HISTORY_TOKEN_BUDGET, session_id: str | None = None) -> list:
+    if mode not in HISTORY_MODES:
+        raise ValueError(f"History mode must be one of: {HISTORY_MODES}")
+    history = [message for message in chat_history if message != '']
+    if mode == "full" or len(history) < 2:
+        return chat_history
+
+    system_messages = [message for message in history[:-1] if message['role'] == 'system']
+    turns = _split_turns([message for message in history[:-1] if message['role'] != 'system'])
+    turn_tokens = [_turn_tokens(turn, model) for turn in turns]
+    if sum(turn_tokens) <= token_budget:
+        return chat_history
+
+    kept = len(turns)
+    used = 0
+    for index in range(len(turns) - 1, -1, -1):
+        if len(turns) - index > keep_turns and used + turn_tokens[index] > token_budget:
+            break
+        used += turn_tokens[index]
+        kept = index
+    dropped_turns = turns[:kept]
+    print(f"[Chat history] Keeping {len(turns) - kept} of {len(turns)} earlier turns ({used} tokens), mode: {mode}")
+
+    compacted = list(system_messages)
+    if mode == "summary" and dropped_turns:
+        try:
+            compacted.append({"role": "user", "content": SUMMARY_PREFIX + summarize_turns(dropped_turns, session_id)})
+        except Exception as e:
+            print(f"[Chat history] Could not summarize earlier turns, dropping them: {e}")
+    for turn in turns[kept:]:
+        compacted.extend(turn)
+    compacted.append(history[-1])
+    return compacted
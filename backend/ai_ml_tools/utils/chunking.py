@@ -0,0 +1,176 @@
+from dotenv import load_dotenv
+import os
+import re
+from ai_ml_tools.utils.tokenizer import count_tokens
+
+# Load enviroment variables
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
+
+# Chunk sizes in tokens. A heading only starts a new chunk once the current one reaches CHUNK_MIN_TOKENS, and chunks
+# split for size repeat up to CHUNK_OVERLAP_TOKENS of their trailing paragraphs at the start of the next chunk.
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "200"))
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "800"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "80"))
+
+# Model whose tokenizer measures chunk sizes (the embedding model's encoding)
+CHUNK_TOKEN_MODEL = None
+
+# Separators tried in order when a single block is larger than the maximum chunk size
+_SPLIT_PATTERNS = [r"\n", r"(?<=[.!?;:])\s+", r"\s+"]
+_HEADER = re.compile(r"#{1,6}\s")
+_COMMENT = re.compile(r"<!--.*-->\s*$")
+
+'''
+A contiguous span of the markdown: a heading, table, figure or paragraph.
+'''
+class Block:
+    def __init__(self, start: int, end: int, kind: str, tokens: int):
+        self.start = start
+        self.end = end
+        self.kind = kind
+        self.tokens = tokens
+
+'''
+Split Document Intelligence markdown into blocks. Headings are single lines, HTML tables (<table>) and figures (<figure>)
+and pipe tables are kept whole, other non-blank lines are grouped into paragraphs. Blank lines and DI comments such as
+<!-- PageBreak --> separate blocks and are not part of any block.
+'''
+def split_markdown_blocks(content: str, model: str | None = CHUNK_TOKEN_MODEL) -> list[Block]:
+    lines = []
+    offset = 0
+    for line in content.splitlines(keepends=True):
+        lines.append((offset, line))
+        offset += len(line)
+
+    blocks = []
+    index = 0
+    while index < len(lines):
+        start, line = lines[index]
+        stripped = line.strip()
+        if not stripped or _COMMENT.match(stripped):
+            index += 1
+            continue
+
+        if _HEADER.match(stripped):
+            kind, index = "header", index + 1
+        elif stripped.startswith("<table") or stripped.startswith("<figure"):
+            closing = "</table>" if stripped.startswith("<table") else "</figure>"
+            kind = "table" if closing == "</table>" else "figure"
+            while index < len(lines) and closing not in lines[index][1]:
+                index += 1
+            index = min(index + 1, len(lines))
+        elif stripped.startswith("|"):
+            kind = "table"
+            while index < len(lines) and lines[index][1].strip().startswith("|"):
+                index += 1
+        else:
+            kind = "paragraph"
+            index += 1
+            while index < len(lines):
+                following = lines[index][1].strip()
+                if not following or _COMMENT.match(following) or _HEADER.match(following) or following.startswith(("<table", "<figure", "|")):
+                    break
+                index += 1
+
+        end = max(lines[index - 1][0] + len(lines[index - 1][1].rstrip()), start + 1)
+        blocks.append(Block(start, end, kind, count_tokens(content[start:end], model)))
+    return blocks
+
+'''
+Split a span that is larger than max_tokens into contiguous pieces of at most max_tokens, trying line breaks, then
+sentence ends, then whitespace, and finally a hard cut by characters.
+'''
+def _split_span(content: str, start: int, end: int, kind: str, max_tokens: int, model: str | None, level: int = 0) -> list[Block]:
+    if level >= len(_SPLIT_PATTERNS):
+        step = max(1, len(content[start:end]) * max_tokens // max(1, count_tokens(content[start:end], model)))
+        return [Block(position, min(end, position + step), kind, count_tokens(content[position:min(end, position + step)], model)) for position in range(start, end, step)]
+
+    cuts = [start] + [start + match.end() for match in re.finditer(_SPLIT_PATTERNS[level], content[start:end])] + [end]
+    segments = [(cuts[i], cuts[i + 1]) for i in range(len(cuts) - 1) if cuts[i + 1] > cuts[i]]
+
+    pieces = []
+    piece_start, piece_tokens = None, 0
+    for segment_start, segment_end in segments:
+        tokens = count_tokens(content[segment_start:segment_end], model)
+        if tokens > max_tokens:
+            if piece_start is not None:
+                pieces.append(Block(piece_start, segment_start, kind, piece_tokens))
+                piece_start, piece_tokens = None, 0
+            pieces.extend(_split_span(content, segment_start, segment_end, kind, max_tokens, model, level + 1))
+            continue
+        if piece_start is not None and piece_tokens + tokens > max_tokens:
+            pieces.append(Block(piece_start, segment_start, kind, piece_tokens))
+            piece_start, piece_tokens = None, 0
+        if piece_start is None:
+            piece_start = segment_start
+        piece_tokens += tokens
+    if piece_start is not None:
+        pieces.append(Block(piece_start, end, kind, piece_tokens))
+    return pieces
+
+'''
+Chunk markdown into token-bounded chunks that follow the document's structure. Each chunk is a contiguous span of the
+content made of whole blocks: a heading starts a new chunk once the current one has min_tokens, blocks are added while
+the chunk stays within max_tokens, blocks larger than max_tokens are split on line, sentence and word boundaries, and a
+chunk split for size repeats its last paragraphs (up to overlap_tokens) at the start of the next one. A final chunk
+smaller than min_tokens is merged into the previous chunk when it fits.
+
+Returns a list of {"text", "start", "end", "tokens"} where text == content[start:end], so offsets can be mapped to pages.
+'''
+def chunk_markdown(content: str, min_tokens: int = CHUNK_MIN_TOKENS, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS, model: str | None = CHUNK_TOKEN_MODEL) -> list[dict]:
+    blocks = []
+    for block in split_markdown_blocks(content, model):
+        if block.tokens > max_tokens:
+            blocks.extend(_split_span(content, block.start, block.end, block.kind, max_tokens, model))
+        else:
+            blocks.append(block)
+
+    spans = []
+    current = []
+    current_tokens = 0
+
+    def flush(with_overlap: bool):
+        nonlocal current, current_tokens
+        if not current:
+            return
+        spans.append((current[0].start, current[-1].end, current_tokens))
+        carried = []
+        if with_overlap and overlap_tokens > 0:
+            carried_tokens = 0
+            for block in reversed(current[1:]):
+                if block.kind == "header" or carried_tokens + block.tokens > overlap_tokens:
+                    break
+                carried.insert(0, block)
+                carried_tokens += block.tokens
+        current = carried
+        current_tokens = sum(block.tokens for block in carried)
+
+    for block in blocks:
+        if block.kind == "header" and current_tokens >= min_tokens:
+            flush(with_overlap=False)
+        if current and current_tokens + block.tokens > max_tokens:
+            flush(with_overlap=True)
+            if current and current_tokens + block.tokens > max_tokens:
+                current, current_tokens = [], 0
+        current.append(block)
+        current_tokens += block.tokens
+    if current and (not spans or current[-1].end > spans[-1][1]):
+        spans.append((current[0].start, current[-1].end, current_tokens))
+
+    if len(spans) > 1 and spans[-1][2] < min_tokens:
+        last_start, last_end, last_tokens = spans.pop()
+        previous_start, previous_end, previous_tokens = spans[-1]
+        merged_tokens = count_tokens(content[previous_start:last_end], model)
+        if merged_tokens <= max_tokens:
+            spans[-1] = (previous_start, last_end, merged_tokens)
+        else:
+            spans.append((last_start, last_end, last_tokens))
+
+    return [{"text": content[start:end], "start": start, "end": end, "tokens": tokens} for start, end, tokens in spans]
+
+'''
+Returns the page numbers whose spans overlap the character range [start, end). page_spans is a list of
+(offset, length, page_number) from the Document Intelligence result's pages.
+'''
+def pages_for_range(start: int, end: int, page_spans: list[tuple[int, int, int]]) -> list[int]:
+    return sorted({page_number for offset, length, page_number in page_spans if offset < end and offset + length > start})
@@ -1,6 +1,6 @@
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import AzureOpenAIEmbeddings, AzureChatOpenAI
+from langchain_openai import AzureChatOpenAI
 from langchain_community.vectorstores import Chroma
 from langchain_core.runnables import RunnablePassthrough, RunnableLambda
 from langchain_core.prompts import ChatPromptTemplate
@@ -8,6 +8,10 @@ from langchain_core.documents import Document
 from pydantic import BaseModel, Field
 from typing import Dict, Any, List
 from ai_ml_tools.utils.azure_key_vault import get_OPENAI_API_KEY
+from ai_ml_tools.utils.llm_scheduler import get_llm_scheduler, deployment_name, ReservationCallback, MODEL_DEPLOYMENT_ENV, PRIORITY_BATCH
+from ai_ml_tools.utils.response_cache import get_response_cache, fingerprint
+from ai_ml_tools.utils.embedding_service import get_embedding_service, ServiceEmbeddings
+from openai import RateLimitError
 
 import fitz  # PyMuPDF
 import os
@@ -40,11 +44,12 @@ FREE_MODEL = "gpt4omini"
 
 # Azure OpenAI deployment names (resolved from env at startup)
 AZURE_DEPLOYMENT_MAP: dict[str, str] = {
-    "gpt4omini":  os.getenv("AZURE_OPENAI_GPT4_o_mini", ""),
-    "gpt4o":      os.getenv("AZURE_OPENAI_GPT4_o", ""),
-    "gpt41mini":  os.getenv("AZURE_OPENAI_GPT4_1_MINI", ""),
+    model: os.getenv(env_name, "") for model, env_name in MODEL_DEPLOYMENT_ENV.items()
 }
 
+# Tokens reserved in the LLM scheduler for one extraction request (30 retrieved chunks of ~1500 characters plus the answer)
+EXTRACTION_TOKENS_ESTIMATE = 16000
+
 # Native (non-Azure) model strings passed directly to each provider's SDK
 NATIVE_MODEL_STRINGS: dict[str, str] = {
     "claude-3-5-sonnet": "claude-3-5-sonnet-20241022",
@@ -99,6 +104,7 @@ def build_llm(model_type: str | None, api_key: str | None = None):
             model=deployment,
             temperature=0,
             max_tokens=4000,
+            include_response_headers=True,  # rate limit headers for the LLM scheduler
         )
         return llm, "azure_openai"
 
@@ -316,20 +322,15 @@ def split_document(documents, chunk_size, chunk_overlap):
 
 def get_embedding_function(api_key=None):
     """
-    Return an AzureOpenAIEmbeddings object using the shared SDPA/OCDS key.
+    Return embeddings for the small embedding deployment, backed by the shared embedding service
+    (token-based batching, bounded concurrency and rate limit handling shared with the other tools).
     Embeddings always use the Azure endpoint regardless of which LLM the user selected.
     """
-    api_key = get_OPENAI_API_KEY()
-    endpoint = os.getenv("OPENAI_API_ENDPOINT")
-    api_version = os.getenv("OPENAI_API_EMBEDDING_VERSION")
-    embed_deployment = os.getenv("AZURE_OPENAI_SMALL_EMBED_DEPLOYMENT")
-
-    return AzureOpenAIEmbeddings(
-        azure_endpoint=endpoint,
-        api_key=api_key,
-        api_version=api_version,
-        model=embed_deployment,
-    )
+    return ServiceEmbeddings(get_embedding_service(
+        os.getenv("AZURE_OPENAI_SMALL_EMBED_DEPLOYMENT"),
+        endpoint=os.getenv("OPENAI_API_ENDPOINT"),
+        api_version=os.getenv("OPENAI_API_EMBEDDING_VERSION"),
+    ))
 
 
 def create_vectorstore(chunks, embedding_function, collection_name, vector_store_path="db"):
@@ -447,6 +448,24 @@ def format_docs(docs):
     return "\n\n".join(doc.page_content for doc in docs)
 
 
+def _invoke_scheduled(chain, query, model_type, provider, session_id=None):
+    """
+    Invoke `chain` on `query`. Requests to the shared Azure deployments wait for budget in the
+    LLM scheduler as batch requests so large extractions do not starve interactive chats.
+    Other providers use the user's own key and are invoked directly.
+    """
+    if provider != "azure_openai":
+        return chain.invoke(query)
+
+    deployment = deployment_name(model_type or FREE_MODEL)
+    with get_llm_scheduler().reserve_sync(deployment, EXTRACTION_TOKENS_ESTIMATE, PRIORITY_BATCH, session_id) as reservation:
+        try:
+            return chain.invoke(query, config={"callbacks": [ReservationCallback(reservation)]})
+        except RateLimitError as e:
+            reservation.report_rate_limited(e)
+            raise
+
+
 def _apply_structured_output(llm, dynamic_model, provider: str):
     """
     Wrap `llm` with structured output using kwargs appropriate for each provider.
@@ -467,6 +486,7 @@ def query_document_per_file(
     document_names,
     api_key=None,
     model_type=None,
+    cache_fingerprint=None,
 ):
     """
     Query a vector store with dynamic fields and return structured responses
@@ -478,6 +498,8 @@ def query_document_per_file(
         document_names – list of PDF filenames to iterate over
         api_key       – user-supplied API key (None → AKV for gpt4omini)
         model_type    – frontend model key (e.g. "gpt4omini", "claude-3-5-sonnet")
+        cache_fingerprint – fingerprint of the vector store, reuses cached answers
+                            for the same fields and document when given
     """
     llm, provider = build_llm(model_type, api_key)
 
@@ -491,6 +513,7 @@ def query_document_per_file(
     structured_llm  = _apply_structured_output(llm, DynamicModel, provider)
 
     results_per_document = {}
+    session_id = f"extraction-{uuid.uuid4().hex[:12]}"
 
     for doc_name in document_names:
         query = f"""Please extract the following specific information ONLY from the document named "{doc_name}":
@@ -513,8 +536,17 @@ def query_document_per_file(
         )
 
         try:
-            structured_response = rag_chain.invoke(query)
-            response_dict       = structured_response.model_dump()
+            # Field lists only reuse exact matches, a similar list can still ask for different fields
+            cache_scope   = fingerprint(cache_fingerprint, doc_name)
+            cache_prompt  = ", ".join(fields_list)
+            response_dict = get_response_cache().get(model_type, cache_scope, cache_prompt, semantic=False) if cache_fingerprint else None
+            if response_dict is None:
+                structured_response = _invoke_scheduled(rag_chain, query, model_type, provider, session_id)
+                response_dict       = structured_response.model_dump()
+                if cache_fingerprint:
+                    get_response_cache().set(model_type, cache_scope, cache_prompt, response_dict, semantic=False)
+            else:
+                print(f"[PDF Extraction] Using cached answers for {doc_name}")
             
             document_rows = []
             for field_name, field_data in response_dict.items():
@@ -585,7 +617,7 @@ def query_document(vectorstore, fields_list, api_key=None, model_type=None):
     )
 
     try:
-        structured_response = rag_chain.invoke(query)
+        structured_response = _invoke_scheduled(rag_chain, query, model_type, provider)
         response_dict       = structured_response.model_dump()
         
         df = pd.DataFrame([response_dict])
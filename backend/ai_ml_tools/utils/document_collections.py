@@ -0,0 +1,154 @@
+from cachetools import LRUCache
+from dotenv import load_dotenv
+from functools import lru_cache
+from uuid import uuid4
+import chromadb
+import os
+import threading
+import time
+from ai_ml_tools.utils.openai import get_openai_client_embeddings, format_chunks
+from ai_ml_tools.utils.retrieval import hybrid_rank, limit_to_token_budget, RETRIEVAL_K, RETRIEVAL_CANDIDATES, RETRIEVAL_CONTEXT_TOKENS, RETRIEVAL_RERANK
+
+# Load enviroment variables
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
+
+# Chatbot document collections are stored in the Chroma server as "chatbot_<collection id>"
+COLLECTION_PREFIX = "chatbot_"
+# A collection expires this long after it was last used
+COLLECTION_TTL_SECONDS = int(os.getenv("CHATBOT_COLLECTION_TTL_HOURS", "24")) * 3600
+# Quotas: chunks in one collection, and collections kept at once (the least recently used are deleted first)
+COLLECTION_MAX_CHUNKS = int(os.getenv("CHATBOT_COLLECTION_MAX_CHUNKS", "10000"))
+MAX_COLLECTIONS = int(os.getenv("CHATBOT_MAX_COLLECTIONS", "200"))
+# Collection expiry is only pushed back when less than this much of the TTL is left, to avoid a write on every question
+TOUCH_INTERVAL_SECONDS = 600
+
+# Chunk texts and metadata of recently used collections, so each question does not read the whole collection back
+_collection_chunks = LRUCache(maxsize=32)
+_collection_chunks_lock = threading.Lock()
+_collections_guard = threading.Lock()
+
+@lru_cache(maxsize=1)
+def _get_chroma_client():
+    chroma_host = os.getenv("CHROMA_HOST", "localhost")
+    chroma_port = int(os.getenv("CHROMA_PORT", "8000"))
+    return chromadb.HttpClient(host=chroma_host, port=chroma_port)
+
+def _collection_name(collection_id: str) -> str:
+    return f"{COLLECTION_PREFIX}{collection_id}"
+
+'''
+Returns the Chroma collection for a collection id, raises KeyError if it does not exist or has expired.
+'''
+def _get_collection(collection_id: str):
+    try:
+        collection = _get_chroma_client().get_collection(_collection_name(collection_id))
+    except Exception:
+        raise KeyError(f"Document collection {collection_id} was not found, it may have expired.")
+    if (collection.metadata or {}).get("expires_at", 0) < time.time():
+        delete_document_collection(collection_id)
+        raise KeyError(f"Document collection {collection_id} has expired.")
+    return collection
+
+'''
+Delete expired chatbot collections, then the least recently used ones while more than MAX_COLLECTIONS - keep remain.
+'''
+def purge_collections(keep: int = 0):
+    now = time.time()
+    collections = [collection for collection in _get_chroma_client().list_collections() if collection.name.startswith(COLLECTION_PREFIX)]
+    collections.sort(key=lambda collection: (collection.metadata or {}).get("expires_at", 0))
+    over_quota = max(0, len(collections) - (MAX_COLLECTIONS - keep))
+    for index, collection in enumerate(collections):
+        if index < over_quota or (collection.metadata or {}).get("expires_at", 0) < now:
+            print(f"[Collections] Deleting {collection.name}")
+            _get_chroma_client().delete_collection(collection.name)
+            with _collection_chunks_lock:
+                _collection_chunks.pop(collection.name[len(COLLECTION_PREFIX):], None)
+
+'''
+Create an empty document collection and return its id. Expired and over quota collections are removed first.
+'''
+def create_document_collection() -> dict:
+    with _collections_guard:
+        purge_collections(keep=1)
+        collection_id = uuid4().hex
+        now = time.time()
+        _get_chroma_client().create_collection(
+            _collection_name(collection_id),
+            metadata={"created_at": now, "expires_at": now + COLLECTION_TTL_SECONDS, "chunk_count": 0},
+            embedding_function=None,
+        )
+    return {"collection_id": collection_id, "expires_at": now + COLLECTION_TTL_SECONDS}
+
+'''
+Embed chunks (output of get_vectors) and add them to a collection. Returns the collection's chunk count.
+'''
+def add_to_document_collection(collection_id: str, text_chunks: list[str], metadata: list[dict]) -> int:
+    if not text_chunks:
+        return 0
+    collection = _get_collection(collection_id)
+    chunk_count = (collection.metadata or {}).get("chunk_count", 0)
+    if chunk_count + len(text_chunks) > COLLECTION_MAX_CHUNKS:
+        raise ValueError(f"Document collections are limited to {COLLECTION_MAX_CHUNKS} chunks.")
+
+    embeddings = get_openai_client_embeddings().embed_documents(text_chunks)
+    collection.add(
+        ids=[f"chunk-{chunk_count + index}" for index in range(len(text_chunks))],
+        documents=text_chunks,
+        embeddings=embeddings,
+        metadatas=[{**{key: value for key, value in meta.items() if value is not None}, "chunk_index": chunk_count + index} for index, meta in enumerate(metadata)],
+    )
+    chunk_count += len(text_chunks)
+    collection.modify(metadata={**collection.metadata, "chunk_count": chunk_count, "expires_at": time.time() + COLLECTION_TTL_SECONDS})
+    with _collection_chunks_lock:
+        _collection_chunks.pop(collection_id, None)
+    return chunk_count
+
+def delete_document_collection(collection_id: str):
+    with _collection_chunks_lock:
+        _collection_chunks.pop(collection_id, None)
+    try:
+        _get_chroma_client().delete_collection(_collection_name(collection_id))
+    except Exception as e:
+        print(f"[Collections] Could not delete {collection_id}: {e}")
+
+'''
+Returns the chunk texts and metadata of a collection ordered by chunk index, cached for recently used collections.
+'''
+def _load_chunks(collection_id: str, collection) -> tuple[list[str], list[dict]]:
+    with _collection_chunks_lock:
+        cached = _collection_chunks.get(collection_id)
+    if cached is not None:
+        return cached
+    stored = collection.get(include=["documents", "metadatas"])
+    ordered = sorted(zip(stored["metadatas"], stored["documents"]), key=lambda item: item[0]["chunk_index"])
+    chunks = ([document for _, document in ordered], [meta for meta, _ in ordered])
+    with _collection_chunks_lock:
+        _collection_chunks[collection_id] = chunks
+    return chunks
+
+'''
+Obtain relevent chunks of a stored collection for a chatbot question, using the same hybrid retrieval as
+get_relevent_chunks but with the embeddings computed once at upload. Using a collection pushes back its expiry.
+'''
+def get_relevent_collection_chunks(chat_history: list[dict], collection_id: str, k: int = RETRIEVAL_K, rerank: str = RETRIEVAL_RERANK, context_tokens: int = RETRIEVAL_CONTEXT_TOKENS) -> str:
+    collection = _get_collection(collection_id)
+    metadata = collection.metadata or {}
+    if metadata.get("expires_at", 0) - time.time() < COLLECTION_TTL_SECONDS - TOUCH_INTERVAL_SECONDS:
+        collection.modify(metadata={**metadata, "expires_at": time.time() + COLLECTION_TTL_SECONDS})
+
+    document_chunks, document_metadata = _load_chunks(collection_id, collection)
+    if not document_chunks:
+        return ''
+    question = chat_history[-1]['content']
+    query_embedding = get_openai_client_embeddings().embed_query(question)
+    results = collection.query(query_embeddings=[query_embedding], n_results=min(max(k, RETRIEVAL_CANDIDATES), len(document_chunks)), include=["metadatas"])
+    vector_ranking = [meta["chunk_index"] for meta in results["metadatas"][0]]
+
+    def get_embeddings(indexes):
+        stored = collection.get(ids=[f"chunk-{index}" for index in indexes], include=["embeddings", "metadatas"])
+        return {meta["chunk_index"]: embedding for meta, embedding in zip(stored["metadatas"], stored["embeddings"])}
+
+    ranked = hybrid_rank(question, document_chunks, vector_ranking, k, rerank, query_embedding, get_embeddings)
+    ranked = limit_to_token_budget(ranked, document_chunks, context_tokens)
+    print("Number of chunks used: "+str(len(ranked)))
+    return format_chunks(ranked, document_chunks, document_metadata)
@@ -1,18 +1,16 @@
 from azure.ai.documentintelligence import DocumentIntelligenceClient
 from azure.ai.formrecognizer import DocumentAnalysisClient
 from azure.core.credentials import AzureKeyCredential
-from langchain.text_splitter import MarkdownHeaderTextSplitter
 from langchain_core.documents import Document
 from fastapi import UploadFile
 from dotenv import load_dotenv
 from fuzzywuzzy import fuzz
-from typing import List
-from io import BytesIO 
-import base64
+from typing import List, BinaryIO
 import json
 import os
 import re
 from ai_ml_tools.utils.azure_key_vault import get_DI_API_KEY
+from ai_ml_tools.utils.chunking import chunk_markdown, pages_for_range
 
 # Load enviroment variables
 load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
@@ -21,6 +19,16 @@ load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
 endpoint = os.getenv('DI_API_ENDPOINT')
 key = get_DI_API_KEY()
 
+# Short keys used by the compact serialization, included in prompts so the LLM can read the compact JSON
+COMPACT_KEY_LEGEND = (
+    'Keys: "c" = content, "p" = paragraphs, "t" = tables, "r" = paragraph role, "pg" = page number(s), '
+    '"n" = [row count, column count], "rows" = table rows as lists of cell text, '
+    'one entry per column ("" for empty cells and cells covered by a merged cell), "poly" = polygon.'
+)
+
+# Rough characters per token for JSON/English text, used for cheap size checks before tokenizing
+CHARS_PER_TOKEN_ESTIMATE = 4
+
 """
 Extracts and refines the content of a document using Document Intelligence.
 
@@ -29,26 +37,28 @@ Steps:
 - Open the file in binary mode and analyze the document.
 - Extract the content and refine it using the 'refine_content' function.
 - Handle exceptions and return the refined content.
+
+When compact is True the JSON uses short keys, no indentation, and tables are written as rows of cell text (see COMPACT_KEY_LEGEND).
 """
-def get_content(pdf: UploadFile, content: bool, polygon: bool, di_api="3.1"):
+def get_content(pdf: UploadFile, content: bool, polygon: bool, di_api="3.1", compact: bool = False):
     refined_content = None
 
     try:
-        file_content =  pdf.file.read()
+        # Stream the upload's spooled file straight to DI instead of reading it into memory first.
+        file_stream = pdf.file
+        file_stream.seek(0)
         # Open the file and analyze it.
         if di_api == "3.1":
             client = DocumentAnalysisClient(endpoint=endpoint, credential=AzureKeyCredential(key))
-            poller = client.begin_analyze_document("prebuilt-document", document=file_content)
+            poller = client.begin_analyze_document("prebuilt-document", document=file_stream)
         elif di_api == "":
             client = DocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key))
-            base64_encoded_pdf = base64.b64encode(file_content).decode("utf-8")
-            analyze_request = {"base64Source": base64_encoded_pdf}
-            poller = client.begin_analyze_document("prebuilt-layout", analyze_request, output_content_format="markdown")
+            poller = _begin_layout_analysis(client, file_stream)
         else:
             raise TypeError(f"{di_api} is not a valid api value.")
 
         result = poller.result()
-        refined_content = _di_object_to_json(result, di_api, content, polygon)
+        refined_content = _di_object_to_json(result, di_api, content, polygon, compact)
     except Exception as e:
         print(f"Error processing document: {e}")
 
@@ -60,75 +70,55 @@ Extracts a document and returns a list of document chunks in markdown.
 Steps:
 - Initialize the client with endpoint and key.
 - Open the file in binary mode and analyze the document.
-- Extract the content and refine it using the 'refine_content' function.
-- Handle exceptions and return the refined content.
+- Split the markdown into token-bounded chunks that follow headings, tables and paragraphs (see chunk_markdown).
+- Map each chunk's character offsets to the pages whose spans it overlaps.
 """
-def get_vectors(file: BytesIO, filename: str) -> List[Document]:
+def get_vectors(file: BinaryIO, filename: str) -> List[Document]:
     # Initiate Azure AI Document Intelligence to load the document.  
     content = ''
-    page_map = [] 
+    page_spans = [] 
     document_intelligence_client = DocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key))  
       
     try:  
-        file.seek(0)  
-        base64_encoded_pdf = base64.b64encode(file.read()).decode("utf-8")  
-        analyze_request = {"base64Source": base64_encoded_pdf}  
-        poller = document_intelligence_client.begin_analyze_document(  
-            "prebuilt-layout", analyze_request, output_content_format="markdown"  
-        )  
+        poller = _begin_layout_analysis(document_intelligence_client, file)  
         result = poller.result()  
           
-        # Extract content and page layout information  
+        # Extract content and the character spans of each page
         content = result.content  
         for page in result.pages:  
-            for line in page.lines:  
-                page_map.append({  
-                    "text": line.content,  
-                    "page_number": page.page_number  
-                })   
+            for span in page.spans or []:  
+                page_spans.append((span.offset, span.length, page.page_number))   
     except Exception as e:  
         print(f"Error processing document: {e}")  
         return [], []  
       
-    # Split the document into chunks based on markdown headers.  
-    headers_to_split_on = [  
-        ("#", "Header 1"),  
-        ("##", "Header 2"),  
-        ("###", "Header 3"),  
-    ]  
-    text_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=headers_to_split_on)  
-    splits = text_splitter.split_text(content)  
+    chunks = chunk_markdown(content)
       
-    # Create list of text chunks and metadata containing document name and page number for a given chunk  
+    # Create list of text chunks and metadata containing document name, page numbers and character offsets for a given chunk  
     text_chunks = []  
     metadata = [] 
-    print("Length of intial page map: " + str(len(page_map)))  
-      
-    for split in splits:
-        normalized_split_content = normalize_text(split.page_content)
-
-        # Find the page number(s) for the split, remove from map so douplicate paragraphs later in the document get the right page number 
-        pages_for_split = set() 
-        for mapping in page_map:
-            normalized_mapping_text = normalize_text(mapping["text"])
-            # similarity = fuzz.ratio(normalized_split_content, normalized_mapping_text)
-            # print(similarity)
-            if normalized_mapping_text in normalized_split_content:
-                # print(normalized_mapping_text)
-                # print(normalized_split_content)
-                pages_for_split.add(mapping["page_number"])
-                page_map.remove(mapping)
-          
-        # Add the text chunk and metadata with page numbers  
-        text_chunks.append(split.page_content)  
+    for chunk in chunks:
+        text_chunks.append(chunk["text"])  
         metadata.append({  
             'document_name': filename,  
-            'page_numbers': ", ".join(map(str, sorted(pages_for_split)))  
+            'page_numbers': ", ".join(map(str, pages_for_range(chunk["start"], chunk["end"], page_spans))),
+            'start_offset': chunk["start"],
+            'end_offset': chunk["end"],
         })  
-    print("Length of final page map: " + str(len(page_map)))  
-    print("Length of splits: " + str(len(splits)))  
+    print(f"Length of document: {len(content)} characters, {len(result.pages)} pages")  
+    print(f"Number of chunks: {len(chunks)}, largest: {max((chunk['tokens'] for chunk in chunks), default=0)} tokens")  
     return text_chunks, metadata  
 
+"""
+Starts a prebuilt-layout analysis with markdown output by sending the file as a binary application/pdf body.
+The stream is read by the client as the request is sent, avoiding a base64 copy and a JSON wrapper of the whole file.
+"""
+def _begin_layout_analysis(client: DocumentIntelligenceClient, file: BinaryIO):
+    file.seek(0)
+    return client.begin_analyze_document(
+        "prebuilt-layout", file, output_content_format="markdown", content_type="application/pdf"
+    )
+
 """  
 Normalize text by removing extra spaces, line breaks, and special characters.  
 """ 
@@ -146,17 +136,77 @@ Steps:
 - Convert the structured data into JSON format.
 - Print and return the JSON string.
 """
-def _di_object_to_json(result: object, di_api: str, content: bool, polygon: bool) -> str:
+def _di_object_to_json(result: object, di_api: str, content: bool, polygon: bool, compact: bool = False) -> str:
     refined_data = _json_with_polygons(result, di_api) if polygon else _json_no_polygons(result, di_api)
 
     if not content:
         del refined_data["Content"]
 
-    # Convert the structured data into a formatted JSON string.
-    refined_json = json.dumps(refined_data, indent=4)
+    # Convert the structured data into a formatted JSON string, or a minified one with short keys for prompts.
+    if compact:
+        refined_json = json.dumps(_compact_refined_data(refined_data), separators=(",", ":"), ensure_ascii=False)
+    else:
+        refined_json = json.dumps(refined_data, indent=4)
+    print(f"DI JSON size: {len(refined_json)} characters, ~{estimate_tokens(refined_json)} tokens")
 
     return refined_json
 
+"""
+Cheap token-count estimate based on string length, avoids running a tokenizer over very large strings.
+"""
+def estimate_tokens(text: str) -> int:
+    return -(-len(text or "") // CHARS_PER_TOKEN_ESTIMATE)
+
+"""
+Converts the dictionary built by _json_no_polygons or _json_with_polygons into the compact form.
+
+- Keys are shortened (see COMPACT_KEY_LEGEND) and empty roles are omitted.
+- Paragraph and table ids are dropped, their position in the list is the id.
+- Table cells are merged into rows of cell text with the table's page range given once. Each cell is placed at its
+  column index, so rows always have the table's column count and cells missing from DI (empty, or covered by a span)
+  are "".
+"""
+def _compact_refined_data(refined_data: dict) -> dict:
+    compact_data = {}
+    if "Content" in refined_data:
+        compact_data["c"] = refined_data["Content"]
+
+    paragraphs = []
+    for paragraph in refined_data["Paragraphs"]:
+        compact_paragraph = {"pg": paragraph["PageNumber"], "c": paragraph["Content"]}
+        if paragraph.get("Role"):
+            compact_paragraph["r"] = paragraph["Role"]
+        if paragraph.get("Polygon"):
+            compact_paragraph["poly"] = paragraph["Polygon"]
+        paragraphs.append(compact_paragraph)
+    compact_data["p"] = paragraphs
+
+    tables = []
+    for table in refined_data["Tables"]:
+        if table["RowCount"] == "N/A":
+            continue
+
+        rows = [[""] * table["ColumnCount"] for _ in range(table["RowCount"])]
+        pages = []
+        for cell in table["Cells"]:
+            if cell["RowIndex"] < table["RowCount"] and cell["ColumnIndex"] < table["ColumnCount"]:
+                rows[cell["RowIndex"]][cell["ColumnIndex"]] = cell["Content"]
+            if cell["PageNumber"] != "N/A" and cell["PageNumber"] not in pages:
+                pages.append(cell["PageNumber"])
+
+        compact_table = {
+            "pg": f"{min(pages)}-{max(pages)}" if len(pages) > 1 else (pages[0] if pages else "N/A"),
+            "n": [table["RowCount"], table["ColumnCount"]],
+            "rows": rows,
+        }
+        polygons = [cell["Polygon"] for cell in table["Cells"] if cell.get("Polygon")]
+        if polygons:
+            compact_table["poly"] = polygons
+        tables.append(compact_table)
+    compact_data["t"] = tables
+
+    return compact_data
+
 """
 Create a dictionary containing the content, paragraphs, and tables from a DI responce, polygons are omitted.
 """
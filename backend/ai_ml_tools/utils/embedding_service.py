@@ -0,0 +1,186 @@
+from langchain_core.embeddings import Embeddings
+from openai import AsyncAzureOpenAI, RateLimitError
+from dotenv import load_dotenv
+import asyncio
+import os
+import threading
+import time
+from ai_ml_tools.utils.azure_key_vault import get_OPENAI_API_KEY
+from ai_ml_tools.utils.tokenizer import count_tokens, get_encoding, DEFAULT_ENCODING
+from ai_ml_tools.utils.llm_scheduler import get_llm_scheduler, deployment_name, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+
+# Load enviroment variables
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
+
+# Azure OpenAI limits for one embeddings request: inputs per request and tokens per input
+EMBEDDING_MAX_BATCH_INPUTS = 2048
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+# Batches are filled up to this many tokens (and EMBEDDING_MAX_BATCH_INPUTS inputs), at most EMBEDDING_MAX_CONCURRENCY run at once
+EMBEDDING_MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "100000"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+# Attempts per batch after a 429, the wait in between comes from the LLM scheduler (Retry-After)
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+
+# All embedding requests run on one background event loop, so sync callers in worker threads and async callers share the
+# same client, concurrency limit and rate limit handling without blocking a server thread on sleeps.
+_service_loop = None
+_service_loop_lock = threading.Lock()
+_services = {}
+_services_lock = threading.Lock()
+
+def _get_service_loop() -> asyncio.AbstractEventLoop:
+    global _service_loop
+    with _service_loop_lock:
+        if _service_loop is None:
+            _service_loop = asyncio.new_event_loop()
+            threading.Thread(target=_service_loop.run_forever, name="embedding-service", daemon=True).start()
+    return _service_loop
+
+'''
+Embeds texts on one Azure OpenAI embedding deployment. Texts are grouped into batches by token count, a bounded number
+of batches run concurrently, and every batch reserves its tokens in the shared LLM scheduler, which pauses the deployment
+for the Retry-After time when a 429 is returned. Throughput is printed after each call and kept in stats().
+'''
+class EmbeddingService:
+    def __init__(self, endpoint: str, deployment: str, api_version: str):
+        self.endpoint = endpoint
+        self.deployment = deployment_name(deployment)
+        self.api_version = api_version
+        self._client = None
+        self._semaphore = None
+        self._stats_lock = threading.Lock()
+        self._stats = {"texts": 0, "tokens": 0, "requests": 0, "rate_limited": 0, "seconds": 0.0}
+
+    '''
+    Embed texts from a worker thread (never from the event loop thread, use aembed there). Returns one vector per text.
+    '''
+    def embed(self, texts: list[str], priority: int = PRIORITY_BATCH, session_id: str | None = None) -> list[list[float]]:
+        return asyncio.run_coroutine_threadsafe(self._embed(texts, priority, session_id), _get_service_loop()).result()
+
+    '''
+    Embed texts from async code. Returns one vector per text.
+    '''
+    async def aembed(self, texts: list[str], priority: int = PRIORITY_BATCH, session_id: str | None = None) -> list[list[float]]:
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._embed(texts, priority, session_id), _get_service_loop()))
+
+    '''
+    Returns the texts, tokens, requests, 429s and seconds spent embedding since startup, and the average tokens per second.
+    '''
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["tokens_per_second"] = round(stats["tokens"] / stats["seconds"]) if stats["seconds"] else 0
+        return stats
+
+    def _get_client(self) -> AsyncAzureOpenAI:
+        if self._client is None:
+            self._client = AsyncAzureOpenAI(
+                azure_endpoint = self.endpoint,
+                api_key = get_OPENAI_API_KEY(),
+                api_version = self.api_version
+            )
+            self._semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+        return self._client
+
+    '''
+    Group texts into batches of at most EMBEDDING_MAX_BATCH_TOKENS tokens and EMBEDDING_MAX_BATCH_INPUTS inputs.
+    Inputs longer than the model accepts are truncated, empty inputs are replaced by a space (the API rejects them).
+    Returns a list of (indexes, texts, tokens) batches.
+    '''
+    def _plan_batches(self, texts: list[str]) -> list[tuple[list[int], list[str], int]]:
+        batches = []
+        indexes, batch_texts, batch_tokens = [], [], 0
+        for index, text in enumerate(texts):
+            text = text if text and text.strip() else " "
+            tokens = count_tokens(text)
+            if tokens > EMBEDDING_MAX_INPUT_TOKENS:
+                encoding = get_encoding(DEFAULT_ENCODING)
+                text = encoding.decode(encoding.encode(text, disallowed_special=())[:EMBEDDING_MAX_INPUT_TOKENS])
+                tokens = EMBEDDING_MAX_INPUT_TOKENS
+                print(f"[Embeddings] Input {index} was truncated to {EMBEDDING_MAX_INPUT_TOKENS} tokens.")
+            if batch_texts and (batch_tokens + tokens > EMBEDDING_MAX_BATCH_TOKENS or len(batch_texts) >= EMBEDDING_MAX_BATCH_INPUTS):
+                batches.append((indexes, batch_texts, batch_tokens))
+                indexes, batch_texts, batch_tokens = [], [], 0
+            indexes.append(index)
+            batch_texts.append(text)
+            batch_tokens += tokens
+        if batch_texts:
+            batches.append((indexes, batch_texts, batch_tokens))
+        return batches
+
+    async def _embed(self, texts: list[str], priority: int, session_id: str | None) -> list[list[float]]:
+        if not texts:
+            return []
+        started = time.monotonic()
+        self._get_client()
+        batches = self._plan_batches(texts)
+        results = await asyncio.gather(*(self._embed_batch(batch_texts, tokens, priority, session_id) for _, batch_texts, tokens in batches))
+
+        vectors = [None] * len(texts)
+        for (indexes, _, _), batch_vectors in zip(batches, results):
+            for index, vector in zip(indexes, batch_vectors):
+                vectors[index] = vector
+
+        seconds = time.monotonic() - started
+        tokens = sum(batch[2] for batch in batches)
+        with self._stats_lock:
+            self._stats["texts"] += len(texts)
+            self._stats["tokens"] += tokens
+            self._stats["seconds"] += seconds
+        if len(texts) > 1:
+            print(f"[Embeddings] {len(texts)} texts, {tokens} tokens in {len(batches)} requests on {self.deployment}, {seconds:.1f}s ({tokens / max(seconds, 0.001):.0f} tokens/s)")
+        return vectors
+
+    async def _embed_batch(self, batch_texts: list[str], tokens: int, priority: int, session_id: str | None) -> list[list[float]]:
+        for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+            async with self._semaphore:
+                async with get_llm_scheduler().reserve(self.deployment, tokens, priority, session_id) as reservation:
+                    try:
+                        raw_response = await self._client.embeddings.with_raw_response.create(model=self.deployment, input=batch_texts)
+                    except RateLimitError as e:
+                        # The scheduler pauses the deployment for Retry-After, the next attempt waits for it without sleeping here
+                        reservation.report_rate_limited(e)
+                        with self._stats_lock:
+                            self._stats["rate_limited"] += 1
+                        if attempt == EMBEDDING_MAX_RETRIES:
+                            raise
+                        continue
+                    reservation.update_from_headers(raw_response.headers)
+                    response = raw_response.parse()
+                    reservation.set_used_tokens(response.usage.total_tokens)
+            with self._stats_lock:
+                self._stats["requests"] += 1
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+'''
+LangChain Embeddings backed by an EmbeddingService, for Chroma and other LangChain components. Documents are embedded
+as batch work and queries as interactive work in the LLM scheduler.
+'''
+class ServiceEmbeddings(Embeddings):
+    def __init__(self, service: EmbeddingService, session_id: str | None = None):
+        self.service = service
+        self.session_id = session_id
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.service.embed(texts, PRIORITY_BATCH, self.session_id)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.service.embed([text], PRIORITY_INTERACTIVE, self.session_id)[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.service.aembed(texts, PRIORITY_BATCH, self.session_id)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.service.aembed([text], PRIORITY_INTERACTIVE, self.session_id))[0]
+
+'''
+Returns the shared embedding service for a deployment, endpoint and api version default to the CAD Azure OpenAI resource.
+'''
+def get_embedding_service(deployment: str, endpoint: str | None = None, api_version: str | None = None) -> EmbeddingService:
+    endpoint = endpoint or os.getenv("OPENAI_API_ENDPOINT")
+    api_version = api_version or os.getenv("OPENAI_API_EMBEDDING_VERSION", "2023-05-15")
+    key = (endpoint, deployment, api_version)
+    with _services_lock:
+        if key not in _services:
+            _services[key] = EmbeddingService(endpoint, deployment, api_version)
+        return _services[key]
@@ -1,6 +1,9 @@
 from ai_ml_tools.models.header import Header
 from io import BytesIO
 from PIL import Image
+from typing import BinaryIO
+import shutil
+import tempfile
 import fitz
 import re
 import csv
@@ -86,11 +89,13 @@ def extract_col_prompts(file):
     header_list = [Header(header, prompt) for header, prompt in zip(headers, prompts)]  
     return header_list 
 
+# Files larger than this are spilled from memory to a temporary file on disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
 # adds page numbers to PDFs by recreating them and adding them in the centre of the page
-def add_page_numbers(file: UploadFile) -> BytesIO:
-    input_bytes = file.file.read()
-    input_pdf = BytesIO(input_bytes)
-    reader = PdfReader(input_pdf)
+def add_page_numbers(file: UploadFile) -> BinaryIO:
+    file.file.seek(0)
+    reader = PdfReader(file.file)
     writer = PdfWriter()
     
     for page_num, page in enumerate(reader.pages):  
@@ -114,8 +119,16 @@ def add_page_numbers(file: UploadFile) -> BytesIO:
         page.merge_page(new_pdf.pages[0])  
         writer.add_page(page)  
 
-    # Write the modified PDF to a BytesIO object.  
-    output_pdf = BytesIO()  
+    # Write the modified PDF to a spooled temp file so large documents are kept on disk rather than in memory.  
+    output_pdf = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)  
     writer.write(output_pdf)  
     output_pdf.seek(0)  
-    return output_pdf  
\ No newline at end of file
+    return output_pdf  
+
+# Copies an upload to a spooled temp file that stays open after the request's form is closed, e.g. while a StreamingResponse is sent
+def copy_upload(file: UploadFile) -> UploadFile:
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    file.file.seek(0)
+    shutil.copyfileobj(file.file, spooled)
+    spooled.seek(0)
+    return UploadFile(file=spooled, filename=file.filename)
@@ -0,0 +1,358 @@
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+import asyncio
+import json
+import os
+import threading
+import time
+
+# Load enviroment variables
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
+
+# Priority classes, lower values are served first
+PRIORITY_INTERACTIVE = 0  # chat websockets, a user is waiting on the answer
+PRIORITY_BATCH = 1        # CSV analyzer, document extraction, scraper summaries
+
+# Budgets used for any deployment without its own entry in LLM_DEPLOYMENT_BUDGETS, e.g.
+# LLM_DEPLOYMENT_BUDGETS='{"gpt-4o-mini": {"tpm": 200000, "rpm": 1200, "max_concurrency": 16}}'
+DEFAULT_TPM = int(os.getenv("LLM_DEFAULT_TPM", "150000"))
+DEFAULT_RPM = int(os.getenv("LLM_DEFAULT_RPM", "900"))
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("LLM_DEFAULT_MAX_CONCURRENCY", "16"))
+
+# Bounds on how long a waiting request sleeps before checking the budget again
+MIN_POLL_SECONDS = 0.05
+MAX_POLL_SECONDS = 2.0
+
+# Model names used by the tools that are not Azure deployment names, mapped to the variable naming the deployment
+MODEL_DEPLOYMENT_ENV = {
+    "gpt4omini": "AZURE_OPENAI_GPT4_o_mini",
+    "gpt4o": "AZURE_OPENAI_GPT4_o",
+    "gpt41mini": "AZURE_OPENAI_GPT4_1_MINI",
+}
+
+'''
+Name of the Azure deployment behind a model name, used as its key in the scheduler so every caller of a deployment
+shares one budget. Model names in MODEL_DEPLOYMENT_ENV are resolved from the environment, others (e.g. "gpt-4o" in the
+chat tools, or AZURE_OPENAI_DEPLOYMENT) already are deployment names. Raises ValueError when no deployment is set.
+'''
+def deployment_name(model: str | None) -> str:
+    name = os.getenv(MODEL_DEPLOYMENT_ENV[model], "") if model in MODEL_DEPLOYMENT_ENV else model
+    if not name or not name.strip():
+        raise ValueError(f"No Azure OpenAI deployment is configured for '{model}'.")
+    return name.strip()
+
+'''
+Read the per-deployment budgets from the LLM_DEPLOYMENT_BUDGETS environment variable (JSON object keyed by deployment).
+'''
+def _load_deployment_budgets() -> dict:
+    raw = os.getenv("LLM_DEPLOYMENT_BUDGETS", "")
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except ValueError:
+        print("LLM_DEPLOYMENT_BUDGETS is not valid JSON, using default budgets.")
+        return {}
+
+'''
+Read the number of seconds to wait from 'retry-after-ms' or 'Retry-After' headers, None if neither is present.
+'''
+def retry_after_from_headers(headers) -> float | None:
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers.get("retry-after-ms")) / 1000
+        if headers.get("retry-after"):
+            return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        pass
+    return None
+
+'''
+A request waiting for budget. Granting is signalled through an asyncio future for async callers or a threading event for
+callers running in worker threads.
+'''
+class _Waiter:
+    def __init__(self, tokens: int, priority: int, session_id: str, loop: asyncio.AbstractEventLoop | None = None):
+        self.tokens = tokens
+        self.priority = priority
+        self.session_id = session_id
+        self.granted = False
+        self._loop = loop
+        self.future = loop.create_future() if loop else None
+        self.event = None if loop else threading.Event()
+
+    def grant(self):
+        self.granted = True
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._set_future)
+        else:
+            self.event.set()
+
+    def _set_future(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+'''
+Token and request buckets for one deployment, refilled continuously at tpm/60 and rpm/60 per second, with waiting
+requests queued per priority class and per session.
+'''
+class _DeploymentState:
+    def __init__(self, tpm: int, rpm: int, max_concurrency: int):
+        self.tpm = tpm
+        self.rpm = rpm
+        self.max_concurrency = max_concurrency
+        self.tokens = float(tpm)
+        self.requests = float(rpm)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.in_flight = 0
+        self.queues: dict[int, OrderedDict] = {}
+
+    def refill(self, now: float):
+        elapsed = now - self.updated
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        self.updated = now
+
+    def seconds_until_available(self, tokens: int, now: float) -> float:
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < tokens:
+            wait = max(wait, (tokens - self.tokens) * 60 / self.tpm)
+        if self.requests < 1:
+            wait = max(wait, (1 - self.requests) * 60 / self.rpm)
+        return wait
+
+'''
+A granted request. Callers report the provider's rate limit headers, 429 errors and the actual tokens used so the
+scheduler can adapt its budget.
+'''
+class Reservation:
+    def __init__(self, scheduler: "LLMScheduler", deployment: str, tokens: int):
+        self._scheduler = scheduler
+        self.deployment = deployment
+        self.tokens = tokens
+        self.used_tokens = None
+
+    def update_from_headers(self, headers):
+        self._scheduler.update_from_headers(self.deployment, headers)
+
+    def report_rate_limited(self, error=None):
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        self._scheduler.report_rate_limited(self.deployment, retry_after_from_headers(headers))
+
+    def set_used_tokens(self, tokens: int):
+        self.used_tokens = tokens
+
+'''
+LangChain callback that reports a chat model's rate limit headers and token usage to a reservation, for calls made
+through LangChain chains. The model must be built with include_response_headers=True for the headers to be reported.
+'''
+class ReservationCallback(BaseCallbackHandler):
+    def __init__(self, reservation: Reservation):
+        self.reservation = reservation
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                metadata = getattr(getattr(generation, "message", None), "response_metadata", None) or {}
+                self.reservation.update_from_headers(metadata.get("headers"))
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage.get("total_tokens") is not None:
+            self.reservation.set_used_tokens(int(usage["total_tokens"]))
+
+'''
+Central scheduler for LLM calls. Every caller reserves its estimated tokens on a deployment before calling it.
+Requests are granted while the deployment's tokens-per-minute, requests-per-minute and concurrency budgets allow,
+interactive requests before batch requests, and round-robin across sessions within a priority class so one large job
+cannot take the whole deployment.
+'''
+class LLMScheduler:
+    def __init__(self, budgets: dict | None = None):
+        self._budgets = budgets if budgets is not None else _load_deployment_budgets()
+        self._deployments: dict[str, _DeploymentState] = {}
+        self._lock = threading.Lock()
+
+    '''
+    Async context manager that waits for budget on the deployment and releases the request when the block exits.
+    '''
+    @asynccontextmanager
+    async def reserve(self, deployment: str, tokens: int, priority: int = PRIORITY_BATCH, session_id: str | None = None):
+        waiter = _Waiter(tokens, priority, session_id or "default", loop=asyncio.get_running_loop())
+        state = self._enqueue(deployment, waiter)
+        try:
+            while not waiter.granted:
+                await asyncio.wait({waiter.future}, timeout=self._poll_delay(state, waiter))
+                if not waiter.granted:
+                    self._dispatch_locked(state)
+        except BaseException:
+            self._abandon(state, waiter)
+            raise
+
+        reservation = Reservation(self, deployment, waiter.tokens)
+        try:
+            yield reservation
+        finally:
+            self._release(state, reservation)
+
+    '''
+    Blocking version of reserve for code running in worker threads. Must not be called on the event loop thread.
+    '''
+    @contextmanager
+    def reserve_sync(self, deployment: str, tokens: int, priority: int = PRIORITY_BATCH, session_id: str | None = None):
+        waiter = _Waiter(tokens, priority, session_id or "default")
+        state = self._enqueue(deployment, waiter)
+        try:
+            while not waiter.granted:
+                waiter.event.wait(self._poll_delay(state, waiter))
+                if not waiter.granted:
+                    self._dispatch_locked(state)
+        except BaseException:
+            self._abandon(state, waiter)
+            raise
+
+        reservation = Reservation(self, deployment, waiter.tokens)
+        try:
+            yield reservation
+        finally:
+            self._release(state, reservation)
+
+    '''
+    Lower the deployment's remaining budget to what the provider reports in its x-ratelimit-remaining-* headers.
+    '''
+    def update_from_headers(self, deployment: str, headers):
+        if not headers:
+            return
+        with self._lock:
+            state = self._get_state(deployment)
+            state.refill(time.monotonic())
+            try:
+                remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+                if remaining_tokens is not None:
+                    state.tokens = min(state.tokens, float(remaining_tokens))
+                remaining_requests = headers.get("x-ratelimit-remaining-requests")
+                if remaining_requests is not None:
+                    state.requests = min(state.requests, float(remaining_requests))
+            except (TypeError, ValueError):
+                pass
+
+    '''
+    Pause every request on the deployment after a 429, for retry_after seconds (defaults to 10).
+    '''
+    def report_rate_limited(self, deployment: str, retry_after: float | None = None):
+        with self._lock:
+            state = self._get_state(deployment)
+            state.paused_until = max(state.paused_until, time.monotonic() + (retry_after if retry_after is not None else 10))
+            state.tokens = min(state.tokens, 0.0)
+        print(f"[LLM] Rate limited on {deployment}, pausing for {retry_after if retry_after is not None else 10} seconds.")
+
+    '''
+    Returns a snapshot of each deployment's remaining budget and queue sizes.
+    '''
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            out = {}
+            for deployment, state in self._deployments.items():
+                state.refill(now)
+                out[deployment] = {
+                    "tokens_available": int(state.tokens),
+                    "requests_available": int(state.requests),
+                    "in_flight": state.in_flight,
+                    "paused_for": max(0.0, state.paused_until - now),
+                    "queued": {priority: sum(len(waiters) for waiters in sessions.values()) for priority, sessions in state.queues.items()},
+                }
+            return out
+
+    def _get_state(self, deployment: str) -> _DeploymentState:
+        state = self._deployments.get(deployment)
+        if state is None:
+            budget = self._budgets.get(deployment, {})
+            state = _DeploymentState(
+                tpm=int(budget.get("tpm", DEFAULT_TPM)),
+                rpm=int(budget.get("rpm", DEFAULT_RPM)),
+                max_concurrency=int(budget.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)),
+            )
+            self._deployments[deployment] = state
+        return state
+
+    def _enqueue(self, deployment: str, waiter: _Waiter) -> _DeploymentState:
+        with self._lock:
+            state = self._get_state(deployment)
+            # A single request larger than the whole budget could never be granted, cap it at the budget
+            waiter.tokens = max(1, min(int(waiter.tokens), state.tpm))
+            sessions = state.queues.setdefault(waiter.priority, OrderedDict())
+            sessions.setdefault(waiter.session_id, deque()).append(waiter)
+            self._dispatch(state)
+        return state
+
+    def _dispatch_locked(self, state: _DeploymentState):
+        with self._lock:
+            self._dispatch(state)
+
+    '''
+    Grant queued requests while the budget allows. Must be called with the lock held.
+    Priority classes are served strictly in order, sessions inside a class take turns (round-robin).
+    '''
+    def _dispatch(self, state: _DeploymentState):
+        now = time.monotonic()
+        state.refill(now)
+        if now < state.paused_until:
+            return
+
+        for priority in sorted(state.queues):
+            sessions = state.queues[priority]
+            while sessions:
+                session_id, waiters = next(iter(sessions.items()))
+                waiter = waiters[0]
+                if state.in_flight >= state.max_concurrency or state.requests < 1 or state.tokens < waiter.tokens:
+                    return
+
+                waiters.popleft()
+                sessions.pop(session_id)
+                if waiters:
+                    sessions[session_id] = waiters  # move the session to the back of the line
+                state.tokens -= waiter.tokens
+                state.requests -= 1
+                state.in_flight += 1
+                waiter.grant()
+
+    def _poll_delay(self, state: _DeploymentState, waiter: _Waiter) -> float:
+        with self._lock:
+            now = time.monotonic()
+            state.refill(now)
+            wait = state.seconds_until_available(waiter.tokens, now)
+        return min(MAX_POLL_SECONDS, max(MIN_POLL_SECONDS, wait))
+
+    def _abandon(self, state: _DeploymentState, waiter: _Waiter):
+        with self._lock:
+            if waiter.granted:
+                state.in_flight -= 1
+                self._dispatch(state)
+                return
+            sessions = state.queues.get(waiter.priority, {})
+            waiters = sessions.get(waiter.session_id)
+            if waiters and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del sessions[waiter.session_id]
+
+    def _release(self, state: _DeploymentState, reservation: Reservation):
+        with self._lock:
+            state.in_flight -= 1
+            # Refund the unused part of the estimate once the real usage is known
+            if reservation.used_tokens is not None and reservation.used_tokens < reservation.tokens:
+                state.tokens = min(state.tpm, state.tokens + reservation.tokens - reservation.used_tokens)
+            self._dispatch(state)
+
+_llm_scheduler = None
+_llm_scheduler_lock = threading.Lock()
+def get_llm_scheduler() -> LLMScheduler:
+    global _llm_scheduler
+    with _llm_scheduler_lock:
+        if _llm_scheduler is None:
+            _llm_scheduler = LLMScheduler()
+    return _llm_scheduler
@@ -1,19 +1,32 @@
-from openai import AzureOpenAI
-from langchain_openai import AzureOpenAIEmbeddings
+from openai import AzureOpenAI, AsyncAzureOpenAI, RateLimitError
 from langchain_core.documents import Document
 from langchain_chroma import Chroma
 from dotenv import load_dotenv
 from uuid import uuid4
-import tiktoken
+import asyncio
 import chromadb
 import json
 import os
+import re
 from ai_ml_tools.utils.azure_key_vault import get_OPENAI_API_KEY, get_OPENAI_API_KEY_US
+from ai_ml_tools.utils.tokenizer import count_tokens, count_messages_tokens
+from ai_ml_tools.utils.llm_scheduler import get_llm_scheduler, deployment_name, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from ai_ml_tools.utils.response_cache import get_response_cache, fingerprint
+from ai_ml_tools.utils.embedding_service import get_embedding_service, ServiceEmbeddings
+from ai_ml_tools.utils.retrieval import (
+    hybrid_rank, limit_to_token_budget,
+    RETRIEVAL_K, RETRIEVAL_CANDIDATES, RETRIEVAL_CONTEXT_TOKENS, RETRIEVAL_RERANK, RERANK_MODES,
+)
     
 # Load enviroment variables, was in main but backend failed to run unless placed here
 load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
 
 # Configure OpenAI settings
+# Completion tokens reserved in the LLM scheduler for each request, refunded once the real usage is known
+COMPLETION_TOKENS_ESTIMATE = 1000
+# Words sent per websocket chunk when replaying a cached answer
+REPLAY_WORDS_PER_CHUNK = 8
+
 US_models = ['o1', 'o3-mini']
 _openai_client_us = None  
 def get_openai_client_us():
@@ -38,16 +51,43 @@ def get_openai_client_cad():
         )
     return _openai_client_cad
 
+# Async clients used for streaming so reading a response does not block the event loop, one shared client per region
+_async_openai_client_us = None
+def get_async_openai_client_us():
+    global _async_openai_client_us
+    if _async_openai_client_us is None:
+        _async_openai_client_us = AsyncAzureOpenAI(
+            azure_endpoint = os.getenv('OPENAI_API_ENDPOINT_US'), 
+            api_key = get_OPENAI_API_KEY_US(),  
+            api_version = os.getenv('OPENAI_API_VERSION')
+        )
+    return _async_openai_client_us
+
+_async_openai_client_cad = None
+def get_async_openai_client_cad():
+    global _async_openai_client_cad
+    if _async_openai_client_cad is None:
+        _async_openai_client_cad = AsyncAzureOpenAI(
+            azure_endpoint = os.getenv('OPENAI_API_ENDPOINT'), 
+            api_key = get_OPENAI_API_KEY(),  
+            api_version = os.getenv('OPENAI_API_VERSION')
+        )
+    return _async_openai_client_cad
+
+# Chatbot embeddings go through the shared embedding service. OPENAI_API_EMBEDDING_ENDPOINT is the full deployment url,
+# the resource endpoint and deployment name are taken from it.
 _openai_client_embeddings = None
 def get_openai_client_embeddings():
     global _openai_client_embeddings
     if _openai_client_embeddings is None:
-        _openai_client_embeddings = AzureOpenAIEmbeddings(
-            model="text-embedding-3-large",
-            azure_endpoint = os.getenv('OPENAI_API_EMBEDDING_ENDPOINT'), 
-            api_key = get_OPENAI_API_KEY(),
-            openai_api_version = os.getenv('OPENAI_API_EMBEDDING_VERSION')
+        embedding_url = os.getenv('OPENAI_API_EMBEDDING_ENDPOINT')
+        deployment = re.search(r"/deployments/([^/?]+)", embedding_url)
+        service = get_embedding_service(
+            deployment.group(1) if deployment else "text-embedding-3-large",
+            endpoint = embedding_url.split("/openai/")[0],
+            api_version = os.getenv('OPENAI_API_EMBEDDING_VERSION')
         )
+        _openai_client_embeddings = ServiceEmbeddings(service)
     return _openai_client_embeddings
 
 # External (non-Azure) provider model lists — require user-supplied api_key
@@ -65,12 +105,10 @@ EXTERNAL_MODEL_MAP = {
 }
 
 '''
-Determines the amount of tokens for OpenAI's newer models a given string will consume.
+Determines the amount of tokens for OpenAI's newer models a given string will consume, uses the shared tokenizer.
 '''
-def num_tokens_from_string(string) -> int:
-    encoding = tiktoken.get_encoding('cl100k_base')
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
+def num_tokens_from_string(string, model=None) -> int:
+    return count_tokens(string, model)
 
 """
 Streams responses from external (non-Azure) LLM providers via LangChain.
@@ -113,26 +151,72 @@ async def _stream_external(messages, model, api_key, tokens_used):
         print(e)
         yield f"data: {{\"error\": \"Error fetching data from external provider: {str(e)}\"}}\n\n"
 
+# Static system prompt for the chat view. It is kept identical across every call so that the system message and the earlier
+# chat turns form a byte-stable prefix that the provider can cache, the retrieved document content is added to the last question instead.
+CHAT_SYSTEM_PROMPT = "You are a helpful assistant that ALWAYS responds in consistent and pleasing HTML formatted text. Also, make sure to use borders ONLY IF you use a table in your response. Only answer the LAST QUESTION based on the document provided with it. Do not answer any questions not related to the document or PDF. Also, at the end of the entire total response tell me what documents and pages you found the information on separated by commas ONLY. For example, at the end include: Source_page: <document-name1.pdf, 1, 4, etc, document-name2.pdf, 2, 5, etc,>."
+
 """
-Streams responses from OpenAI for the chat view. 
+Build the chat messages in a cache-friendly order: the static system prompt, the earlier turns unchanged, then the last
+question with the document content placed in front of it. Only the last message changes between turns.
 """
-async def request_openai_chat(chat_history: list, document_content: str, type="chat", model="gpt-4o", temperature=0.3, reasoning_effort="high", token_remaining=100000, isAuth=False, api_key: str = None):
-    if type == "chat":
-        if chat_history[0] == '' or chat_history[0]['role'] != "system":
-            messages = [{
-                "role": "system","content": "You are a helpful assistant that ALWAYS responds in consistent and pleasing HTML formatted text. Also, make sure to use borders ONLY IF you use a table in your response. Only answer the LAST QUESTION based on the document provided. Do not answer any questions not related to the document or PDF. Also, at the end of the entire total response tell me what documents and pages you found the information on separated by commas ONLY. For example, at the end include: Source_page: <document-name1.pdf, 1, 4, etc, document-name2.pdf, 2, 5, etc,>." + document_content
-            }]
-        else:
-            messages = []
+def build_chat_messages(chat_history: list, document_content: str, type="chat") -> list:
+    history = [message for message in chat_history if message != '']
+    if type == "chat" and history and history[0]['role'] == "system":
+        messages = []
     else:
-        messages = [{
-            "role": "system","content": "You are a helpful assistant that ALWAYS responds in consistent and pleasing HTML formatted text. Also, make sure to use borders ONLY IF you use a table in your response. Only answer the LAST QUESTION based on the document provided. Do not answer any questions not related to the document or PDF. Also, at the end of the entire total response tell me what documents and pages you found the information on separated by commas ONLY. For example, at the end include: Source_page: <document-name1.pdf, 1, 4, etc, document-name2.pdf, 2, 5, etc,>." + document_content
-        }] 
-    messages.extend(chat_history)
-    if messages[1] == '':
-        del messages[1]
-    new_message_string = json.dumps(messages)
-    tokens_used = num_tokens_from_string(new_message_string)
+        messages = [{"role": "system", "content": CHAT_SYSTEM_PROMPT}]
+    messages.extend(history)
+
+    if document_content and messages[-1]['role'] == "user":
+        messages[-1] = {
+            "role": "user",
+            "content": "[DOCUMENT]\n" + document_content + "\n\n[LAST QUESTION]\n" + messages[-1]['content'],
+        }
+    return messages
+
+"""
+Returns the number of prompt tokens served from the provider's prompt cache for a response's usage, 0 if not reported.
+"""
+def cached_tokens_from_usage(usage) -> int:
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+"""
+Returns the (cache scope, question) pair for a chat turn. The scope covers the document fingerprint and every earlier turn,
+so only a question asked at the same point of a conversation about the same documents can reuse a cached answer.
+"""
+def _chat_cache_prompt(chat_history: list, document_fingerprint: str):
+    history = [message for message in chat_history if message != '']
+    earlier_turns = [(message['role'], message['content']) for message in history[:-1]]
+    return fingerprint(document_fingerprint, earlier_turns), history[-1]['content']
+
+"""
+Look up a cached answer for the last question of a chat, None on a miss. May embed the question, call it off the event loop.
+"""
+def get_cached_chat_answer(chat_history: list, model: str, document_fingerprint: str):
+    scope, question = _chat_cache_prompt(chat_history, document_fingerprint)
+    return get_response_cache().get(model, scope, question)
+
+"""
+Replays a cached answer in the same SSE chunk format as request_openai_chat.
+"""
+async def replay_cached_chat(answer: str, tokens_used: int):
+    words = re.findall(r"\S+\s*", answer)
+    for start in range(0, len(words), REPLAY_WORDS_PER_CHUNK):
+        data = json.dumps({'content': "".join(words[start:start + REPLAY_WORDS_PER_CHUNK]), 'finish_reason': None, 'tokens_used': tokens_used, 'cached': True})
+        yield f"data: {data}\n\n"
+    data = json.dumps({'content': None, 'finish_reason': 'stop', 'tokens_used': tokens_used, 'cached': True})
+    yield f"data: {data}\n\n"
+
+"""
+Streams responses from OpenAI for the chat view. Azure requests go through the shared LLM scheduler as interactive
+requests, session_id lets the scheduler share the deployment fairly between chat sessions.
+When cache_fingerprint (a fingerprint of the documents) is given, a completed answer is stored in the response cache.
+"""
+async def request_openai_chat(chat_history: list, document_content: str, type="chat", model="gpt-4o", temperature=0.3, reasoning_effort="high", token_remaining=100000, isAuth=False, api_key: str = None, session_id: str = None, cache_fingerprint: str = None):
+    messages = build_chat_messages(chat_history, document_content, type)
+    # Earlier turns are cached by the tokenizer, only the new question and document content are tokenized
+    tokens_used = count_messages_tokens(messages, model)
     print(f"Input tokens: {tokens_used}")
 
     if (tokens_used > token_remaining) and not isAuth:
@@ -140,94 +224,153 @@ async def request_openai_chat(chat_history: list, document_content: str, type="c
         yield f"data: {data}\n\n"
     else:
         try:
-            if model in CAD_models:
-                openAIClient_CAD_models = get_openai_client_cad()
-                stream = openAIClient_CAD_models.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=temperature,
-                    frequency_penalty=0,
-                    presence_penalty=0,
-                    stop=None,
-                    stream=True
-                )
-            elif model in US_models:
-                openAIClient_US_models = get_openai_client_us()
-                stream = openAIClient_US_models.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    reasoning_effort=reasoning_effort,
-                    stop=None,
-                    stream=True
-                )
-            elif model in ANTHROPIC_models or model in GOOGLE_models or model in XAI_models:
+            if model in ANTHROPIC_models or model in GOOGLE_models or model in XAI_models:
                 async for chunk_data in _stream_external(messages, model, api_key, tokens_used):
                     yield chunk_data
                 return
-            else:
+            elif model not in CAD_models and model not in US_models:
                 raise ValueError(f"{model} is not a supported model name.")
 
-            for response in stream:
-                content = response.choices[0].delta.content if len(response.choices) > 0 else []
-                finish_reason = response.choices[0].finish_reason if len(response.choices) > 0 else None
-                data = json.dumps({'content': content, 'finish_reason': finish_reason,'tokens_used': tokens_used})
-                yield f"data: {data}\n\n"
+            answer_parts = []
+            async with get_llm_scheduler().reserve(deployment_name(model), tokens_used + COMPLETION_TOKENS_ESTIMATE, PRIORITY_INTERACTIVE, session_id) as reservation:
+                try:
+                    if model in CAD_models:
+                        openAIClient_CAD_models = get_async_openai_client_cad()
+                        raw_response = await openAIClient_CAD_models.chat.completions.with_raw_response.create(
+                            model=model,
+                            messages=messages,
+                            temperature=temperature,
+                            frequency_penalty=0,
+                            presence_penalty=0,
+                            stop=None,
+                            stream=True,
+                            stream_options={"include_usage": True}
+                        )
+                    else:
+                        openAIClient_US_models = get_async_openai_client_us()
+                        raw_response = await openAIClient_US_models.chat.completions.with_raw_response.create(
+                            model=model,
+                            messages=messages,
+                            reasoning_effort=reasoning_effort,
+                            stop=None,
+                            stream=True,
+                            stream_options={"include_usage": True}
+                        )
+                except RateLimitError as e:
+                    reservation.report_rate_limited(e)
+                    raise
+                reservation.update_from_headers(raw_response.headers)
+                stream = raw_response.parse()
+
+                async for response in stream:
+                    # The final chunk only carries usage, record how much of the prompt was served from cache
+                    if response.usage is not None:
+                        reservation.set_used_tokens(response.usage.total_tokens)
+                        print(f"Prompt tokens: {response.usage.prompt_tokens}, cached: {cached_tokens_from_usage(response.usage)}")
+                        if len(response.choices) == 0:
+                            continue
+                    content = response.choices[0].delta.content if len(response.choices) > 0 else []
+                    finish_reason = response.choices[0].finish_reason if len(response.choices) > 0 else None
+                    if content:
+                        answer_parts.append(content)
+                    if finish_reason == 'stop' and cache_fingerprint:
+                        scope, question = _chat_cache_prompt(chat_history, cache_fingerprint)
+                        await asyncio.to_thread(get_response_cache().set, model, scope, question, "".join(answer_parts))
+                    data = json.dumps({'content': content, 'finish_reason': finish_reason,'tokens_used': tokens_used})
+                    yield f"data: {data}\n\n"
 
         except Exception as e:
             print(e)
             yield f"data: {{'error': 'Error fetching data from OpenAI: {str(e)}'}}\n\n"
 
 """
-Obtain relevent document chunks for a given LLM chatbot question
+Format retrieved chunks for the prompt, each chunk preceded by its document name and page numbers.
+"""
+def format_chunks(indexes: list[int], document_chunks: list[str], document_metadata: list[dict]) -> str:
+    document_content = ''
+    for index in indexes:
+        document_content += json.dumps({"document_name": document_metadata[index]['document_name'], "page_numbers": document_metadata[index]["page_numbers"]}, indent=4) 
+        document_content += document_chunks[index]
+    return document_content
+
+"""
+Obtain relevent document chunks for a given LLM chatbot question. Chunks are ranked by both vector similarity (Chroma)
+and BM25 keyword scores, fused with reciprocal rank fusion so exact terms such as permit numbers or species codes are
+found, optionally reranked (see RERANK_MODES), then limited to k chunks and context_tokens tokens.
 """
-def get_relevent_chunks(chat_history: list[dict], document_chunks: list[str], document_metadata: list[dict]):
+def get_relevent_chunks(chat_history: list[dict], document_chunks: list[str], document_metadata: list[dict], k: int = RETRIEVAL_K, rerank: str = RETRIEVAL_RERANK, context_tokens: int = RETRIEVAL_CONTEXT_TOKENS):
+    if rerank not in RERANK_MODES:
+        raise ValueError(f"Rerank mode must be one of: {RERANK_MODES}")
     chromadb.api.client.SharedSystemClient.clear_system_cache()
 
     document_content = ''
     try:
-        document_objects = [Document(id=index,page_content=chunk,metadata={"document_name": document_metadata[index]['document_name'], "page_numbers": document_metadata[index]["page_numbers"]},) for index, chunk in enumerate(document_chunks)]
+        question = chat_history[-1]['content']
+        candidate_count = min(max(k, RETRIEVAL_CANDIDATES), len(document_chunks))
+        document_objects = [Document(page_content=chunk,metadata={"document_name": document_metadata[index]['document_name'], "page_numbers": document_metadata[index]["page_numbers"], "chunk_index": index},) for index, chunk in enumerate(document_chunks)]
         
         embeddings = get_openai_client_embeddings()
         vector_store = Chroma("example_collection", embedding_function=embeddings)
         uuids = [str(uuid4()) for _ in range(len(document_objects))]
 
         vector_store.add_documents(documents=document_objects, ids=uuids)
-        results = vector_store.similarity_search(chat_history[-1]['content'])
+        query_embedding = embeddings.embed_query(question)
+        vector_results = vector_store.similarity_search_by_vector(query_embedding, k=candidate_count)
+        vector_ranking = [result.metadata["chunk_index"] for result in vector_results]
+
+        def get_embeddings(indexes):
+            stored = vector_store._collection.get(ids=[uuids[index] for index in indexes], include=["embeddings", "metadatas"])
+            return {metadata["chunk_index"]: embedding for metadata, embedding in zip(stored["metadatas"], stored["embeddings"])}
+
+        ranked = hybrid_rank(question, document_chunks, vector_ranking, k, rerank, query_embedding, get_embeddings)
         vector_store.reset_collection()
-        print("Number of chunks used: "+str(len(results)))
 
-        for result in results:
-            document_content += json.dumps(result.metadata, indent=4) 
-            document_content += result.page_content
+        ranked = limit_to_token_budget(ranked, document_chunks, context_tokens)
+        print("Number of chunks used: "+str(len(ranked)))
+        document_content = format_chunks(ranked, document_chunks, document_metadata)
     except Exception as e:
         print(e)
     return document_content
 
 '''
-Using OpenAI API, generate a response on the given document-based conversation.
-''' 
-def request_openai_response(question, conversation_input, model="gpt-4o-mini", tempurature=0.3, reasoning_effort='high'):  
-    conversation_input.append({"role": "user", "content": question})
-    print(conversation_input)
-
+Create a (non-streaming) chat completion on an Azure deployment. The request waits for budget in the shared LLM
+scheduler as a batch request, and the deployment's rate limit headers and real token usage are reported back to it.
+'''
+def _create_chat_completion(messages, model, tempurature, reasoning_effort, session_id=None, **kwargs):
     if model in CAD_models:
-        openAIClient_CAD_models = get_openai_client_cad()
-        response = openAIClient_CAD_models.chat.completions.create(
-            model=model,
-            messages=conversation_input,
-            temperature=tempurature,
-            frequency_penalty=0,
-            presence_penalty=0,
-            stop=None)
+        client = get_openai_client_cad()
+        options = {"temperature": tempurature, "frequency_penalty": 0, "presence_penalty": 0}
     elif model in US_models:
-        openAIClient_US_models = get_openai_client_us()
-        response = openAIClient_US_models.chat.completions.create(
-            model=model,
-            messages=conversation_input,
-            reasoning_effort=reasoning_effort,
-            stop=None)
+        client = get_openai_client_us()
+        options = {"reasoning_effort": reasoning_effort}
     else:
         raise ValueError(f"{model} is not a supported model name.")
+
+    estimated_tokens = count_messages_tokens(messages, model) + COMPLETION_TOKENS_ESTIMATE
+    with get_llm_scheduler().reserve_sync(deployment_name(model), estimated_tokens, PRIORITY_BATCH, session_id) as reservation:
+        try:
+            raw_response = client.chat.completions.with_raw_response.create(
+                model=model,
+                messages=messages,
+                stop=None,
+                **options,
+                **kwargs)
+        except RateLimitError as e:
+            reservation.report_rate_limited(e)
+            raise
+        reservation.update_from_headers(raw_response.headers)
+        response = raw_response.parse()
+        reservation.set_used_tokens(response.usage.total_tokens)
+    return response
+
+'''
+Using OpenAI API, generate a response on the given document-based conversation.
+''' 
+def request_openai_response(question, conversation_input, model="gpt-4o-mini", tempurature=0.3, reasoning_effort='high', session_id=None):  
+    # a new list, so a call retried after a rate limit does not send the question twice
+    conversation_input = conversation_input + [{"role": "user", "content": question}]
+
+    response = _create_chat_completion(conversation_input, model, tempurature, reasoning_effort, session_id)
     
     conversation_input.append(
         {
@@ -237,5 +380,23 @@ def request_openai_response(question, conversation_input, model="gpt-4o-mini", t
     )
     
     api_usage = response.usage
-    print('(Tokens consumed: {0})\n'.format(api_usage.total_tokens))
-    return [conversation_input, response.choices[0].message.content, api_usage.total_tokens]
\ No newline at end of file
+    cached_tokens = cached_tokens_from_usage(api_usage)
+    print('(Tokens consumed: {0}, cached: {1})\n'.format(api_usage.total_tokens, cached_tokens))
+    return [conversation_input, response.choices[0].message.content, api_usage.total_tokens, cached_tokens]
+
+'''
+Using OpenAI API, generate a JSON response that follows the given JSON schema (structured outputs).
+Returns the parsed JSON object and the number of tokens consumed.
+'''
+def request_openai_structured_response(messages, schema_name, schema, model="gpt-4o-mini", tempurature=0.3, reasoning_effort='high', session_id=None):
+    response_format = {
+        "type": "json_schema",
+        "json_schema": {"name": schema_name, "schema": schema, "strict": True},
+    }
+
+    response = _create_chat_completion(messages, model, tempurature, reasoning_effort, session_id, response_format=response_format)
+
+    api_usage = response.usage
+    cached_tokens = cached_tokens_from_usage(api_usage)
+    print('(Tokens consumed: {0}, cached: {1})\n'.format(api_usage.total_tokens, cached_tokens))
+    return [json.loads(response.choices[0].message.content), api_usage.total_tokens, cached_tokens]
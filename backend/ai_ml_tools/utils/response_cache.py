@@ -0,0 +1,151 @@
+from cachetools import LRUCache, TTLCache
+from dotenv import load_dotenv
+import hashlib
+import json
+import numpy as np
+import os
+import re
+import threading
+
+# Load enviroment variables
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
+
+# Cached answers expire after RESPONSE_CACHE_TTL seconds, the least recently stored are evicted past RESPONSE_CACHE_MAX_ENTRIES
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+# Cosine similarity a question must reach to reuse the answer of a different wording, 0 turns off similarity matching
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+# Question embeddings kept so storing an answer does not embed the question a second time
+QUERY_EMBEDDING_CACHE_SIZE = 512
+
+'''
+Lowercase a prompt, drop punctuation and collapse whitespace so trivially different wordings share a cache key.
+'''
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", (prompt or "").lower()).split())
+
+'''
+Returns a stable hash of the given parts (documents, chunks, collection ids, ...), used to scope cached answers to the
+exact content they were generated from.
+'''
+def fingerprint(*parts) -> str:
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8", "ignore")).hexdigest()
+
+'''
+Cache of LLM answers keyed by (model, document fingerprint, normalized prompt). A lookup first tries the exact key, then
+compares the question's embedding with the cached questions for the same model and document and reuses the closest
+answer above the similarity threshold. Entries expire after a TTL and the cache is bounded in size.
+'''
+class ResponseCache:
+    def __init__(self, maxsize: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: int = RESPONSE_CACHE_TTL, similarity_threshold: float = RESPONSE_CACHE_SIMILARITY, embed_query=None):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._query_embeddings = LRUCache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)
+        self._lock = threading.Lock()
+        self._embed_query = embed_query
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    '''
+    Returns the cached answer for the prompt, None on a miss. semantic=False only allows exact (normalized) matches.
+    '''
+    def get(self, model: str, document_fingerprint: str, prompt: str, semantic: bool = True):
+        scope = self._scope(model, document_fingerprint)
+        normalized = normalize_prompt(prompt)
+        with self._lock:
+            entry = self._entries.get(self._key(scope, normalized))
+            if entry is not None:
+                self.hits += 1
+                return entry["value"]
+            self._entries.expire()
+            candidates = [entry for entry in self._entries.values() if entry["scope"] == scope and entry["embedding"] is not None]
+
+        if semantic and candidates and self._semantic_enabled():
+            embedding = self._embedding(normalized)
+            if embedding is not None:
+                best_score, best_entry = 0.0, None
+                for entry in candidates:
+                    score = float(np.dot(embedding, entry["embedding"]))
+                    if score > best_score:
+                        best_score, best_entry = score, entry
+                if best_entry is not None and best_score >= self.similarity_threshold:
+                    print(f"[Response cache] Similar question hit ({best_score:.3f}): '{normalized}' ~ '{best_entry['prompt']}'")
+                    with self._lock:
+                        self.hits += 1
+                        self.semantic_hits += 1
+                    return best_entry["value"]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    '''
+    Store an answer for the prompt. semantic=False stores it for exact matches only, without embedding the question.
+    '''
+    def set(self, model: str, document_fingerprint: str, prompt: str, value, semantic: bool = True):
+        scope = self._scope(model, document_fingerprint)
+        normalized = normalize_prompt(prompt)
+        embedding = self._embedding(normalized) if semantic and self._semantic_enabled() else None
+        with self._lock:
+            self._entries[self._key(scope, normalized)] = {"scope": scope, "prompt": normalized, "embedding": embedding, "value": value}
+
+    '''
+    Returns the hit and miss counters and the number of cached answers.
+    '''
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "semantic_hits": self.semantic_hits, "misses": self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._query_embeddings.clear()
+
+    def _semantic_enabled(self) -> bool:
+        return self.similarity_threshold > 0 and self._embed_query is not None
+
+    @staticmethod
+    def _scope(model: str, document_fingerprint: str) -> str:
+        return f"{model}\0{document_fingerprint}"
+
+    @staticmethod
+    def _key(scope: str, normalized_prompt: str) -> str:
+        return hashlib.sha1(f"{scope}\0{normalized_prompt}".encode("utf-8", "ignore")).hexdigest()
+
+    '''
+    Returns the normalized (unit length) embedding of a normalized prompt, None if the embedding request fails.
+    '''
+    def _embedding(self, normalized_prompt: str):
+        with self._lock:
+            embedding = self._query_embeddings.get(normalized_prompt)
+        if embedding is not None:
+            return embedding
+        try:
+            embedding = np.asarray(self._embed_query(normalized_prompt), dtype=np.float32)
+        except Exception as e:
+            print(f"[Response cache] Could not embed question, using exact matches only: {e}")
+            return None
+        norm = np.linalg.norm(embedding)
+        if norm == 0:
+            return None
+        embedding = embedding / norm
+        with self._lock:
+            self._query_embeddings[normalized_prompt] = embedding
+        return embedding
+
+'''
+Embed a question with the shared Azure embedding client.
+'''
+def _embed_with_azure(text: str) -> list[float]:
+    from ai_ml_tools.utils.openai import get_openai_client_embeddings
+    return get_openai_client_embeddings().embed_query(text)
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+def get_response_cache() -> ResponseCache:
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(embed_query=_embed_with_azure)
+    return _response_cache
@@ -0,0 +1,184 @@
+from cachetools import LRUCache
+from collections import Counter, defaultdict
+from dotenv import load_dotenv
+import hashlib
+import json
+import math
+import numpy as np
+import os
+import re
+import threading
+from ai_ml_tools.utils.tokenizer import count_tokens
+
+# Load enviroment variables
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
+
+# Chunks returned for a question, candidates taken from each of the BM25 and vector rankings before fusion
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "6"))
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+# Token budget for the retrieved chunks added to the prompt, lower ranked chunks past it are left out
+RETRIEVAL_CONTEXT_TOKENS = int(os.getenv("RETRIEVAL_CONTEXT_TOKENS", "6000"))
+# Reranking of the fused candidates: none, mmr (diversity using the chunk embeddings) or cross_encoder (local model)
+RERANK_MODES = ["none", "mmr", "cross_encoder"]
+RETRIEVAL_RERANK = os.getenv("RETRIEVAL_RERANK", "none")
+# Local cross-encoder used by the cross_encoder mode, requires the optional sentence-transformers package
+CROSS_ENCODER_MODEL = os.getenv("RETRIEVAL_CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+RRF_K = 60          # Standard reciprocal rank fusion constant, damps the weight of the top few ranks
+MMR_LAMBDA = 0.7    # Relevance vs. diversity trade-off for MMR, 1 is pure relevance
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# BM25 indexes keyed by a hash of the chunks, so a conversation about the same documents only builds its index once
+_bm25_cache = LRUCache(maxsize=64)
+_bm25_cache_lock = threading.Lock()
+_cross_encoder = None
+_cross_encoder_lock = threading.Lock()
+
+'''
+Split text into lowercase terms for BM25. Identifiers such as permit numbers or species codes ("AB-1234", "3.2.1") are
+kept whole and also indexed by their parts, so either form of the query matches.
+'''
+def bm25_terms(text: str) -> list[str]:
+    terms = []
+    for token in re.findall(r"\w+(?:[-./:]\w+)*", (text or "").lower()):
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in re.split(r"[-./:_]", token) if part)
+    return terms
+
+'''
+Okapi BM25 over a fixed list of texts. The inverted index (term -> postings of (text index, term frequency)) is built once
+so a search only touches the postings of the query terms.
+'''
+class BM25Index:
+    def __init__(self, texts: list[str], k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.size = len(texts)
+        self.lengths = []
+        self.postings = defaultdict(list)
+        for index, text in enumerate(texts):
+            terms = bm25_terms(text)
+            self.lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                self.postings[term].append((index, frequency))
+        self.average_length = (sum(self.lengths) / self.size) if self.size else 0
+        self.idf = {term: math.log(1 + (self.size - len(postings) + 0.5) / (len(postings) + 0.5)) for term, postings in self.postings.items()}
+
+    '''
+    Returns up to k (text index, score) pairs, best first. Texts sharing no term with the query are not returned.
+    '''
+    def search(self, query: str, k: int) -> list[tuple[int, float]]:
+        scores = defaultdict(float)
+        for term in set(bm25_terms(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for index, frequency in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / (self.average_length or 1))
+                scores[index] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+'''
+Returns the BM25 index for the given chunks, built on first use and cached by the chunks' hash.
+'''
+def get_bm25_index(texts: list[str]) -> BM25Index:
+    key = hashlib.sha1(json.dumps(texts).encode("utf-8", "ignore")).hexdigest()
+    with _bm25_cache_lock:
+        index = _bm25_cache.get(key)
+    if index is None:
+        index = BM25Index(texts)
+        with _bm25_cache_lock:
+            _bm25_cache[key] = index
+    return index
+
+'''
+Fuse several rankings (lists of ids, best first) with reciprocal rank fusion. Returns (id, score) pairs, best first.
+'''
+def reciprocal_rank_fusion(rankings: list[list], rrf_k: int = RRF_K) -> list[tuple]:
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] += 1 / (rrf_k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+'''
+Maximal marginal relevance: pick k candidates that are relevant to the query but not near duplicates of each other.
+embeddings maps each candidate to its embedding, candidates without one keep their order after the selected ones.
+'''
+def mmr_rerank(query_embedding, candidates: list, embeddings: dict, k: int, lambda_mult: float = MMR_LAMBDA) -> list:
+    with_vectors = [candidate for candidate in candidates if embeddings.get(candidate) is not None]
+    if not with_vectors:
+        return candidates[:k]
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1)
+    vectors = np.asarray([embeddings[candidate] for candidate in with_vectors], dtype=np.float32)
+    vectors = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+    relevance = vectors @ query
+
+    selected = []
+    remaining = list(range(len(with_vectors)))
+    while remaining and len(selected) < k:
+        if selected:
+            redundancy = (vectors[remaining] @ vectors[selected].T).max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * redundancy
+        best = remaining[int(np.argmax(scores))]
+        selected.append(best)
+        remaining.remove(best)
+
+    ranked = [with_vectors[index] for index in selected]
+    ranked.extend(candidate for candidate in candidates if candidate not in ranked)
+    return ranked[:k]
+
+'''
+Rerank candidates with a local cross-encoder. Returns the candidates unchanged if sentence-transformers is not installed.
+'''
+def cross_encoder_rerank(query: str, candidates: list, texts: dict, k: int) -> list:
+    global _cross_encoder
+    try:
+        with _cross_encoder_lock:
+            if _cross_encoder is None:
+                from sentence_transformers import CrossEncoder
+                _cross_encoder = CrossEncoder(CROSS_ENCODER_MODEL)
+    except ImportError:
+        print("sentence-transformers is not installed, skipping cross-encoder reranking.")
+        return candidates[:k]
+    scores = _cross_encoder.predict([(query, texts[candidate]) for candidate in candidates])
+    ranked = sorted(zip(candidates, scores), key=lambda item: item[1], reverse=True)
+    return [candidate for candidate, _ in ranked[:k]]
+
+'''
+Keep chunks in rank order until the token budget is used, always keeping at least the best one.
+'''
+def limit_to_token_budget(candidates: list, texts: dict, max_tokens: int, model: str | None = None) -> list:
+    kept = []
+    used = 0
+    for candidate in candidates:
+        tokens = count_tokens(texts[candidate], model)
+        if kept and used + tokens > max_tokens:
+            break
+        kept.append(candidate)
+        used += tokens
+    return kept
+
+'''
+Rank chunks for a question: fuse the vector ranking (chunk indexes, best first) with a BM25 ranking of the texts, then
+rerank the fused candidates. get_embeddings(indexes) -> {index: embedding} is only called for MMR. Returns up to k
+chunk indexes, best first.
+'''
+def hybrid_rank(question: str, texts: list[str], vector_ranking: list[int], k: int = RETRIEVAL_K, rerank: str = RETRIEVAL_RERANK, query_embedding=None, get_embeddings=None) -> list[int]:
+    if rerank not in RERANK_MODES:
+        raise ValueError(f"Rerank mode must be one of: {RERANK_MODES}")
+    candidate_count = max(len(vector_ranking), min(max(k, RETRIEVAL_CANDIDATES), len(texts)))
+    bm25_ranking = [index for index, _ in get_bm25_index(texts).search(question, candidate_count)]
+    fused = [index for index, _ in reciprocal_rank_fusion([vector_ranking, bm25_ranking])]
+    print(f"Retrieval candidates: {len(vector_ranking)} vector, {len(bm25_ranking)} keyword, {len(fused)} fused")
+
+    if rerank == "mmr" and query_embedding is not None and get_embeddings is not None:
+        return mmr_rerank(query_embedding, fused, get_embeddings(fused), k)
+    if rerank == "cross_encoder":
+        return cross_encoder_rerank(question, fused, texts, k)
+    return fused[:k]
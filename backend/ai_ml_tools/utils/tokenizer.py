@@ -0,0 +1,71 @@
+from cachetools import LRUCache
+from functools import lru_cache
+import hashlib
+import threading
+import tiktoken
+
+# Encoding used by each supported OpenAI model, anything not listed falls back to DEFAULT_ENCODING
+MODEL_ENCODINGS = {
+    'gpt-4o': 'o200k_base',
+    'gpt-4o-mini': 'o200k_base',
+    'o1': 'o200k_base',
+    'o3-mini': 'o200k_base',
+}
+DEFAULT_ENCODING = 'cl100k_base'
+
+# Tokens added by the chat format for every message and for priming the reply (see OpenAI's token counting guide)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Token counts of previously seen messages keyed by a hash of (encoding, role, content), so a chat turn only tokenizes new messages
+_message_token_cache = LRUCache(maxsize=20000)
+_message_token_cache_lock = threading.Lock()
+
+'''
+Returns the tiktoken encoding with the given name, each encoding is only loaded once per process.
+'''
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = DEFAULT_ENCODING) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(encoding_name)
+
+'''
+Returns the encoding name used by a model, DEFAULT_ENCODING if the model is unknown or not given.
+'''
+def encoding_name_for_model(model: str | None = None) -> str:
+    return MODEL_ENCODINGS.get(model, DEFAULT_ENCODING)
+
+'''
+Determines the amount of tokens a given string will consume for the given model.
+'''
+def count_tokens(text: str, model: str | None = None) -> int:
+    return len(get_encoding(encoding_name_for_model(model)).encode(text or "", disallowed_special=()))
+
+'''
+Returns the token count of a single chat message's content, cached by message hash.
+'''
+def count_message_tokens(message: dict, model: str | None = None) -> int:
+    encoding_name = encoding_name_for_model(model)
+    content = message.get('content') or ''
+    if not isinstance(content, str):
+        content = str(content)
+    key = hashlib.sha1(f"{encoding_name}\0{message.get('role', '')}\0{content}".encode("utf-8", "ignore")).hexdigest()
+
+    with _message_token_cache_lock:
+        cached = _message_token_cache.get(key)
+    if cached is not None:
+        return cached
+
+    num_tokens = len(get_encoding(encoding_name).encode(content, disallowed_special=())) + count_tokens(message.get('role', ''), model)
+    with _message_token_cache_lock:
+        _message_token_cache[key] = num_tokens
+    return num_tokens
+
+'''
+Determines the amount of prompt tokens a list of chat messages will consume. Messages that were counted before,
+such as earlier turns of a conversation, are read from the cache so only new messages are tokenized.
+'''
+def count_messages_tokens(messages: list, model: str | None = None) -> int:
+    num_tokens = TOKENS_PER_REPLY
+    for message in messages:
+        num_tokens += TOKENS_PER_MESSAGE + count_message_tokens(message, model)
+    return num_tokens
@@ -0,0 +1,87 @@
+from typing import Optional, Tuple
+import pandas as pd
+import pdfplumber
+import zipfile
+from docx import Document
+
+# Text extraction of downloaded files linked from crawled sites. These are CPU bound and run in the crawler's process
+# pool (see run_cpu_bound in scrape.py), so this module only imports what the extraction needs.
+
+def extract_csv_text(path: str) -> str:
+    """Read a CSV file into a DataFrame and return Markdown table"""
+    df = pd.read_csv(path)
+    return df.to_markdown(index=False)
+
+def extract_xlsx_text(path: str) -> str:
+    """Read an XLSX file into a DataFrame and return Markdown table."""
+    df = pd.read_excel(path)
+    return df.to_markdown(index=False)
+
+def extract_pdf_text(path: str, max_pages: Optional[int] = None) -> str:
+    """
+    Extract text from the pages of a PDF file (basic text layer only), one page at a time. Each page is closed once
+    its text is read, so memory use is bounded by one page rather than the whole document.
+    """
+    parts = []
+    with pdfplumber.open(path) as pdf:
+        for number, page in enumerate(pdf.pages):
+            if max_pages is not None and number >= max_pages:
+                print(f"PDF has more than {max_pages} pages, the rest is skipped: {path}")
+                break
+            parts.append(page.extract_text() or "")
+            page.close()
+    return "\n".join(parts).strip()
+
+def extract_docx_text(path: str) -> str:
+    """Extract paragraph text of a DOCX file."""
+    doc = Document(path)
+    text = "\n".join(p.text for p in doc.paragraphs)
+    return text.strip()
+
+def sniff_file_kind(path: str, content_type: str = "", hint: str = "") -> Optional[str]:
+    """
+    Detect the kind of a downloaded file from its content rather than the link's extension: PDFs by their header,
+    DOCX/XLSX by the parts inside the zip, CSV by the Content-Type (or the hint, unless the server sent HTML).
+    hint is the kind suggested by the link (e.g. its extension). Returns None for anything else.
+    """
+    with open(path, "rb") as f:
+        head = f.read(8)
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    if head.startswith(b"PK\x03\x04"):
+        try:
+            with zipfile.ZipFile(path) as archive:
+                names = set(archive.namelist())
+        except zipfile.BadZipFile:
+            return None
+        if "word/document.xml" in names:
+            return "docx"
+        if "xl/workbook.xml" in names:
+            return "xlsx"
+        return None
+    if "html" in content_type:
+        return None
+    if "csv" in content_type or hint == "csv":
+        return "csv"
+    return None
+
+def extract_file_text(path: str, content_type: str = "", hint: str = "", url: str = "", max_pdf_pages: Optional[int] = None) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Detect the kind of a downloaded file (see sniff_file_kind) and extract its text.
+    Returns (kind, text), kind is None when the file is not a supported document and text is None on failure.
+    """
+    try:
+        kind = sniff_file_kind(path, content_type, hint)
+        if kind is None:
+            print(f"⚠️ Not a supported document ({content_type or 'unknown type'}): {url or path}")
+            return None, None
+        if kind == "pdf":
+            return kind, extract_pdf_text(path, max_pdf_pages)
+        if kind == "docx":
+            return kind, extract_docx_text(path)
+        if kind == "xlsx":
+            return kind, extract_xlsx_text(path)
+        return kind, extract_csv_text(path)
+    except Exception as e:
+        print(f"❌ {(hint or 'file').upper()} extract failed for {url or path}: {e}")
+        return hint or None, None
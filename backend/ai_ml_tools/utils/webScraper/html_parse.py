@@ -0,0 +1,100 @@
+from urllib.parse import urljoin, urlparse, urlunparse
+from typing import Dict, List
+import lxml.html
+import json, re
+
+# Pages are parsed from UTF-8 bytes, lxml refuses str input that carries its own encoding declaration
+_HTML_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+# Tags whose text is not page content
+_NON_TEXT_TAGS = {"script", "style"}
+
+def normalizeUrl(u: str) -> str:
+    """
+    Normalize URL but KEEP the #fragment so client-side hash routes
+    (e.g., /#2012 vs /#2013) are treated as distinct pages.
+    """
+    p = urlparse(u.strip())
+    # normalize scheme/host, keep path/query/fragment as-is
+    p = p._replace(scheme=p.scheme.lower(), netloc=p.netloc.lower())
+    return urlunparse(p)
+
+def _parse_jsonld(raw: str) -> list:
+    raw = (raw or "").strip()
+    if not raw:
+        return []
+    try:
+        raw = re.sub(r"/\*.*?\*/", "", raw, flags=re.S) # strip /* */
+        raw = re.sub(r"^\s*//.*?$", "", raw, flags=re.M) # strip //
+        data = json.loads(re.sub(r",\s*([}\]])", r"\1", raw)) # fix trailing commas
+        return data if isinstance(data, list) else [data]
+    except Exception:
+        return []
+
+def _body_text(body) -> str:
+    """Readable text of <body> without script/style, one line per text node, blank lines dropped."""
+    parts = []
+    for element in body.iter():
+        # comments and processing instructions only contribute their tail text
+        if isinstance(element.tag, str) and element.tag not in _NON_TEXT_TAGS and element.text:
+            parts.append(element.text)
+        if element is not body and element.tail:
+            parts.append(element.tail)
+    return "\n".join(line.strip() for line in "\n".join(parts).splitlines() if line.strip())
+
+def parse_page(html: str, base_url: str) -> Dict[str, object]:
+    """
+    Parse a crawled page once and return everything the crawler needs from it:
+      links   - <a href> targets absolutized to full URLs (including fragments), plus synthetic #fragment URLs for
+                <a href="#" id="2023"> style navigation
+      jsonld  - parsed JSON-LD blocks
+      meta    - title, description and favicon from the <head> (used when crawl4ai has no metadata)
+      text    - readable <body> text without script/style
+    """
+    page = {"links": [], "jsonld": [], "meta": {"title": "", "description": "", "favicon": ""}, "text": ""}
+    if not html or not html.strip():
+        return page
+    try:
+        doc = lxml.html.document_fromstring(html.encode("utf-8", "ignore"), parser=_HTML_PARSER)
+    except Exception:
+        return page
+
+    links: List[str] = []
+    fragment_links: List[str] = []
+    metas: Dict[str, str] = {}
+    favicon = ""
+    for element in doc.iter("a", "meta", "link", "script"):
+        tag = element.tag
+        if tag == "a":
+            href = (element.get("href") or "").strip()
+            # Some sites use <a href="#"> and put the real route/state in the <a id="2023">
+            if href == "#" and (element.get("id") or "").strip():
+                fragment_links.append(normalizeUrl(urljoin(base_url, "#" + element.get("id").strip())))
+            if not href or href.startswith(("mailto:", "javascript:")):
+                continue
+            full = normalizeUrl(urljoin(base_url, href))
+            links.append(full)
+            if href.startswith("#") and len(href) > 1:
+                fragment_links.append(full)
+        elif tag == "meta":
+            key = (element.get("name") or element.get("property") or "").strip().lower()
+            if key and key not in metas:
+                metas[key] = (element.get("content") or "").strip()
+        elif tag == "link":
+            if not favicon and "icon" in (element.get("rel") or "").lower() and (element.get("href") or "").strip():
+                favicon = urljoin(base_url, element.get("href").strip())
+        elif "ld+json" in (element.get("type") or "").lower():
+            page["jsonld"].extend(_parse_jsonld(element.text_content()))
+    page["links"] = links + fragment_links
+
+    title = (doc.findtext(".//title") or "").strip()
+    page["meta"] = {
+        "title": title or metas.get("og:title") or metas.get("twitter:title") or "",
+        "description": metas.get("description") or metas.get("og:description") or metas.get("twitter:description") or "",
+        "favicon": favicon,
+    }
+
+    body = doc.find("body")
+    if body is not None:
+        page["text"] = _body_text(body)
+    return page
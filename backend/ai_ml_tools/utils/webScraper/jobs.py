@@ -0,0 +1,164 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+from dotenv import load_dotenv
+import os, threading, time, uuid
+
+# ---------- Load environment variables ----------
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env'))
+
+# ---------- Variables ----------
+# Scrapes that run at once in this process, further jobs wait in the queue until one finishes
+SCRAPE_MAX_CONCURRENT_JOBS = int(os.getenv("SCRAPE_MAX_CONCURRENT_JOBS", "2"))
+# Seconds a finished job stays available to the status routes
+SCRAPE_JOB_TTL = int(os.getenv("SCRAPE_JOB_TTL", "3600"))
+
+FINISHED_STATES = {"done", "error", "cancelled"}
+
+class ScrapeJobFailed(Exception):
+    """A scrape job failure that is reported to the client with a reason and a readable message."""
+    def __init__(self, reason: str, message: str, detail: str = ""):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+        self.detail = detail
+
+class ScrapeJob:
+    """
+    State of one background scrape, updated by the job's thread and read by the status routes.
+    status is queued, running, done, error or cancelled, phase the step of a running job (crawling, embedding).
+    Every update bumps version, so watchers only send a snapshot when something changed.
+    """
+    def __init__(self, url: str):
+        self.id = str(uuid.uuid4())
+        self.url = url
+        self.status = "queued"
+        self.phase = None
+        self.cancel_event = threading.Event()
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.phase_started_at = None
+        self.pages_crawled = 0
+        self.pages_queued = 0
+        self.pages_chunked = 0
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.result = None
+        self.error = None
+        self.version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def update(self, **fields):
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+
+    def start_phase(self, phase: str):
+        self.update(phase=phase, phase_started_at=time.time())
+
+    def _eta_seconds(self, now: float) -> Optional[float]:
+        # Remaining work of the current phase at the rate seen so far in that phase
+        if self.status != "running" or not self.phase_started_at:
+            return None
+        elapsed = now - self.phase_started_at
+        if self.phase == "crawling" and self.pages_crawled:
+            return round(elapsed / self.pages_crawled * self.pages_queued, 1)
+        # pages are chunked while their chunks are embedded, so the embedding phase is measured in pages
+        if self.phase == "embedding" and self.pages_chunked:
+            return round(elapsed / self.pages_chunked * (self.pages_crawled - self.pages_chunked), 1)
+        return None
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        with self._lock:
+            snapshot = {
+                "job_id": self.id,
+                "url": self.url,
+                "status": self.status,
+                "phase": self.phase,
+                "pages_crawled": self.pages_crawled,
+                "pages_queued": self.pages_queued,
+                "pages_chunked": self.pages_chunked,
+                "chunks_total": self.chunks_total,
+                "chunks_embedded": self.chunks_embedded,
+                "elapsed_seconds": round((self.finished_at or now) - self.started_at, 1) if self.started_at else 0,
+                "eta_seconds": self._eta_seconds(now),
+                "version": self.version,
+            }
+            if self.result is not None:
+                snapshot["result"] = self.result
+            if self.error is not None:
+                snapshot["error"] = self.error
+        return snapshot
+
+class ScrapeJobManager:
+    """
+    Runs scrape jobs on a bounded thread pool, so at most max_concurrent crawls run at once in this process and the
+    rest wait queued. A URL has at most one active job: submitting it again returns the job already queued or running.
+    Finished jobs are kept SCRAPE_JOB_TTL seconds for the status routes.
+    """
+    def __init__(self, max_concurrent: int = SCRAPE_MAX_CONCURRENT_JOBS):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_concurrent), thread_name_prefix="scrape-job")
+        self._jobs: Dict[str, ScrapeJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, url: str, run: Callable[[ScrapeJob], dict]) -> tuple[ScrapeJob, bool]:
+        """Queue run(job) for a URL. Returns (job, created), created is False when the URL already had an active job."""
+        with self._lock:
+            self._prune()
+            for job in self._jobs.values():
+                if job.url == url and not job.finished:
+                    return job, False
+            job = ScrapeJob(url)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, run)
+        return job, True
+
+    def get(self, job_id: str) -> Optional[ScrapeJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[ScrapeJob]:
+        """Ask a job to stop. A queued job is cancelled right away, a running one at its next check."""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+        job.cancel_event.set()
+        if job.status == "queued":
+            job.update(status="cancelled", finished_at=time.time())
+        return job
+
+    def _run(self, job: ScrapeJob, run: Callable[[ScrapeJob], dict]):
+        if job.cancel_event.is_set():
+            return
+        job.update(status="running", started_at=time.time())
+        try:
+            result = run(job)
+            job.update(status="done", result=result, finished_at=time.time())
+        except ScrapeJobFailed as e:
+            job.update(status="error", error={"reason": e.reason, "message": e.message, "detail": e.detail}, finished_at=time.time())
+        except Exception as e:
+            if job.cancel_event.is_set():
+                job.update(status="cancelled", finished_at=time.time())
+            else:
+                print(f"❌ Scrape job {job.id} for {job.url} failed: {e}")
+                job.update(status="error", error={"reason": "failed", "message": "The scrape failed.", "detail": str(e)}, finished_at=time.time())
+
+    def _prune(self):
+        expired = time.time() - SCRAPE_JOB_TTL
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < expired]:
+            del self._jobs[job_id]
+
+_scrape_jobs = None
+_scrape_jobs_lock = threading.Lock()
+def get_scrape_jobs() -> ScrapeJobManager:
+    global _scrape_jobs
+    with _scrape_jobs_lock:
+        if _scrape_jobs is None:
+            _scrape_jobs = ScrapeJobManager()
+    return _scrape_jobs
@@ -0,0 +1,115 @@
+from typing import Dict, Optional
+import json, os, sqlite3, tempfile, threading, time
+
+# Per-page crawl state (validators, content hash, extracted content) used by incremental re-crawls. Kept in SQLite on
+# local disk by default: SQLite locking is unreliable on network shares such as the Azure Files mount of the Chroma
+# volume, so SCRAPE_STATE_DB should only point to a local path.
+STATE_DB_PATH = os.getenv("SCRAPE_STATE_DB") or os.path.join(tempfile.gettempdir(), "scrape_state.sqlite3")
+# Pages not crawled again for this many days are forgotten (their next crawl renders them again)
+STATE_TTL_DAYS = float(os.getenv("SCRAPE_STATE_TTL_DAYS", "45"))
+# Saved pages are written in one transaction per this many pages
+STATE_WRITE_BATCH = 50
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    site TEXT NOT NULL,
+    url TEXT NOT NULL,
+    final_url TEXT,
+    depth INTEGER,
+    etag TEXT,
+    last_modified TEXT,
+    body_hash TEXT,
+    content_hash TEXT,
+    text TEXT,
+    markdown TEXT,
+    links TEXT,
+    jsonld TEXT,
+    meta TEXT,
+    crawled_at REAL,
+    PRIMARY KEY (site, url)
+)
+"""
+
+class PageStateStore:
+    """
+    Page state of crawled sites, keyed by (site, page url), site being the crawl's start URL.
+    validators() returns the lightweight fields for every page of a site, content() the stored text, markdown and
+    links of one page, so a crawl never loads the content of a whole site. save() buffers pages and writes them
+    STATE_WRITE_BATCH at a time, close() writes the rest. Pages older than STATE_TTL_DAYS are removed when a store is
+    opened. Safe to use from several threads; from an event loop call content() and save() through asyncio.to_thread.
+    """
+    def __init__(self, path: str = STATE_DB_PATH, ttl_days: float = STATE_TTL_DAYS):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute(_SCHEMA)
+        self._conn.execute("DELETE FROM pages WHERE crawled_at < ?", (time.time() - ttl_days * 86400,))
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._conn.close()
+
+    def validators(self, site: str) -> Dict[str, dict]:
+        """{url: {etag, last_modified, body_hash, content_hash}} for every stored page of a site."""
+        with self._lock:
+            self._flush()
+            rows = self._conn.execute(
+                "SELECT url, etag, last_modified, body_hash, content_hash FROM pages WHERE site = ?", (site,)
+            ).fetchall()
+        return {row[0]: {"etag": row[1], "last_modified": row[2], "body_hash": row[3], "content_hash": row[4]} for row in rows}
+
+    def content(self, site: str, url: str) -> Optional[dict]:
+        """Stored content of a page: final_url, text, markdown, links, jsonld and meta. None if not stored."""
+        with self._lock:
+            self._flush()
+            row = self._conn.execute(
+                "SELECT final_url, text, markdown, links, jsonld, meta FROM pages WHERE site = ? AND url = ?", (site, url)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "final_url": row[0] or url,
+            "text": row[1] or "",
+            "markdown": row[2] or "",
+            "links": json.loads(row[3] or "[]"),
+            "jsonld": json.loads(row[4] or "[]"),
+            "meta": json.loads(row[5] or "{}"),
+        }
+
+    def save(self, site: str, url: str, page: dict):
+        """Store (or replace) a crawled page. page holds the columns of the pages table, links/jsonld/meta as objects."""
+        row = (
+            site, url, page.get("final_url"), page.get("depth"), page.get("etag"), page.get("last_modified"),
+            page.get("body_hash"), page.get("content_hash"), page.get("text"), page.get("markdown"),
+            json.dumps(page.get("links") or []), json.dumps(page.get("jsonld") or []),
+            json.dumps(page.get("meta") or {}), time.time(),
+        )
+        with self._lock:
+            self._pending.append(row)
+            if len(self._pending) >= STATE_WRITE_BATCH:
+                self._flush()
+
+    def _flush(self):
+        # called with the lock held
+        if not self._pending:
+            return
+        self._conn.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self._pending)
+        self._conn.commit()
+        self._pending = []
+
+    def prune(self, site: str, keep_urls: set) -> int:
+        """Remove the pages of a site that were not reached by the latest complete crawl. Returns the number removed."""
+        stored = set(self.validators(site))
+        removed = [(site, url) for url in stored - set(keep_urls)]
+        with self._lock:
+            self._conn.executemany("DELETE FROM pages WHERE site = ? AND url = ?", removed)
+            self._conn.commit()
+        return len(removed)
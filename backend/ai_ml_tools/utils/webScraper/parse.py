@@ -2,6 +2,12 @@ import os
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import AzureChatOpenAI
 from ai_ml_tools.utils.azure_key_vault import get_OPENAI_API_KEY
+from ai_ml_tools.utils.llm_scheduler import get_llm_scheduler, deployment_name, ReservationCallback, PRIORITY_BATCH
+from ai_ml_tools.utils.tokenizer import count_tokens
+from openai import RateLimitError
+
+# Tokens reserved in the LLM scheduler for each map/reduce answer (max_tokens of the model below)
+ANSWER_TOKENS_ESTIMATE = 4000
 
 # Template for prompt
 _MAP_PROMPT = ChatPromptTemplate.from_template(
@@ -56,6 +62,7 @@ def _make_llm() -> AzureChatOpenAI:
         temperature=0,
         max_tokens=4000,
         request_timeout=120,
+        include_response_headers=True,  # rate limit headers for the LLM scheduler
     )
 
 def unique_lines(text: str) -> str:
@@ -78,16 +85,27 @@ def dedupe_answer(answer: str) -> str:
             out.append(line)
     return "\n".join(out)
     
+# invoke a prompt through the shared LLM scheduler as a batch request
+def _invoke_scheduled(chain, inputs: dict, session_id: str | None = None):
+    deployment = deployment_name(os.getenv("AZURE_OPENAI_DEPLOYMENT"))
+    estimated_tokens = sum(count_tokens(str(value)) for value in inputs.values()) + ANSWER_TOKENS_ESTIMATE
+    with get_llm_scheduler().reserve_sync(deployment, estimated_tokens, PRIORITY_BATCH, session_id) as reservation:
+        try:
+            return chain.invoke(inputs, config={"callbacks": [ReservationCallback(reservation)]})
+        except RateLimitError as e:
+            reservation.report_rate_limited(e)
+            raise
+
 # function to parse the chunks to the LLM
-def parse_with_azure_llm(dom_chunks: list[str], parse_description: str) -> str:
+def parse_with_azure_llm(dom_chunks: list[str], parse_description: str, session_id: str | None = None) -> str:
     llm = _make_llm()
 
     # MAP
     partials = []
     for ch in dom_chunks:
-        resp = ( _MAP_PROMPT | llm ).invoke({
+        resp = _invoke_scheduled(_MAP_PROMPT | llm, {
             "dom_content": ch, "parse_description": parse_description
-        })
+        }, session_id)
         text = getattr(resp, "content", resp)
         if text and text.strip():
             partials.append(text.strip())
@@ -97,10 +115,10 @@ def parse_with_azure_llm(dom_chunks: list[str], parse_description: str) -> str:
 
     # REDUCE to a single, canonical output
     reduce_in = "\n".join(partials)
-    final = ( _REDUCE_PROMPT | llm ).invoke({
+    final = _invoke_scheduled(_REDUCE_PROMPT | llm, {
         "partial_results": reduce_in,
         "parse_description": parse_description
-    })
+    }, session_id)
     final_text = getattr(final, "content", final).strip()
 
     # safety dedupe (if the user asked for lists)
@@ -7,19 +7,30 @@ if sys.platform == "win32":
 # ---------- Imports ----------
 from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
 from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urldefrag, urlparse, urlunparse
-from typing import List, Dict, Optional, Set, Tuple
-import requests, tempfile, os, hashlib, re, json, urllib3, warnings
-import pandas as pd
-import pdfplumber
-from docx import Document
+from urllib.parse import urljoin, urldefrag, urlparse
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Set, Tuple
+from contextlib import asynccontextmanager, nullcontext
+from cachetools import TTLCache
+from dotenv import load_dotenv
+import tempfile, os, hashlib, re, urllib3, warnings, itertools, threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import httpx
+import multiprocessing
+from ai_ml_tools.utils.webScraper.html_parse import parse_page, normalizeUrl
+from ai_ml_tools.utils.webScraper.extract import extract_file_text
+from ai_ml_tools.utils.webScraper.page_state import PageStateStore
+from ai_ml_tools.utils.webScraper.spool import PageSpool
+from ai_ml_tools.utils.chunking import chunk_markdown
 from urllib3.exceptions import InsecureRequestWarning
 
 # ---------- Ignore verify=False warnings ----------
 warnings.filterwarnings("ignore", category=InsecureRequestWarning)
 urllib3.disable_warnings(InsecureRequestWarning)
 
+# ---------- Load environment variables ----------
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env'))
+
 # ---------- Variables ----------
 LOW_QUALITY_PATTERNS = ["contact", "privacy", "terms", "login", "disclaimer", "account", "signup",
                         "legal","policy","adult","violence","complaints","report","abuse"]
@@ -30,6 +41,45 @@ MAX_DEPTH = 4 # set to 4 for proudction and 1 or 2 for development
 MAX_PAGES = 6000
 PACIFIC_EXACT_URL = "https://www.pac.dfo-mpo.gc.ca/"
 PACIFIC_MAX_DEPTH = 25
+# Pages fetched concurrently (one browser, one tab per worker), and per-host politeness limits
+CRAWL_WORKERS = int(os.getenv("SCRAPE_WORKERS", "6"))
+CRAWL_PER_HOST_CONCURRENCY = int(os.getenv("SCRAPE_PER_HOST_CONCURRENCY", "6"))
+CRAWL_PER_HOST_DELAY = float(os.getenv("SCRAPE_PER_HOST_DELAY", "0.1"))  # seconds between request starts to one host
+# When links are checked for redirect aliases: "dequeue" (just before the page is fetched), "discover" (when the link
+# is found, all links of a page at once) or "off"
+REDIRECT_MODES = ["dequeue", "discover", "off"]
+REDIRECT_RESOLUTION = os.getenv("SCRAPE_RESOLVE_REDIRECTS", "dequeue")
+REDIRECT_TIMEOUT = 3.0
+REDIRECT_MAX_CONCURRENCY = 20
+REDIRECT_CACHE_TTL = int(os.getenv("SCRAPE_REDIRECT_CACHE_TTL", "86400"))
+# How incremental re-crawls check a page crawled before: "body" (conditional GET, a 200 is compared with the stored
+# body and text, so pages without ETag / Last-Modified can be reused but a changed page is downloaded twice) or
+# "validators" (conditional HEAD, only for pages with an ETag or Last-Modified, a changed page is downloaded once)
+RECRAWL_CHECK_MODES = ["body", "validators"]
+RECRAWL_CHECK = os.getenv("SCRAPE_RECRAWL_CHECK", "body")
+
+# Processes for CPU bound parsing and file extraction, shared by all crawls (0 runs them in threads instead)
+CPU_PROCESSES = int(os.getenv("SCRAPE_CPU_PROCESSES", str(min(4, os.cpu_count() or 1))))
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+# Linked files (PDF, DOCX, CSV, XLSX) are streamed to disk, at most FILE_MAX_BYTES and FILE_DOWNLOAD_TIMEOUT seconds each
+FILE_MAX_BYTES = int(os.getenv("SCRAPE_MAX_FILE_MB", "50")) * 2**20
+FILE_DOWNLOAD_TIMEOUT = float(os.getenv("SCRAPE_FILE_TIMEOUT", "60"))
+FILE_MAX_PDF_PAGES = int(os.getenv("SCRAPE_MAX_PDF_PAGES", "500"))
+FILE_CHUNK_BYTES = 64 * 1024
+# Content types of links that are downloaded and extracted instead of rendered, for links without a file extension
+FILE_CONTENT_TYPES = {
+    "application/pdf": ".pdf",
+    "text/csv": ".csv",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": ".xlsx",
+}
+
+# Resolved redirect targets and their content type, shared by all crawls (see RedirectResolver)
+_resolved_urls = TTLCache(maxsize=200000, ttl=REDIRECT_CACHE_TTL)
+_resolved_urls_lock = threading.Lock()
 
 PACIFIC_IGNORED_URLS = {
     "https://www.canada.ca/en/services/jobs/opportunities.html",
@@ -41,16 +91,6 @@ PACIFIC_IGNORED_URLS = {
 
 
 # ---------- URL + Link Helpers ----------
-def normalizeUrl(u: str) -> str:
-    """
-    Normalize URL but KEEP the #fragment so client-side hash routes
-    (e.g., /#2012 vs /#2013) are treated as distinct pages.
-    """
-    p = urlparse(u.strip())
-    # normalize scheme/host, keep path/query/fragment as-is
-    p = p._replace(scheme=p.scheme.lower(), netloc=p.netloc.lower())
-    return urlunparse(p)
-
 def normalize_compare_url(u: str) -> str:
     return urldefrag(normalizeUrl(u))[0].rstrip("/")
 
@@ -69,25 +109,6 @@ def looks_like_file(url: str) -> Optional[str]:
             return ext
     return None
 
-def extract_links(base_url: str, html: str) -> List[str]:
-    """Pull <a href>, absolutize to full URLs (including fragments)."""
-    soup = BeautifulSoup(html, "html.parser")
-    links: List[str] = []
-
-    # regular a[href]
-    for a in soup.find_all("a", href=True):
-        href = a["href"].strip()
-        if not href or href.startswith(("mailto:", "javascript:")):
-            continue
-        full = normalizeUrl(urljoin(base_url, href))
-        links.append(full)
-
-    # detect hidden fragment navigation stored in IDs
-    fragment_links = extract_fragment_id_links(base_url, html)
-    links.extend(fragment_links)
-
-    return links
-
 def is_recursive_path(url: str, repeat_threshold: int = 2) -> bool:
     """
     Skip looping/recursive paths like /a/b/a/b/a/ or /2025/10/28/2025/10/28/.
@@ -104,175 +125,303 @@ def is_recursive_path(url: str, repeat_threshold: int = 2) -> bool:
     except Exception:
         return False
 
-def resolve_head(url: str, timeout: float = 3.0) -> Optional[str]:
-    """
-    Best-effort canonicalization: follow redirects with HEAD; fall back to GET.
-
-    Why:
-    - Different URLs often resolve to the same canonical destination.
-    - Collapsing aliases early avoids enqueuing duplicates.
-
-    Returns:
-    - Final resolved URL (normalized) on success, or
-    - None on network/timeout errors (caller can decide what to do).
-    """
-    try:
-        r = requests.head(url, allow_redirects=True, timeout=timeout, verify=False)
-        # Some origins disallow HEAD; try a lightweight GET
-        if r.status_code in (405, 403) or r.is_redirect:
-            r = requests.get(url, allow_redirects=True, timeout=timeout, stream=True, verify=False)
-        final = r.url or url
-        return normalizeUrl(final)
-    except Exception:
-        return None
-
 # ---------- Extraction Helpers ----------
-def extract_csv_text(url):
-    """Read CSV over HTTP(S) into a DataFrame and return Markdown table"""
-    try:
-        df = pd.read_csv(url)
-        return df.to_markdown(index=False)
-    except Exception as e:
-        print(f"❌ CSV extract failed for {url}: {e}")
-        return None
+class FileTooLarge(Exception):
+    pass
 
-def extract_xlsx_text(url):
-    """Read XLSX over HTTP(S) into a DataFrame and return Markdown table."""
-    try:
-        df = pd.read_excel(url)
-        return df.to_markdown(index=False)
-    except Exception as e:
-        print(f"❌ XLSX extract failed for {url}: {e}")
-        return None
+class ScrapeCancelled(Exception):
+    pass
 
-def extract_pdf_text(url):
-    """Download PDF and extract text from all pages (basic text layer only)."""
-    try:
-        response = requests.get(url, timeout=10, verify=False)
+async def download_file(client: httpx.AsyncClient, url: str, suffix: str) -> Tuple[str, str]:
+    """
+    Stream a linked file to a temp file, without holding it in memory, and return (path, content type). The caller
+    deletes the file. Raises FileTooLarge past FILE_MAX_BYTES (checked against Content-Length first, then while
+    streaming), and httpx errors on failures and timeouts.
+    """
+    async with client.stream("GET", url) as response:
         response.raise_for_status()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(response.content)
-            tmp_path = tmp.name
-        with pdfplumber.open(tmp_path) as pdf:
-            text = "\n".join(page.extract_text() or "" for page in pdf.pages)
-        os.unlink(tmp_path)
-        return text.strip()
-    except Exception as e:
-        print(f"❌ PDF extract failed for {url}: {e}")
-        return None
-
-def extract_docx_text(url):
-    """Download DOCX and extract paragraph text."""
+        content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+        if int(response.headers.get("content-length") or 0) > FILE_MAX_BYTES:
+            raise FileTooLarge(f"larger than {FILE_MAX_BYTES // 2**20} MB")
+        size = 0
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+            try:
+                async for chunk in response.aiter_bytes(FILE_CHUNK_BYTES):
+                    size += len(chunk)
+                    if size > FILE_MAX_BYTES:
+                        raise FileTooLarge(f"larger than {FILE_MAX_BYTES // 2**20} MB")
+                    tmp.write(chunk)
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+            return tmp.name, content_type
+
+def _get_process_pool() -> Optional[ProcessPoolExecutor]:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None and CPU_PROCESSES > 0:
+            # spawn: the server process has threads, forking it is unsafe
+            _process_pool = ProcessPoolExecutor(max_workers=CPU_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return _process_pool
+
+async def run_cpu_bound(func, *args):
+    """
+    Run CPU bound work (HTML parsing, file text extraction) in the crawler's process pool, so page fetches keep going
+    on the event loop meanwhile. func must be a module level function of a light module (html_parse, extract).
+    Runs in a thread instead when the pool is disabled (SCRAPE_CPU_PROCESSES=0) or has broken.
+    """
+    global _process_pool
+    pool = _get_process_pool()
+    if pool is not None:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+        except BrokenProcessPool:
+            print("[SCRAPER] Process pool broke, it will be restarted.")
+            with _process_pool_lock:
+                if _process_pool is pool:
+                    _process_pool = None
+    return await asyncio.to_thread(func, *args)
+
+async def fetch_file_text(client: httpx.AsyncClient, url: str, file_ext: str, slot=None) -> Tuple[str, Optional[str]]:
+    """
+    Download a linked file and extract its text in the process pool. The kind is sniffed from the downloaded content,
+    file_ext (from the link or its Content-Type) is only a hint. Returns (kind, text), text is None on failure.
+    slot (e.g. HostPoliteness.slot(url)) is held during the download only, not while the text is extracted.
+    """
+    hint = file_ext.lstrip(".")
     try:
-        response = requests.get(url, timeout=10, verify=False)
-        response.raise_for_status()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
-            tmp.write(response.content)
-            tmp_path = tmp.name
-        doc = Document(tmp_path)
-        text = "\n".join(p.text for p in doc.paragraphs)
-        os.unlink(tmp_path)
-        return text.strip()
+        async with slot or nullcontext():
+            path, content_type = await asyncio.wait_for(download_file(client, url, file_ext), FILE_DOWNLOAD_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"❌ Download timed out after {FILE_DOWNLOAD_TIMEOUT}s: {url}")
+        return hint, None
     except Exception as e:
-        print(f"❌ DOCX extract failed for {url}: {e}")
-        return None
+        print(f"❌ Download failed for {url}: {e}")
+        return hint, None
+    try:
+        kind, text = await run_cpu_bound(extract_file_text, path, content_type, hint, url, FILE_MAX_PDF_PAGES)
+        return kind or hint, text
+    finally:
+        os.unlink(path)
 
-def extract_fragment_id_links(base_url: str, html: str) -> List[str]:
+async def check_unchanged(client: httpx.AsyncClient, url: str, previous: dict, slot=None) -> Tuple[bool, dict]:
     """
-    Some sites use <a href="#"> and put the real route/state in the <a id="2023">.
-    This helper creates synthetic #fragment URLs such as base_url + '#2023'.
+    Conditional request for a page crawled before (previous holds its stored etag, last_modified, body_hash and
+    content_hash). The page is unchanged if the server answers 304, or 200 with the same body as last time, or with a
+    body whose text (parsed like a rendered page) has the stored content_hash. Returns (unchanged, validators of the
+    response to store with the page).
+    No request is sent when there is nothing to compare with. With SCRAPE_RECRAWL_CHECK=validators only the
+    conditional headers are checked, with a HEAD request, so a changed page is not downloaded before it is rendered.
+    slot (e.g. HostPoliteness.slot(url)) is held during the request only, not while the body is parsed.
     """
-    soup = BeautifulSoup(html, "html.parser")
-    out = []
-    
-    for a in soup.find_all("a", href=True):
-        href = a["href"].strip()
-        
-        # Case 1: real href with fragment is handled already
-        if href.startswith("#") and len(href) > 1:
-            full = normalizeUrl(urljoin(base_url, href))
-            out.append(full)
-            continue
-
-        # Case 2: href is "#" but the a-tag has an ID, treat ID as fragment
-        if href == "#" and a.get("id"):
-            frag = "#" + a["id"].strip()
-            full = normalizeUrl(urljoin(base_url, frag))
-            out.append(full)
+    headers = {}
+    if previous.get("etag"):
+        headers["If-None-Match"] = previous["etag"]
+    if previous.get("last_modified"):
+        headers["If-Modified-Since"] = previous["last_modified"]
+    compare_body = RECRAWL_CHECK == "body" and (previous.get("body_hash") or previous.get("content_hash"))
+    if not headers and not compare_body:
+        return False, {}
+    try:
+        async with slot or nullcontext():
+            if compare_body:
+                response = await client.get(url, headers=headers)
+            else:
+                response = await client.head(url, headers=headers)
+    except Exception:
+        return False, {}
+    state = {
+        "etag": response.headers.get("etag") or previous.get("etag"),
+        "last_modified": response.headers.get("last-modified") or previous.get("last_modified"),
+    }
+    if response.status_code == 304:
+        return True, {**state, "body_hash": previous.get("body_hash")}
+    if response.status_code != 200 or not compare_body:
+        return False, {}
+    state["body_hash"] = hashlib.sha256(response.content).hexdigest()
+    if state["body_hash"] == previous.get("body_hash"):
+        return True, state
+    # the rendered DOM never hashes like the raw body, so a page first seen by the browser is compared by its text
+    if not previous.get("content_hash") or "html" not in response.headers.get("content-type", ""):
+        return False, state
+    try:
+        page = await run_cpu_bound(parse_page, response.text, url)
+    except Exception:
+        return False, state
+    return hashlib.sha256(page["text"].encode("utf-8", "ignore")).hexdigest() == previous["content_hash"], state
 
-    return out
+def _default_favicon(url: str) -> str:
+    p = urlparse(url)
+    return urljoin(f"{p.scheme}://{p.netloc}", "/favicon.ico")
 
-def extract_jsonld(html: str) -> list:
-    soup = BeautifulSoup(html, "html.parser")
-    out=[]
-    for s in soup.find_all("script", attrs={"type": lambda t: t and "ld+json" in t.lower()}):
-        raw=(s.string or s.get_text() or "").strip()
-        if not raw: continue
-        try:
-            raw = re.sub(r"/\*.*?\*/", "", raw, flags=re.S) # strip /* */
-            raw = re.sub(r"^\s*//.*?$", "", raw, flags=re.M) # strip //
-            data=json.loads(re.sub(r",\s*([}\]])", r"\1", raw)) # fix trailing commas
-            out.extend(data if isinstance(data, list) else [data])
-        except Exception:
-            pass
-    return out
-
-def extract_simple_meta_from_result(result, base_url: str) -> dict:
+def extract_simple_meta_from_result(result, base_url: str, page_meta: dict) -> dict:
+    """Site title, description and favicon from crawl4ai's metadata, falling back to the parsed page (parse_page)."""
     meta = getattr(result, "metadata", None) or getattr(result, "meta_tags", {}) or {}
-    title = (meta.get("title") or "").strip()
-    descr = (meta.get("description") or meta.get("og:description") or "").strip()
-
-    # fallback
-    soup = BeautifulSoup(getattr(result, "html", "") or "", "html.parser")
-    if not title:
-        if soup.title and soup.title.string:
-            title = soup.title.string.strip()
-        else:
-            tag = soup.select_one('meta[property="og:title" i]') or soup.select_one('meta[name="twitter:title" i]')
-            if tag:
-                title = (tag.get("content") or "").strip()
-    if not descr:
-        tag = (soup.select_one('meta[name="description" i]') or
-               soup.select_one('meta[property="og:description" i]') or
-               soup.select_one('meta[name="twitter:description" i]'))
-        if tag:
-            descr = (tag.get("content") or "").strip()
+    title = (meta.get("title") or "").strip() or page_meta.get("title", "")
+    descr = (meta.get("description") or meta.get("og:description") or "").strip() or page_meta.get("description", "")
 
     # Favicon (png/jpg/ico/svg/apple-touch)
-    fav = ""
-    candidates = []
-    for link in soup.select('link[rel*="icon" i], link[rel*="apple-touch-icon" i], link[rel="mask-icon" i]'):
-        href = (link.get("href") or "").strip()
-        if href:
-            candidates.append(urljoin(base_url, href))
-    if candidates:
-        fav = candidates[0]
-    if not fav:
-        p = urlparse(base_url)
-        fav = urljoin(f"{p.scheme}://{p.netloc}", "/favicon.ico")
+    fav = page_meta.get("favicon", "") or _default_favicon(base_url)
 
     return {"site_title": title, "site_description": descr, "favicon": fav}
 
 
 # ---------- Processing Helpers ----------
-def extract_body_content(html_content: str) -> str:
-    """Return only <body> content as HTML."""
-    soup = BeautifulSoup(html_content, "html.parser")
-    body_content = soup.body
-    return str(body_content) if body_content else ""
-
-def clean_body_content(body_content: str) -> str:
-    """Strip script/style/noscript and return readable text."""
-    soup = BeautifulSoup(body_content, "html.parser")
-    for tag in soup(["script", "style"]):
-        tag.extract()
-    cleaned = soup.get_text(separator="\n")
-    cleaned = "\n".join(line.strip() for line in cleaned.splitlines() if line.strip())
-    return cleaned
-
-def split_dom_content(dom_content: str, max_length: int = 6000) -> list[str]:
-    """Chunk long strings for LLMs (unchanged helper)."""
-    return [dom_content[i:i + max_length] for i in range(0, len(dom_content), max_length)]
+def chunk_pages(pages: Iterable[Dict]) -> Iterator[Dict]:
+    """
+    Split crawled pages into token-bounded chunks page by page, so a chunk never spans two pages. HTML pages are
+    chunked from crawl4ai's markdown along their headings with overlap (see chunk_markdown), files and pages without
+    markdown from their text. Yields {"text", "url", "depth", "title", "kind"} per chunk, in crawl order, consuming
+    pages one at a time (e.g. from PageSpool.iter_pages()).
+    """
+    for page in pages:
+        content = (page.get("markdown") or page.get("text") or "").strip()
+        if not content:
+            continue
+        for chunk in chunk_markdown(content):
+            text = chunk["text"].strip()
+            if text:
+                yield {
+                    "text": text,
+                    "url": page["url"],
+                    "depth": page.get("depth", 0),
+                    "title": page.get("title") or "",
+                    "kind": page.get("kind") or "html",
+                }
+
+
+# ---------- Redirect Resolution ----------
+class RedirectResolver:
+    """
+    Best-effort canonicalization of links: follow redirects with HEAD on a pooled async client, falling back to a
+    GET (headers only) when HEAD is refused. Different URLs often resolve to the same destination, collapsing these
+    aliases avoids fetching the same page twice.
+
+    Results (None on network/timeout errors) are cached for REDIRECT_CACHE_TTL seconds across crawls, and concurrent
+    lookups of the same URL share one request. Create and use it inside the crawl's event loop, as an async context
+    manager.
+    """
+    def __init__(self, timeout: float = REDIRECT_TIMEOUT, max_concurrency: int = REDIRECT_MAX_CONCURRENCY):
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def __aenter__(self):
+        self._client = httpx.AsyncClient(
+            verify=False,
+            follow_redirects=True,
+            timeout=self.timeout,
+            headers={"User-Agent": DEFAULT_UA},
+            limits=httpx.Limits(max_connections=self.max_concurrency),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        for task in list(self._pending.values()):
+            task.cancel()
+        await self._client.aclose()
+
+    async def resolve(self, url: str) -> Optional[str]:
+        """Returns the final URL (normalized) after redirects, or None if it could not be resolved."""
+        with _resolved_urls_lock:
+            if url in _resolved_urls:
+                return _resolved_urls[url][0]
+        task = self._pending.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(url))
+            self._pending[url] = task
+            task.add_done_callback(lambda _: self._pending.pop(url, None))
+        # shielded so a cancelled caller does not cancel the lookup for the others waiting on it
+        return await asyncio.shield(task)
+
+    def content_type(self, url: str) -> str:
+        """Content-Type returned for an already resolved URL ("" if unknown)."""
+        with _resolved_urls_lock:
+            cached = _resolved_urls.get(url)
+        return cached[1] if cached else ""
+
+    async def resolve_many(self, urls: List[str]) -> List[Optional[str]]:
+        return list(await asyncio.gather(*(self.resolve(url) for url in urls)))
+
+    async def _fetch(self, url: str) -> Optional[str]:
+        content_type = ""
+        async with self._semaphore:
+            try:
+                response = await self._client.head(url)
+                # Some origins disallow HEAD; try a GET without reading the body
+                if response.status_code in (405, 403):
+                    async with self._client.stream("GET", url) as response:
+                        pass
+                resolved = normalizeUrl(str(response.url) or url)
+                content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+            except Exception:
+                resolved = None
+        with _resolved_urls_lock:
+            _resolved_urls[url] = (resolved, content_type)
+        return resolved
+
+
+# ---------- Crawl Frontier ----------
+class CrawlFrontier:
+    """
+    Depth-ordered crawl queue: shallower pages are always fetched first, pages at the same depth in the order they
+    were discovered. Workers take URLs with get() and call task_done() when a page is finished, join() returns once
+    the queue is empty and no page is in progress.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.enqueued: Set[str] = set()
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+
+    def push(self, url: str, depth: int) -> bool:
+        """Queue a URL unless it was queued before or the frontier is full. Returns True when queued."""
+        if url in self.enqueued or self._queue.qsize() >= self.max_size:
+            return False
+        self.enqueued.add(url)
+        self._queue.put_nowait((depth, next(self._order), url))
+        return True
+
+    async def get(self) -> Tuple[str, int]:
+        depth, _, url = await self._queue.get()
+        return url, depth
+
+    def task_done(self):
+        self._queue.task_done()
+
+    async def join(self):
+        await self._queue.join()
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+class HostPoliteness:
+    """
+    Per-host politeness for concurrent fetches: at most max_concurrency requests in flight to one host, and requests
+    to the same host started at least min_delay seconds apart.
+    """
+    def __init__(self, max_concurrency: int, min_delay: float):
+        self.max_concurrency = max_concurrency
+        self.min_delay = min_delay
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._next_start: Dict[str, float] = {}
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        host = urlparse(url).netloc
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self.max_concurrency))
+        async with semaphore:
+            async with self._locks.setdefault(host, asyncio.Lock()):
+                loop = asyncio.get_running_loop()
+                wait = self._next_start.get(host, 0.0) - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._next_start[host] = loop.time() + self.min_delay
+            yield
 
 
 # ---------- Main ----------
@@ -281,7 +430,20 @@ def scrape_website(
     max_depth: int = MAX_DEPTH,
     max_pages: int = MAX_PAGES,
     same_domain_only: bool = True,
+    workers: int = CRAWL_WORKERS,
+    incremental: bool = False,
+    progress: Optional[Callable[[int, int], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
 ) -> Dict[str, object]:
+    """
+    Crawl a site from start_url and return its pages and the site's metadata. Pages are written to a PageSpool on disk
+    as they are crawled, so memory does not grow with the site; the caller reads them back and must close the spool.
+    Every rendered page is recorded in the page state store. With incremental=True, pages crawled before are first
+    checked with a conditional request (ETag / Last-Modified, then the body's hash, see SCRAPE_RECRAWL_CHECK) and
+    reuse their stored content when unchanged, instead of being rendered again.
+    progress is called with (pages crawled, pages queued within max_pages) after every page, from the crawl's event
+    loop, so it must not block. Setting cancel_event stops the crawl within a second and raises ScrapeCancelled.
+    """
 
     start_url = normalizeUrl(start_url)
     base_netloc = urlparse(start_url).netloc
@@ -291,192 +453,296 @@ def scrape_website(
         max_depth = PACIFIC_MAX_DEPTH
         ignored_urls = {normalize_compare_url(u) for u in PACIFIC_IGNORED_URLS}
 
-    print(f"[SCRAPER] Using max_depth={max_depth} for start_url={start_url}")
+    if REDIRECT_RESOLUTION not in REDIRECT_MODES:
+        raise ValueError(f"SCRAPE_RESOLVE_REDIRECTS must be one of: {REDIRECT_MODES}")
+    if RECRAWL_CHECK not in RECRAWL_CHECK_MODES:
+        raise ValueError(f"SCRAPE_RECRAWL_CHECK must be one of: {RECRAWL_CHECK_MODES}")
+    print(f"[SCRAPER] Using max_depth={max_depth}, workers={workers} for start_url={start_url}")
     
     visited: Set[str] = set()
     urls_seen_ordered: List[str] = []
-    results: List[Dict] = []
+    results = PageSpool(max_pages=max_pages)
     seen_signatures: Set[str] = set()
     canonical_seen: Set[str] = set()
-    queue: List[Tuple[str, int]] = [(start_url, 0)]
-    enqueued: Set[str] = {start_url}
     site_meta = None
+    site_key = start_url
+    page_store = PageStateStore()
+    previous_pages = page_store.validators(site_key) if incremental else {}
+    unchanged_pages: Set[str] = set()
+    if incremental:
+        print(f"[SCRAPER] Incremental re-crawl, {len(previous_pages)} pages known from the last crawl")
+
+    md_generator = DefaultMarkdownGenerator(
+        options={"ignore_links": True, "escape_html": False, "body_width": 80}
+    )
+
+    def _run_config(session_id: str) -> CrawlerRunConfig:
+        # each worker has its own crawl4ai session (browser tab), pages of one session must not be fetched concurrently
+        return CrawlerRunConfig(
+            cache_mode=CacheMode.BYPASS,
+            session_id=session_id,
+            wait_until="domcontentloaded",
+            exclude_external_links=True,
+            excluded_tags=["script", "style", "nav", "footer", "header"],
+            excluded_selector="#ads, .sidebar, .footer, .header",
+            scan_full_page=True,
+            check_robots_txt=True,
+            exclude_social_media_links=True,
+            word_count_threshold=0,
+            markdown_generator=md_generator,
+            process_iframes=True,
+            js_code=[
+            "document.querySelectorAll('[role=\"tab\"], .tab, .tab-button, .accordion, .toggle, .show-more, .expander').forEach(el=>el.click());",
+            "window.scrollTo(0, document.body.scrollHeight);",
+            ],
+        )
 
-    async def _run():
+    async def _crawl_page(crawler, frontier: CrawlFrontier, politeness: HostPoliteness, resolver: RedirectResolver, files_client: httpx.AsyncClient, url: str, depth: int, config: CrawlerRunConfig):
         nonlocal site_meta
+        if url in visited:
+            return
+
+        if normalize_compare_url(url) in ignored_urls:
+            print(f"⛔ Skipping ignored URL: {url}")
+            return
+
+        # skip recursive/looping paths
+        if is_recursive_path(url):
+            print(f"⛔ Skipping recursive path: {url}")
+            return
+
+        # domain scope
+        if same_domain_only and not same_domain(url, base_netloc):
+            print(f"⛔ Skipping off-domain: {url}")
+            return
+
+        # Collapse redirect aliases just before fetching; if the resolved URL was already visited, skip
+        resolved = None
+        if REDIRECT_RESOLUTION == "dequeue" and depth > 0 and '#' not in url:
+            resolved = await resolver.resolve(url)
+            if resolved and resolved != url and resolved in visited:
+                print(f"⚠️ Redirect alias of a visited page: {url} -> {resolved}")
+                return
+
+        visited.add(url)
+        if resolved:
+            visited.add(resolved)
+        urls_seen_ordered.append(url)
+        print(f"\n➡️ Visiting (depth {depth}): {url}")
+
+        # handle direct file links (by extension, or by the Content-Type seen when resolving redirects),
+        # streamed to disk and extracted in the process pool
+        file_ext = looks_like_file(url) or FILE_CONTENT_TYPES.get(resolver.content_type(url))
+        if file_ext:
+            kind, text = await fetch_file_text(files_client, url, file_ext, politeness.slot(url))
+
+            results.append({
+                "url": url,
+                "depth": depth,
+                "kind": kind,
+                "text": text,
+            })
+            print(f"📄 Captured file ({kind}): {url}")
+            return
+
+        # incremental re-crawl: a page whose server response did not change reuses its stored content
+        state = {}
+        stored = None
+        if url in previous_pages and '#' not in url:
+            unchanged, state = await check_unchanged(files_client, url, previous_pages[url], politeness.slot(url))
+            if unchanged:
+                stored = await asyncio.to_thread(page_store.content, site_key, url)
+
+        if stored is not None:
+            final_url, text, content_md, jsonld, links = stored["final_url"], stored["text"], stored["markdown"], stored["jsonld"], stored["links"]
+            page_meta = stored["meta"]
+            if site_meta is None:
+                site_meta = {"site_title": page_meta.get("title", ""), "site_description": page_meta.get("description", ""), "favicon": page_meta.get("favicon") or _default_favicon(url)}
+            # keep the refreshed validators, so the next re-crawl can skip the body comparison
+            await asyncio.to_thread(page_store.save, site_key, url, {
+                **stored,
+                **state,
+                "depth": depth,
+                "content_hash": previous_pages[url].get("content_hash"),
+            })
+            unchanged_pages.add(url)
+            print(f"♻️ Unchanged since last crawl: {url}")
+        else:
+            # --- crawl4ai fetch (robots respected here) ---
+            try:
+                async with politeness.slot(url):
+                    result = await crawler.arun(url=url, config=config)
+                if not result.success:
+                    raise Exception("Crawler returned unsuccessful status")
+                content_md = str(result.markdown or "")
+                html = result.html
+                # one parse per page gives the links, JSON-LD, head metadata and body text
+                page = await run_cpu_bound(parse_page, html, url)
+                jsonld = page["jsonld"]
+                page_meta = page["meta"]
+                if (site_meta is None) and result.success and (result.html):
+                    site_meta = extract_simple_meta_from_result(result, url, page_meta)
+
+            except Exception as e:
+                print(f"❌ Fetch failed (crawl4ai): {url} -> {e}")
+                results.append({"url": url, "depth": depth, "kind": "error", "text": None})
+                return
+
+            # extract text
+            text = page["text"]
+            links = page["links"]
+
+            # prefer resolved final URL after redirects
+            final_url = normalizeUrl(getattr(result, "response_url", None) or url)
+
+            # validators for the next incremental re-crawl, from the conditional request or the rendered response.
+            # content_hash is stored on every render, so pages of servers without validators can still be compared
+            headers = {key.lower(): value for key, value in (getattr(result, "response_headers", None) or {}).items()}
+            await asyncio.to_thread(page_store.save, site_key, url, {
+                "final_url": final_url,
+                "depth": depth,
+                "etag": state.get("etag") or headers.get("etag"),
+                "last_modified": state.get("last_modified") or headers.get("last-modified"),
+                "body_hash": state.get("body_hash"),
+                "content_hash": hashlib.sha256(text.encode("utf-8", "ignore")).hexdigest(),
+                "text": text,
+                "markdown": content_md,
+                "links": links,
+                "jsonld": jsonld,
+                "meta": page_meta,
+            })
+
+        canonical_seen.add(final_url)
+
+        # minimal content signature
+        sig_basis = (content_md or text or "").strip()
+        sig = hashlib.sha256(re.sub(r"\s+", " ", sig_basis).encode("utf-8","ignore")).hexdigest()
+
+        if sig in seen_signatures:
+            print(f"⚠️ Duplicate page content: {final_url}")
+            return
+        seen_signatures.add(sig)
+
+        # low-quality filter
+        if any(p in url.lower() for p in LOW_QUALITY_PATTERNS):
+            print(f"⚠️ Low-quality pattern hit: {url}")
+            # do NOT block traversal; still discover links
+        else:
+            results.append({
+                "url": final_url,
+                "depth": depth,
+                "kind": "html",
+                "text": text,
+                "markdown": content_md,
+                "jsonld": jsonld,
+                "title": page_meta.get("title", ""),
+            })
+            print(f"✅ Saved page (words={len(text.split())}): {url}")
+
+        # depth limit
+        if depth >= max_depth:
+            return
+
+        # discover + print next-layer links
+
+        if links:
+            print("🔗 Links found:")
+            for l in links[:50]:
+                print("   -", l)
+
+        new_links = []
+        for link in dict.fromkeys(links):
+            if link in visited or link in frontier.enqueued:
+                continue
+            if ignored_urls and normalize_compare_url(link) in ignored_urls:
+                continue
+            if same_domain_only and not same_domain(link, base_netloc):
+                continue
+            if is_recursive_path(link):
+                continue
+            if "/pages/frames/" in link and "frame=i" in link and "family=" not in link:
+                continue
+            new_links.append(link)
+
+        # Collapse redirect aliases of the page's links in one concurrent batch; if the resolved URL is known, skip
+        if REDIRECT_RESOLUTION == "discover":
+            to_resolve = [link for link in new_links if '#' not in link]
+            aliases = {
+                link for link, resolved in zip(to_resolve, await resolver.resolve_many(to_resolve))
+                if resolved and resolved != link and (resolved in visited or resolved in frontier.enqueued)
+            }
+            new_links = [link for link in new_links if link not in aliases]
+
+        for link in new_links:
+            frontier.push(link, depth + 1)
+
+    async def _run():
+        # simple guardrail to avoid runaway queues: never hold more than twice max_pages
+        frontier = CrawlFrontier(max_size=max_pages * 2)
+        frontier.push(start_url, 0)
+        politeness = HostPoliteness(CRAWL_PER_HOST_CONCURRENCY, CRAWL_PER_HOST_DELAY)
+        page_limit_reached = asyncio.Event()
+
         browser_cfg = BrowserConfig(
             headless=True,
             text_mode=True,
             user_agent=DEFAULT_UA,
         )
-        async with AsyncWebCrawler(config=browser_cfg) as crawler:
-            while queue and len(results) < max_pages:
-                url, depth = queue.pop(0)
-                if url in visited:
-                    continue
-
-                if normalize_compare_url(url) in ignored_urls:
-                    print(f"⛔ Skipping ignored URL: {url}")
-                    continue
-
-                # skip recursive/looping paths
-                if is_recursive_path(url):
-                    print(f"⛔ Skipping recursive path: {url}")
-                    continue
-
-                # domain scope
-                if same_domain_only and not same_domain(url, base_netloc):
-                    print(f"⛔ Skipping off-domain: {url}")
-                    continue
-
-                visited.add(url)
-                urls_seen_ordered.append(url)
-                print(f"\n➡️ Visiting (depth {depth}): {url}")
-
-                # handle direct file links (unchanged)
-                file_ext = looks_like_file(url)
-                if file_ext:
-                    kind = file_ext.lstrip(".")
-                    text = None
-                    if file_ext == ".csv":
-                        text = extract_csv_text(url)
-                    elif file_ext == ".xlsx":
-                        text = extract_xlsx_text(url)
-                    elif file_ext == ".pdf":
-                        text = extract_pdf_text(url)
-                    elif file_ext == ".docx":
-                        text = extract_docx_text(url)
-
-                    results.append({
-                        "url": url,
-                        "depth": depth,
-                        "kind": kind,
-                        "text": text,
-                        "html": None,
-                    })
-                    print(f"📄 Captured file ({kind}): {url}")
-                    continue
-
-                # --- crawl4ai fetch (robots respected here) ---
-                md_generator = DefaultMarkdownGenerator(
-                    options={"ignore_links": True, "escape_html": False, "body_width": 80}
-                )
-                config = CrawlerRunConfig(
-                    cache_mode=CacheMode.BYPASS,
-                    session_id="intelligent-crawl",
-                    wait_until="domcontentloaded",
-                    exclude_external_links=True,
-                    excluded_tags=["script", "style", "nav", "footer", "header"],
-                    excluded_selector="#ads, .sidebar, .footer, .header",
-                    scan_full_page=True,
-                    check_robots_txt=True,
-                    exclude_social_media_links=True,
-                    word_count_threshold=0,
-                    markdown_generator=md_generator,
-                    process_iframes=True,
-                    js_code=[
-                    "document.querySelectorAll('[role=\"tab\"], .tab, .tab-button, .accordion, .toggle, .show-more, .expander').forEach(el=>el.click());",
-                    "window.scrollTo(0, document.body.scrollHeight);",
-                    ],
-                )
-
-                try:
-                    result = await crawler.arun(url=url, config=config)
-                    if not result.success:
-                        raise Exception("Crawler returned unsuccessful status")
-                    content_md = result.markdown
-                    html = result.html
-                    jsonld = extract_jsonld(html)
-                    if (site_meta is None) and result.success and (result.html):
-                        site_meta = extract_simple_meta_from_result(result, url)
-
-                except Exception as e:
-                    print(f"❌ Fetch failed (crawl4ai): {url} -> {e}")
-                    results.append({
-                        "url": url, "depth": depth, "kind": "error",
-                        "text": None, "html": None
-                    })
-                    continue
-
-                # extract text
-                body_html = extract_body_content(html)
-                text = clean_body_content(body_html)
-
-                # prefer resolved final URL after redirects
-                final_url = normalizeUrl(getattr(result, "response_url", url))
-                canonical_seen.add(final_url)
-
-                # minimal content signature
-                sig_basis = (content_md or text or "").strip()
-                sig = hashlib.sha256(re.sub(r"\s+", " ", sig_basis).encode("utf-8","ignore")).hexdigest()
-
-                if sig in seen_signatures:
-                    print(f"⚠️ Duplicate page content: {final_url}")
-                    continue
-                seen_signatures.add(sig)
-
-                # low-quality filter
-                if any(p in url.lower() for p in LOW_QUALITY_PATTERNS):
-                    print(f"⚠️ Low-quality pattern hit: {url}")
-                    # do NOT block traversal; still discover links
-                else:
-                    results.append({
-                        "url": final_url,
-                        "depth": depth,
-                        "kind": "html",
-                        "text": text,
-                        "html": html,
-                        "markdown": content_md,
-                        "jsonld": jsonld,
-                    })
-                    print(f"✅ Saved page (words={len(text.split())}): {url}")
-
-                # depth limit
-                if depth >= max_depth:
-                    continue
-
-                # discover + print next-layer links
-                links = extract_links(url, html)
-
-                if links:
-                    print("🔗 Links found:")
-                    for l in links[:50]:
-                        print("   -", l)
-
-                for link in links:
-                    if link in visited or link in enqueued:
-                        continue
-                    if normalize_compare_url(link) in ignored_urls:
-                        continue
-                    if same_domain_only and not same_domain(link, base_netloc):
-                        continue
-                    if is_recursive_path(link):
-                        continue
-                    if "/pages/frames/" in link and "frame=i" in link and "family=" not in link:
-                        continue
-
-                    # Collapse redirect aliases; if resolved URL is already known, skip
-                    resolved = None if '#' in link else resolve_head(link, timeout=3.0)
-                    if resolved and (resolved in visited or resolved in enqueued):
-                        continue
-
-                    queue.append((link, depth + 1))
-                    enqueued.add(link) 
-
-                # simple guardrail to avoid runaway queues
-                if len(results) + len(queue) > max_pages * 2:
-                    queue[:] = queue[:max_pages]
+        files_client = httpx.AsyncClient(
+            verify=False,
+            follow_redirects=True,
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            headers={"User-Agent": DEFAULT_UA},
+        )
+        async with AsyncWebCrawler(config=browser_cfg) as crawler, RedirectResolver() as resolver, files_client:
+            async def _worker(worker_id: int):
+                config = _run_config(f"intelligent-crawl-{worker_id}")
+                while True:
+                    url, depth = await frontier.get()
+                    try:
+                        if len(results) >= max_pages:
+                            page_limit_reached.set()
+                            continue
+                        await _crawl_page(crawler, frontier, politeness, resolver, files_client, url, depth, config)
+                    except Exception as e:
+                        print(f"❌ Crawl worker error on {url}: {e}")
+                    finally:
+                        frontier.task_done()
+                        if progress is not None:
+                            crawled = min(len(results), max_pages)
+                            progress(crawled, min(len(frontier), max_pages - crawled))
+
+            async def _wait_cancelled():
+                # cancel_event is set from another thread, so it is polled rather than awaited
+                while not cancel_event.is_set():
+                    await asyncio.sleep(0.5)
+
+            worker_tasks = [asyncio.create_task(_worker(i)) for i in range(max(1, workers))]
+            stop_tasks = [asyncio.create_task(frontier.join()), asyncio.create_task(page_limit_reached.wait())]
+            if cancel_event is not None:
+                stop_tasks.append(asyncio.create_task(_wait_cancelled()))
+            await asyncio.wait(stop_tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in worker_tasks + stop_tasks:
+                task.cancel()
+            await asyncio.gather(*worker_tasks, *stop_tasks, return_exceptions=True)
 
     # run the async crawler
-    asyncio.run(_run())
-
-    combined_text = "\n\n".join(
-        item["text"] for item in results if item.get("text")
-    ).strip()
+    try:
+        asyncio.run(_run())
+        if cancel_event is not None and cancel_event.is_set():
+            raise ScrapeCancelled(f"Crawl of {start_url} was cancelled after {len(results)} pages")
+        # pages that were not reached any more are forgotten, unless the crawl stopped at max_pages
+        if len(results) < max_pages:
+            page_store.prune(site_key, visited)
+    except BaseException:
+        results.close()
+        raise
+    finally:
+        page_store.close()
 
     return {
         "pages": results,
         "urls_seen": urls_seen_ordered,
-        "combined_text": combined_text,
-        "site_meta": site_meta or {"site_title": "", "site_description": "", "favicon": urljoin(f"{urlparse(start_url).scheme}://{urlparse(start_url).netloc}", "/favicon.ico")}
+        "unchanged_pages": len(unchanged_pages),
+        "site_meta": site_meta or {"site_title": "", "site_description": "", "favicon": _default_favicon(start_url)}
     }
@@ -0,0 +1,123 @@
+from cachetools import TTLCache
+from typing import BinaryIO, Iterable, Optional
+from dotenv import load_dotenv
+import glob, os, tempfile, threading, uuid
+
+# ---------- Load environment variables ----------
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env'))
+
+# ---------- Variables ----------
+# Seconds a scrape session (its URL and combined text) is kept after it was last stored
+SCRAPE_SESSION_TTL = int(os.getenv("SCRAPE_SESSION_TTL", "86400"))
+# Disk used by the combined texts of all sessions, the least recently used are deleted past it
+SCRAPE_SESSION_MAX_MB = int(os.getenv("SCRAPE_SESSION_MAX_MB", "256"))
+# Folder where the combined texts of sessions are kept as files, defaults to a folder in the temp folder
+SCRAPE_SESSION_DIR = os.getenv("SCRAPE_SESSION_DIR") or os.path.join(tempfile.gettempdir(), "scrape_sessions")
+# Session URLs are tiny, they are kept for the TTL up to this many sessions
+SESSION_URL_LIMIT = 100_000
+
+_TEXT_SUFFIX = ".session.txt"
+_WRITE_BUFFER_BYTES = 1024 * 1024
+
+def _remove(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+class _TextFiles(TTLCache):
+    """TTL cache of (path, size) text files bounded by their total size, whose files are deleted when evicted or expired."""
+    def __init__(self, maxsize: int, ttl: int):
+        super().__init__(maxsize=maxsize, ttl=ttl, getsizeof=lambda entry: entry[1])
+
+    def popitem(self):
+        key, entry = super().popitem()
+        _remove(entry[0])
+        return key, entry
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for _, entry in expired:
+            _remove(entry[0])
+        return expired
+
+class ScrapeSessionStore:
+    """
+    Sessions handed out by /api/scrape: the scraped URL, and for a fresh scrape its combined text.
+    URLs are kept SCRAPE_SESSION_TTL seconds. The combined text is streamed to a file in SCRAPE_SESSION_DIR, so it is
+    never held in memory; files expire after the same time and the least recently used are deleted once they take more
+    than SCRAPE_SESSION_MAX_MB, so readers must handle open_text() returning None, e.g. by reading the vector store.
+    """
+    def __init__(self, max_bytes: int = SCRAPE_SESSION_MAX_MB * 1024 * 1024, ttl: int = SCRAPE_SESSION_TTL, directory: str = SCRAPE_SESSION_DIR):
+        self.ttl = ttl
+        self.directory = directory
+        self._urls = TTLCache(maxsize=SESSION_URL_LIMIT, ttl=ttl)
+        self._texts = _TextFiles(max_bytes, ttl)
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        # texts of a previous process can not be reached any more
+        for path in glob.glob(os.path.join(directory, "*" + _TEXT_SUFFIX)):
+            _remove(path)
+
+    def put(self, session_id: str, url: str, texts: Optional[Iterable[str]] = None):
+        """Store a session. texts (e.g. PageSpool.iter_text()) are streamed to its file, joined by blank lines."""
+        with self._lock:
+            self._texts.expire()
+            self._urls[session_id] = url
+        if texts is None:
+            return
+        path = self._write_text(texts)
+        if path is None:
+            return
+        size = os.path.getsize(path)
+        with self._lock:
+            try:
+                self._texts[session_id] = (path, size)
+            except ValueError:
+                # larger than the whole store, the text will be rebuilt from the vector store instead
+                _remove(path)
+
+    def url(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            return self._urls.get(session_id)
+
+    def open_text(self, session_id: str) -> Optional[BinaryIO]:
+        """The session's combined text as an open UTF-8 file, the caller closes it. None when deleted or expired."""
+        with self._lock:
+            entry = self._texts.get(session_id)
+            if entry is None:
+                return None
+            # opened under the lock, so an eviction can only unlink the file once it is open
+            try:
+                return open(entry[0], "rb")
+            except OSError:
+                return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._urls),
+                "texts": len(self._texts),
+                "text_bytes": self._texts.currsize,
+            }
+
+    def _write_text(self, texts: Iterable[str]) -> Optional[str]:
+        path = os.path.join(self.directory, uuid.uuid4().hex + _TEXT_SUFFIX)
+        written = False
+        try:
+            with open(path, "w", encoding="utf-8", buffering=_WRITE_BUFFER_BYTES) as f:
+                for text in texts:
+                    text = (text or "").strip()
+                    if not text:
+                        continue
+                    if written:
+                        f.write("\n\n")
+                    f.write(text)
+                    written = True
+        except OSError as e:
+            print(f"[SESSIONS] Could not write the combined text: {e}")
+            written = False
+        if not written:
+            _remove(path)
+            return None
+        return path
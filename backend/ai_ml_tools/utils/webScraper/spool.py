@@ -0,0 +1,78 @@
+from typing import Dict, Iterator, List, Optional
+import json, os, tempfile, threading
+
+# Crawl results are spooled to a JSONL file in SCRAPE_SPOOL_DIR (the temp folder by default) while the crawl runs
+SPOOL_DIR = os.getenv("SCRAPE_SPOOL_DIR") or None
+
+class PageSpool:
+    """
+    Results of one crawl, written to a JSONL file as pages are produced so a large site never has to fit in memory.
+    Only a summary of each page (url, depth, kind, title and text length) is kept in memory, iter_pages() reads the
+    full records back in crawl order. At most max_pages pages are kept, append() refuses the rest.
+    Close the spool (or use it as a context manager) to delete the file.
+    """
+    def __init__(self, max_pages: Optional[int] = None, directory: Optional[str] = SPOOL_DIR):
+        self.max_pages = max_pages
+        self.summaries: List[Dict] = []
+        self._lock = threading.Lock()
+        self._file = tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", prefix="crawl-", suffix=".jsonl", dir=directory, delete=False
+        )
+        self.path = self._file.name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.summaries)
+
+    def append(self, page: Dict) -> bool:
+        """Write a page record to the spool. Returns False when the spool already holds max_pages pages."""
+        with self._lock:
+            if self.max_pages is not None and len(self.summaries) >= self.max_pages:
+                return False
+            self._file.write(json.dumps(page, ensure_ascii=False) + "\n")
+            self.summaries.append({
+                "url": page.get("url"),
+                "depth": page.get("depth"),
+                "kind": page.get("kind"),
+                "title": page.get("title") or "",
+                "chars": len(page.get("text") or ""),
+            })
+        return True
+
+    def iter_pages(self) -> Iterator[Dict]:
+        """Full page records in crawl order, read one at a time from the spool."""
+        with self._lock:
+            self._file.flush()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def iter_text(self) -> Iterator[str]:
+        """Text of each page that has text, in crawl order (the parts of the combined text)."""
+        for page in self.iter_pages():
+            if page.get("text"):
+                yield page["text"]
+
+    def text_sample(self, max_chars: int) -> str:
+        """Start of the combined text, reading only as many pages as needed."""
+        parts, size = [], 0
+        for text in self.iter_text():
+            parts.append(text)
+            size += len(text) + 2
+            if size >= max_chars:
+                break
+        return "\n\n".join(parts).strip()[:max_chars]
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,71 @@
+'''
+Compare the old header-only splitter with the structure-aware chunker on Document Intelligence markdown.
+
+Run it from the backend folder with the markdown of a document (result.content of a prebuilt-layout analysis):
+    python -m dev_tools.benchmark_chunking document.md --queries queries.json
+
+queries.json is an optional list of {"question": "...", "answer": "..."} where answer is a short piece of text that the
+right chunk contains, e.g. a permit number. Retrieval quality is measured with the BM25 ranking only, so no Azure
+calls are made.
+
+Reported per chunker: chunk count, chunk sizes in tokens, chunks over the embedding model's input limit, embedding
+requests and tokens needed to embed the document, and hit rate and prompt tokens at k for the queries.
+'''
+from ai_ml_tools.utils.chunking import chunk_markdown
+from ai_ml_tools.utils.retrieval import BM25Index
+from ai_ml_tools.utils.tokenizer import count_tokens
+import argparse
+import json
+import math
+import statistics
+
+# Input limit of text-embedding-3-large, longer chunks are rejected or truncated
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+
+def header_chunks(content: str) -> list[str]:
+    from langchain_text_splitters import MarkdownHeaderTextSplitter
+    splitter = MarkdownHeaderTextSplitter(headers_to_split_on=[("#", "Header 1"), ("##", "Header 2"), ("###", "Header 3")])
+    return [split.page_content for split in splitter.split_text(content)]
+
+def structured_chunks(content: str) -> list[str]:
+    return [chunk["text"] for chunk in chunk_markdown(content)]
+
+def report(name: str, chunks: list[str], queries: list[dict], k: int, batch_size: int):
+    sizes = [count_tokens(chunk) for chunk in chunks]
+    print(f"\n== {name} ==")
+    print(f"Chunks: {len(chunks)}")
+    if sizes:
+        print(f"Tokens per chunk: min {min(sizes)}, median {int(statistics.median(sizes))}, max {max(sizes)}")
+    print(f"Chunks over the embedding input limit: {sum(size > EMBEDDING_MAX_INPUT_TOKENS for size in sizes)}")
+    print(f"Embedding requests (batches of {batch_size}): {math.ceil(len(chunks) / batch_size)}, tokens embedded: {sum(sizes)}")
+
+    if queries and chunks:
+        index = BM25Index(chunks)
+        hits = 0
+        context_tokens = []
+        for query in queries:
+            top = [position for position, _ in index.search(query["question"], k)]
+            hits += any(query["answer"].lower() in chunks[position].lower() for position in top)
+            context_tokens.append(sum(sizes[position] for position in top))
+        print(f"Hit rate at k={k}: {hits}/{len(queries)} ({hits / len(queries):.0%}), average prompt tokens: {int(statistics.mean(context_tokens))}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("markdown", help="Markdown content of an analyzed document")
+    parser.add_argument("--queries", help="JSON list of {question, answer}")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    with open(args.markdown, encoding="utf-8") as f:
+        content = f.read()
+    queries = []
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            queries = json.load(f)
+
+    report("Header splitter (previous)", header_chunks(content), queries, args.k, args.batch_size)
+    report("Structure-aware chunker", structured_chunks(content), queries, args.k, args.batch_size)
+
+if __name__ == "__main__":
+    main()
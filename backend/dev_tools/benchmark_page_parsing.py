@@ -0,0 +1,117 @@
+'''
+Compare the previous BeautifulSoup page processing of the web scraper (one html.parser parse per helper) with the
+single lxml parse of parse_page, on saved pages.
+
+Save some pages first, e.g. from the DFO Pacific site:
+    curl -sL -o pages/index.html https://www.pac.dfo-mpo.gc.ca/index-eng.html
+then run it from the backend folder (beautifulsoup4 is only needed for the comparison):
+    python -m dev_tools.benchmark_page_parsing pages/*.html --base-url https://www.pac.dfo-mpo.gc.ca/ --repeat 5
+
+Reported per implementation: total and per page time. The outputs are also compared, links and JSON-LD should
+match exactly and body text should only differ in whitespace.
+'''
+from ai_ml_tools.utils.webScraper.html_parse import parse_page, normalizeUrl
+from urllib.parse import urljoin
+import argparse
+import json
+import re
+import time
+
+def previous_processing(html: str, base_url: str) -> dict:
+    '''The helpers scrape.py used before parse_page, each building its own BeautifulSoup.'''
+    from bs4 import BeautifulSoup
+
+    def extract_fragment_id_links():
+        soup = BeautifulSoup(html, "html.parser")
+        out = []
+        for a in soup.find_all("a", href=True):
+            href = a["href"].strip()
+            if href.startswith("#") and len(href) > 1:
+                out.append(normalizeUrl(urljoin(base_url, href)))
+                continue
+            if href == "#" and a.get("id"):
+                out.append(normalizeUrl(urljoin(base_url, "#" + a["id"].strip())))
+        return out
+
+    def extract_links():
+        soup = BeautifulSoup(html, "html.parser")
+        links = []
+        for a in soup.find_all("a", href=True):
+            href = a["href"].strip()
+            if not href or href.startswith(("mailto:", "javascript:")):
+                continue
+            links.append(normalizeUrl(urljoin(base_url, href)))
+        links.extend(extract_fragment_id_links())
+        return links
+
+    def extract_jsonld():
+        soup = BeautifulSoup(html, "html.parser")
+        out = []
+        for s in soup.find_all("script", attrs={"type": lambda t: t and "ld+json" in t.lower()}):
+            raw = (s.string or s.get_text() or "").strip()
+            if not raw:
+                continue
+            try:
+                raw = re.sub(r"/\*.*?\*/", "", raw, flags=re.S)
+                raw = re.sub(r"^\s*//.*?$", "", raw, flags=re.M)
+                data = json.loads(re.sub(r",\s*([}\]])", r"\1", raw))
+                out.extend(data if isinstance(data, list) else [data])
+            except Exception:
+                pass
+        return out
+
+    def extract_meta():
+        soup = BeautifulSoup(html, "html.parser")
+        title = soup.title.string.strip() if soup.title and soup.title.string else ""
+        tag = soup.select_one('meta[name="description" i]') or soup.select_one('meta[property="og:description" i]')
+        descr = (tag.get("content") or "").strip() if tag else ""
+        icons = soup.select('link[rel*="icon" i]')
+        return {"title": title, "description": descr, "favicon": urljoin(base_url, icons[0].get("href")) if icons else ""}
+
+    def extract_text():
+        body = BeautifulSoup(html, "html.parser").body
+        soup = BeautifulSoup(str(body) if body else "", "html.parser")
+        for tag in soup(["script", "style"]):
+            tag.extract()
+        cleaned = soup.get_text(separator="\n")
+        return "\n".join(line.strip() for line in cleaned.splitlines() if line.strip())
+
+    return {"links": extract_links(), "jsonld": extract_jsonld(), "meta": extract_meta(), "text": extract_text()}
+
+def time_parser(name: str, parse, pages: list[str], base_url: str, repeat: int) -> list[dict]:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        outputs = [parse(html, base_url) for html in pages]
+    seconds = (time.perf_counter() - started) / repeat
+    print(f"{name}: {seconds * 1000:.1f} ms for {len(pages)} pages, {seconds * 1000 / max(len(pages), 1):.2f} ms per page")
+    return outputs
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages", nargs="+", help="Saved HTML pages")
+    parser.add_argument("--base-url", default="https://www.pac.dfo-mpo.gc.ca/")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = []
+    for path in args.pages:
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            pages.append(f.read())
+    print(f"{len(pages)} pages, {sum(len(html) for html in pages) / 1e6:.1f} MB of HTML")
+
+    single = time_parser("parse_page (lxml, one parse)", parse_page, pages, args.base_url, args.repeat)
+    try:
+        previous = time_parser("Previous helpers (BeautifulSoup html.parser)", previous_processing, pages, args.base_url, args.repeat)
+    except ImportError:
+        print("beautifulsoup4 is not installed, skipping the comparison.")
+        return
+
+    for path, new, old in zip(args.pages, single, previous):
+        differences = [key for key in ("links", "jsonld") if new[key] != old[key]]
+        if new["text"].split() != old["text"].split():
+            differences.append("text")
+        if differences:
+            print(f"{path}: outputs differ in {', '.join(differences)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+'''
+Local fake Azure OpenAI server for testing the LLM scheduler and rate limit handling without using real quota.
+
+Run it with:
+    uvicorn dev_tools.fake_openai_server:app --port 8010
+
+Then point the backend at it in ai_ml_tools/.env:
+    OPENAI_API_ENDPOINT = "http://localhost:8010/"
+    OPENAI_API_KEY = "fake"
+
+Each deployment gets its own token and request buckets (FAKE_TPM, FAKE_RPM). Requests over budget get a 429 with
+Retry-After headers, every response carries x-ratelimit-remaining-* headers like Azure does. FAKE_LATENCY sets the
+seconds before the first token and FAKE_TOKEN_DELAY the seconds between streamed tokens.
+'''
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+FAKE_TPM = int(os.getenv("FAKE_TPM", "30000"))
+FAKE_RPM = int(os.getenv("FAKE_RPM", "60"))
+FAKE_LATENCY = float(os.getenv("FAKE_LATENCY", "0.5"))
+FAKE_TOKEN_DELAY = float(os.getenv("FAKE_TOKEN_DELAY", "0.02"))
+FAKE_EMBEDDING_DIMENSIONS = int(os.getenv("FAKE_EMBEDDING_DIMENSIONS", "3072"))
+FAKE_ANSWER = "This is a fake answer from the local test server. Source: fake.pdf, Page: 1"
+
+app = FastAPI()
+
+_buckets = {}
+
+'''
+Take tokens and one request from the deployment's buckets. Returns (allowed, retry_after_seconds, remaining_tokens, remaining_requests).
+'''
+def _take_budget(deployment: str, tokens: int):
+    now = time.monotonic()
+    bucket = _buckets.setdefault(deployment, {"tokens": float(FAKE_TPM), "requests": float(FAKE_RPM), "updated": now})
+    elapsed = now - bucket["updated"]
+    bucket["tokens"] = min(FAKE_TPM, bucket["tokens"] + elapsed * FAKE_TPM / 60)
+    bucket["requests"] = min(FAKE_RPM, bucket["requests"] + elapsed * FAKE_RPM / 60)
+    bucket["updated"] = now
+
+    if bucket["tokens"] < tokens or bucket["requests"] < 1:
+        wait = max((tokens - bucket["tokens"]) * 60 / FAKE_TPM, (1 - bucket["requests"]) * 60 / FAKE_RPM, 1)
+        return False, wait, bucket["tokens"], bucket["requests"]
+
+    bucket["tokens"] -= tokens
+    bucket["requests"] -= 1
+    return True, 0, bucket["tokens"], bucket["requests"]
+
+def _rate_limit_headers(remaining_tokens: float, remaining_requests: float) -> dict:
+    return {
+        "x-ratelimit-remaining-tokens": str(int(max(0, remaining_tokens))),
+        "x-ratelimit-remaining-requests": str(int(max(0, remaining_requests))),
+    }
+
+'''
+Rough token count (4 characters per token), good enough for budgeting fake requests.
+'''
+def _estimate_tokens(value) -> int:
+    return max(1, len(json.dumps(value)) // 4)
+
+def _rate_limited_response(retry_after: float, remaining_tokens: float, remaining_requests: float) -> JSONResponse:
+    headers = _rate_limit_headers(remaining_tokens, remaining_requests)
+    headers["retry-after"] = str(int(retry_after + 0.999))
+    headers["retry-after-ms"] = str(int(retry_after * 1000))
+    return JSONResponse(
+        status_code=429,
+        content={"error": {"code": "429", "message": f"Rate limit is exceeded. Try again in {int(retry_after + 0.999)} seconds."}},
+        headers=headers,
+    )
+
+'''
+Build an answer matching a json_schema response format, every string field gets the fake answer.
+'''
+def _fake_structured_answer(schema: dict):
+    if schema.get("type") == "object":
+        return {name: _fake_structured_answer(field) for name, field in schema.get("properties", {}).items()}
+    if schema.get("type") == "array":
+        return [_fake_structured_answer(schema.get("items", {}))]
+    return FAKE_ANSWER
+
+@app.post("/openai/deployments/{deployment}/chat/completions")
+async def chat_completions(deployment: str, request: Request):
+    body = await request.json()
+    prompt_tokens = _estimate_tokens(body.get("messages", []))
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        answer = json.dumps(_fake_structured_answer(response_format["json_schema"]["schema"]))
+    else:
+        answer = FAKE_ANSWER
+    completion_tokens = max(1, len(answer) // 4)
+
+    allowed, retry_after, remaining_tokens, remaining_requests = _take_budget(deployment, prompt_tokens + completion_tokens)
+    if not allowed:
+        return _rate_limited_response(retry_after, remaining_tokens, remaining_requests)
+    headers = _rate_limit_headers(remaining_tokens, remaining_requests)
+
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": 0},
+    }
+    await asyncio.sleep(FAKE_LATENCY)
+
+    if not body.get("stream"):
+        return JSONResponse({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": deployment,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": answer}}],
+            "usage": usage,
+        }, headers=headers)
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    async def events():
+        words = answer.split(" ")
+        for index, word in enumerate(words):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": deployment,
+                "choices": [{"index": 0, "delta": {"content": word + (" " if index < len(words) - 1 else "")}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(FAKE_TOKEN_DELAY)
+        final = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": deployment,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        yield f"data: {json.dumps(final)}\n\n"
+        if include_usage:
+            usage_chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": deployment,
+                           "choices": [], "usage": usage}
+            yield f"data: {json.dumps(usage_chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+@app.post("/openai/deployments/{deployment}/embeddings")
+async def embeddings(deployment: str, request: Request):
+    body = await request.json()
+    inputs = body.get("input", [])
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    tokens = sum(_estimate_tokens(text) for text in inputs)
+
+    allowed, retry_after, remaining_tokens, remaining_requests = _take_budget(deployment, tokens)
+    if not allowed:
+        return _rate_limited_response(retry_after, remaining_tokens, remaining_requests)
+
+    await asyncio.sleep(FAKE_LATENCY)
+    data = []
+    for index, text in enumerate(inputs):
+        rng = random.Random(str(text))
+        data.append({"object": "embedding", "index": index, "embedding": [rng.uniform(-1, 1) for _ in range(FAKE_EMBEDDING_DIMENSIONS)]})
+    return JSONResponse({
+        "object": "list",
+        "data": data,
+        "model": deployment,
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }, headers=_rate_limit_headers(remaining_tokens, remaining_requests))
@@ -0,0 +1,101 @@
+'''
+Throttling tests of the LLM scheduler against the fake Azure OpenAI server (dev_tools/fake_openai_server.py), which is
+started in a background thread. No real quota is used.
+
+Run from the backend folder:
+    python -m pytest dev_tools/test_llm_scheduler.py
+'''
+from concurrent.futures import ThreadPoolExecutor
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+from openai import AzureOpenAI, RateLimitError
+
+from dev_tools import fake_openai_server
+from ai_ml_tools.utils.llm_scheduler import LLMScheduler, ReservationCallback, PRIORITY_BATCH
+
+# Fake server budget: a bucket of FAKE_TPM tokens refilled at FAKE_TPM / 60 tokens per second
+FAKE_TPM = 6000
+API_VERSION = "2025-01-01-preview"
+
+@pytest.fixture(scope="module")
+def endpoint():
+    fake_openai_server.FAKE_TPM = FAKE_TPM
+    fake_openai_server.FAKE_RPM = 1000
+    fake_openai_server.FAKE_LATENCY = 0
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(fake_openai_server.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}/"
+    server.should_exit = True
+    thread.join(5)
+
+'''
+A user message that the fake server counts as exactly `tokens` tokens, answer included.
+'''
+def _messages(tokens: int) -> list:
+    answer_tokens = max(1, len(fake_openai_server.FAKE_ANSWER) // 4)
+    overhead = len('[{"role": "user", "content": ""}]')
+    return [{"role": "user", "content": "x" * ((tokens - answer_tokens) * 4 - overhead)}]
+
+'''
+Four concurrent requests that together need slightly more than the fake server's bucket, through a scheduler that
+does not know the server's budget. The request that gets a 429 pauses the deployment for the Retry-After time, and
+every request still completes after one retry.
+'''
+def test_rate_limit_pauses_deployment(endpoint):
+    deployment = "fake-rate-limited"
+    scheduler = LLMScheduler(budgets={deployment: {"tpm": 1_000_000, "rpm": 1000, "max_concurrency": 4}})
+    client = AzureOpenAI(azure_endpoint=endpoint, api_key="fake", api_version=API_VERSION, max_retries=0)
+    tokens = FAKE_TPM // 4 + 30  # 120 tokens over the bucket, about a 1.2 second wait at the refill rate
+    rate_limited = []
+    paused_for = []
+
+    def call():
+        for _ in range(3):
+            with scheduler.reserve_sync(deployment, tokens, PRIORITY_BATCH) as reservation:
+                try:
+                    raw_response = client.chat.completions.with_raw_response.create(model=deployment, messages=_messages(tokens))
+                except RateLimitError as e:
+                    rate_limited.append(e)
+                    reservation.report_rate_limited(e)
+                    paused_for.append(scheduler.stats()[deployment]["paused_for"])
+                    continue
+                reservation.update_from_headers(raw_response.headers)
+                return raw_response.parse()
+        raise AssertionError("request was still rate limited after retrying")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        responses = list(executor.map(lambda _: call(), range(4)))
+
+    assert len(responses) == 4
+    assert len(rate_limited) == 1
+    assert 0.5 < paused_for[0] <= 2
+
+'''
+A LangChain chat model built with include_response_headers reports the server's remaining budget to the scheduler
+through ReservationCallback, and its real token usage refunds the reservation's estimate.
+'''
+def test_langchain_reports_headers(endpoint):
+    from langchain_openai import AzureChatOpenAI
+
+    deployment = "fake-langchain"
+    scheduler = LLMScheduler(budgets={deployment: {"tpm": 1_000_000, "rpm": 1000, "max_concurrency": 4}})
+    llm = AzureChatOpenAI(
+        azure_endpoint=endpoint, api_key="fake", api_version=API_VERSION, azure_deployment=deployment,
+        max_retries=0, include_response_headers=True,
+    )
+    with scheduler.reserve_sync(deployment, 2000, PRIORITY_BATCH) as reservation:
+        llm.invoke("Hello", config={"callbacks": [ReservationCallback(reservation)]})
+
+    assert reservation.used_tokens is not None and reservation.used_tokens < 2000
+    # the scheduler's own budget is far larger, the server's remaining tokens header lowered it
+    assert scheduler.stats()[deployment]["tokens_available"] < FAKE_TPM + 2000
@@ -631,6 +631,20 @@ export function WebScraper() {
     return null;
   };
 
+  // Follows a background scrape job until it is finished, resolves with its last progress message
+  const waitForScrapeJob = (jobId) => new Promise((resolve, reject) => {
+    const protocol = window.location.protocol === "https:" ? "wss" : "ws";
+    const ws = new WebSocket(`${protocol}://${window.location.host}/api/ws/scrape_jobs/${jobId}`);
+    let last = null;
+    ws.onmessage = (ev) => {
+      try { last = JSON.parse(ev.data); } catch { return; }
+      if (last.error && !last.status) { ws.close(); reject(new Error(last.error)); }
+      if (["done", "error", "cancelled"].includes(last.status)) ws.close();
+    };
+    ws.onclose = () => (last && last.status ? resolve(last) : reject(new Error("connection closed")));
+    ws.onerror = () => reject(new Error("connection failed"));
+  });
+
   const runScrape = async (url, force = false) => {
     flushSync(() => {
       setScrapeInProgress(true);
@@ -675,6 +689,19 @@ export function WebScraper() {
         return;
       }
 
+      // A new scrape runs as a background job, wait for it before refreshing the presets
+      if (r.status === 202 && j?.job_id) {
+        const job = await waitForScrapeJob(j.job_id);
+        if (job.status === "error" && job.error?.reason === "unreachable") {
+          setAddErr("We couldn't reach that website. It may be down or blocked.");
+          return;
+        }
+        if (job.status !== "done") {
+          setAddErr("The scrape did not finish. Please try again later.");
+          return;
+        }
+      }
+
       await reload();
     } catch {
       setAddErr("Scrape started. Please return later and refresh presets.");